@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+### Connection latency benchmark - measures the time to connect and the
+### latency of the first order sent afterwards under each connection setting
+### (plain TCP with and without TCP_NODELAY, TLS with a full handshake on
+### every connection and TLS resuming the previous session on reconnect),
+### against a local server answering every message (the TLS certificate is
+### generated with the openssl command line tool):
+###     python3 benchmarks/connect_latency.py [--runs N]
+
+# Standard library imports
+import argparse
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Local imports
+from pysmartt.smartt_client import SmarttClient
+from pysmartt.smartt_connection import SmarttConnectionConfig
+
+
+# Answers every message with an order id, as send_order does
+def serveConnection(connection):
+    with connection:
+        data = b""
+        while True:
+            received = connection.recv(4096)
+            if not received:
+                return
+            data += received
+            while b"$" in data:
+                data = data.split(b"$", 1)[1]
+                connection.sendall(b"send_order;1$")
+
+
+def startServer(ssl_context=None):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(64)
+
+    def accept():
+        while True:
+            (connection, _) = listener.accept()
+            # Only the client side setting is measured
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if ssl_context is not None:
+                try:
+                    connection = ssl_context.wrap_socket(connection,
+                                                         server_side=True)
+                except (ssl.SSLError, OSError):
+                    connection.close()
+                    continue
+            threading.Thread(target=serveConnection, args=(connection,),
+                             daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def serverSslContext(directory):
+    certificate = os.path.join(directory, "certificate.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.check_call(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+         "-keyout", key, "-out", certificate, "-days", "1",
+         "-subj", "/CN=localhost"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certificate, key)
+    return context
+
+
+def sendFirstOrder(client):
+    start = time.perf_counter()
+    client.sendOrder("paper", None, 0, "PETR4", None, 1, 10.0)
+    return time.perf_counter() - start
+
+
+# Returns the connect and first order latencies of each run
+def measure(port, use_ssl, config, runs, reconnect):
+    connects = []
+    orders = []
+    reused = 0
+    client = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        if reconnect and client is not None:
+            client.reconnect()
+        else:
+            if client is not None:
+                client.close()
+            client = SmarttClient("127.0.0.1", port, use_ssl=use_ssl,
+                                  connection_config=config)
+        connects.append(time.perf_counter() - start)
+        orders.append(sendFirstOrder(client))
+        reused += client.tlsSessionReused()
+    client.close()
+    return (connects, orders, reused)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        plain_port = startServer()
+        tls_port = startServer(serverSslContext(directory))
+
+        settings = [
+            ("tcp", plain_port, False,
+             SmarttConnectionConfig(tcp_nodelay=False), False),
+            ("tcp nodelay", plain_port, False,
+             SmarttConnectionConfig(tcp_nodelay=True), False),
+            ("tls full handshake", tls_port, True,
+             SmarttConnectionConfig(reuse_tls_session=False), True),
+            ("tls resumed session", tls_port, True,
+             SmarttConnectionConfig(reuse_tls_session=True), True)
+        ]
+        print("%-22s %14s %18s %8s" % ("setting", "connect (ms)",
+                                       "first order (ms)", "resumed"))
+        for (name, port, use_ssl, config, reconnect) in settings:
+            (connects, orders, reused) = measure(port, use_ssl, config,
+                                                 args.runs, reconnect)
+            print("%-22s %14.3f %18.3f %8d" % (name, median(connects) * 1000,
+                                               median(orders) * 1000,
+                                               reused))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
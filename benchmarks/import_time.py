@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+### Import time benchmark - measures the time taken to import the pysmartt
+### modules in a fresh interpreter and checks that the modules which should
+### only be loaded on demand aren't imported; exits with an error if any
+### check fails, so it can be used to guard against regressions:
+###     python benchmarks/import_time.py [--runs N] [--max-ms MS]
+
+# Standard library imports
+import argparse
+import os
+import subprocess
+import sys
+
+
+# Modules measured, with the modules they must not import
+MODULES = {
+    "pysmartt": ["pkg_resources", "ssl"],
+    "pysmartt.smartt_client": ["pkg_resources", "ssl"],
+    "pysmartt.console": ["pkg_resources", "ssl", "getpass"]
+}
+
+MEASURE_CODE = """
+import sys, time
+start = time.time()
+import %s
+elapsed = time.time() - start
+print(repr((elapsed, sorted(name for name in %r if name in sys.modules))))
+"""
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module, forbidden):
+    output = subprocess.check_output(
+        [sys.executable, "-c", MEASURE_CODE % (module, forbidden)],
+        cwd=ROOT_DIRECTORY)
+    return eval(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="fail if the median import time is higher")
+    args = parser.parse_args()
+
+    failed = False
+    for (module, forbidden) in sorted(MODULES.items()):
+        times = []
+        loaded = []
+        for _ in range(args.runs):
+            (elapsed, loaded) = measure(module, forbidden)
+            times.append(elapsed * 1000)
+        times.sort()
+        median = times[len(times) // 2]
+
+        print("%-24s min %7.2fms  median %7.2fms" % (module, times[0],
+                                                     median))
+        if loaded:
+            print("    loaded on import: %s" % ", ".join(loaded))
+            failed = True
+        if args.max_ms is not None and median > args.max_ms:
+            print("    median above %.2fms" % args.max_ms)
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
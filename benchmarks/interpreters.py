@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+### Interpreters benchmark - runs the same client workload (receiving,
+### parsing and formatting getTrades responses and encoding order messages,
+### over an in memory connection) under each given interpreter, so the
+### speedups of newer CPython releases (or other implementations) can be
+### compared on this code:
+###     python3 benchmarks/interpreters.py [--rows N] [--runs N] python3.8 ...
+
+# Standard library imports
+import argparse
+import os
+import subprocess
+import sys
+
+
+WORKLOAD_CODE = """
+import sys, time
+from pysmartt.smartt_client import SmarttClient
+from pysmartt.smartt_simple_protocol import SmarttSimpleProtocol
+
+rows = %d
+runs = %d
+row = ["1", "123", "paper", "1", "0", "0", "PETR4", "Bovespa",
+       "2015-01-02 10:00:00", "100", "10.50", "1050.00", "0.01", "0.02",
+       "0.03", "0.00", "0.00", "0.00"]
+response = (";".join(row * rows) + "$").encode("latin1")
+
+class Connection(object):
+    def __init__(self):
+        self.pending = b""
+    def recv(self, size):
+        data = self.pending[:size]
+        self.pending = self.pending[size:]
+        return data
+    def send(self, data):
+        self.pending = response
+        return len(data)
+
+connection = Connection()
+client = SmarttClient.__new__(SmarttClient)
+client.lazy_lists = False
+client.response_format = "dicts"
+client.protocol = SmarttSimpleProtocol(connection.recv, connection.send)
+
+results = {}
+best = None
+for _ in range(runs):
+    start = time.perf_counter()
+    client.protocol.send(["get_trades", "brokerage_id=1"])
+    client.formatListOfDictsResponse(client.protocol.receive(), None,
+                                     SmarttClient.getTradesAttributes)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+results["get_trades_rows_per_s"] = rows / best
+
+best = None
+for _ in range(runs):
+    start = time.perf_counter()
+    for _ in range(1000):
+        client.protocol.send(["send_order"] +
+                             client.formatString("investment_code", "paper") +
+                             client.formatBoolean("order_type", 0) +
+                             client.formatString("stock_code", "PETR4") +
+                             client.formatInteger("number_of_stocks", 100) +
+                             client.formatDecimal2("price", 10.5))
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+results["send_order_messages_per_s"] = 1000 / best
+
+print(repr((sys.version.split()[0], results)))
+"""
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(interpreter, rows, runs):
+    output = subprocess.check_output(
+        [interpreter, "-c", WORKLOAD_CODE % (rows, runs)],
+        cwd=ROOT_DIRECTORY)
+    return eval(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("interpreters", nargs="*", default=[sys.executable])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = None
+    for interpreter in args.interpreters:
+        (version, results) = measure(interpreter, args.rows, args.runs)
+        if baseline is None:
+            baseline = results
+        print("%s (%s)" % (interpreter, version))
+        for (name, value) in sorted(results.items()):
+            print("    %-28s %12.0f  %5.2fx" % (name, value,
+                                               value / baseline[name]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+### Row building benchmark - measures the time to build getTrades results
+### from a flat response in each response format (see smartt_schema), lazy
+### and under each decoding policy, compared to the generic builder used
+### before the schemas (slicing and zipping each row):
+###     python3 benchmarks/row_building.py [--rows N] [--runs N]
+### The default format (eager dicts) only takes about 0.5-0.8 of the time of
+### the generic builder, as most of it goes to allocating the dicts; row
+### objects take about 0.3-0.5 and columns about 0.1, but only for callers
+### which use them (the modules of the package accept any format, converting
+### the rows to dicts - see smartt_schema.iterDicts)
+
+# Standard library imports
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Local imports
+from pysmartt.smartt_client import SmarttClient
+from pysmartt.smartt_simple_protocol import SmarttSimpleProtocol
+
+
+ROW = ["1", "123", "paper", "1", "0", "0", "PETR4", "Bovespa",
+       "2015-01-02 10:00:00", "100", "10.50", "1050.00", "0.01", "0.02",
+       "0.03", "0.00", "0.00", "0.00"]
+
+
+# The builder used before the schemas
+def genericBuild(values, attributes):
+    k = len(attributes)
+    return [dict(zip(attributes, values[i:i + k]))
+            for i in range(0, len(values), k)]
+
+
+def best(function, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    attributes = SmarttClient.getTradesAttributes
+    values = ROW * args.rows
+    client = SmarttClient.__new__(SmarttClient)
+    client.protocol = SmarttSimpleProtocol(None, None)
+
+    baseline = best(lambda: genericBuild(values, attributes), args.runs)
+    print("%-36s %10.1f ms" % ("generic dicts", baseline * 1000))
+    for policy in SmarttSimpleProtocol.DECODE_POLICIES:
+        client.protocol.decode_policy = policy
+        for (responseFormat, lazy) in [("dicts", False), ("dicts", True),
+                                       ("rows", False), ("columns", False)]:
+            client.response_format = responseFormat
+            client.lazy_lists = lazy
+
+            def build():
+                rows = client.formatListOfDictsResponse(values, None,
+                                                        attributes)
+                if lazy:
+                    for _ in rows:
+                        pass
+
+            elapsed = best(build, args.runs)
+            name = "%s %s%s" % (policy, responseFormat,
+                                " (lazy)" if lazy else "")
+            print("%-36s %10.1f ms  %5.2fx" % (name, elapsed * 1000,
+                                               elapsed / baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,2 @@
-# Magic line that makes everything work! :)
-# This allows me to run the application script directly from the package
-# directory - I still don't understand how it works
-# Got it from here: https://github.com/srid/modern-package-template
-__import__('pkg_resources').declare_namespace(__name__)
+# pysmartt - Smartt Python Client (a plain package: importing it loads
+# nothing, each module is imported on its own)
@@ -1,12 +1,19 @@
 
 ### Standard library imports
 from cmd import Cmd
-import getpass
+import csv
+import datetime
+import itertools
+import json
+import os
 import re
+import sys
+import threading
 
 ### Local imports
-from smartt_client import SmarttClient
-from smartt_client import SmarttClientException
+from .smartt_client import SmarttClient
+from .smartt_client import SmarttClientException
+from .smartt_schema import FORMAT_DICTS
 
 
 HEADERCOLORCODE = "\033[95m"
@@ -24,37 +31,159 @@ class SmarttConsole(Cmd):
     ### Configurations ###
     ######################
     prompt = "smartt> "
+    # How lists of results are printed: "tree" (one field per line) or
+    # "table" (one row per line, streamed as the response is received - see
+    # streamedFunctions)
+    output_mode = "tree"
+    # Columns printed in table mode (requested as the return attributes),
+    # all of them if None
+    columns = None
+    # Rows printed before waiting for the user (0 for no paging)
+    page_size = 0
+    # Rows written at once in table mode when not paging
+    table_chunk_size = 500
+    # Columns of the last function called, for printing tables
+    table_columns = None
+    # Functions returning lists of rows, whose responses are read as a
+    # stream in table mode (never kept whole in memory)
+    streamedFunctions = ["getOrders", "getOrdersEvents", "getStopOrders",
+                         "getStopOrdersEvents", "getTrades", "getPortfolio",
+                         "getAvailableLimits", "getFinancialTransactions"]
 
     def preloop(self):
         self.smartt_client = SmarttClient(use_ssl=False)
     ##########################################################################
 
     def splitArgs(self, arg):
-        extracted_values = re.findall('("([^"]*)")|(\S+)', arg)
+        extracted_values = re.findall(r'("([^"]*)")|(\S+)', arg)
         values = [(value[2] if value[0] == "" else value[1])
                   for value in extracted_values]
         return values
 
+    ### Parses "name=value" arguments into the keyword arguments of a client
+    ### function - names may be given as in the protocol (snake case) or as
+    ### in the client (camel case), and values are converted according to
+    ### the parameter name (datetimes, dates and attribute lists)
+    def parseParameters(self, function, arg):
+        code = function.__code__
+        parameter_names = code.co_varnames[1:code.co_argcount]
+        parameters = {}
+        for argument in self.splitArgs(arg):
+            if "=" not in argument:
+                raise SmarttClientException("Invalid parameter (expected "
+                                            "name=value): " + argument)
+            (name, value) = argument.split("=", 1)
+            name = re.sub("_([a-z0-9])", lambda m: m.group(1).upper(), name)
+            if name not in parameter_names:
+                raise SmarttClientException("Invalid parameter: " + name)
+            parameters[name] = self.parseValue(name, value)
+        return parameters
+
+    def parseValue(self, name, value):
+        if name == "returnAttributes":
+            return value.split(",")
+        if name.endswith("atetime"):
+            value = value.replace("T", " ")
+            for datetime_format in ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M",
+                                    "%Y-%m-%d"]:
+                try:
+                    return datetime.datetime.strptime(value, datetime_format)
+                except ValueError:
+                    pass
+            raise SmarttClientException("Invalid datetime: " + value)
+        if name in ["validity", "birthday"]:
+            try:
+                return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+            except ValueError:
+                raise SmarttClientException("Invalid date: " + value)
+        return value
+
+    ### Calls a client function with the "name=value" arguments
+    ### (in table mode, the rows of the streamed functions are built while
+    ### their response is received and printed, and the selected columns are
+    ### used as the return attributes)
+    def callFunction(self, function, arg):
+        parameters = self.parseParameters(function, arg)
+
+        self.table_columns = (parameters.get("returnAttributes") or
+                              self.columns or
+                              getattr(self.smartt_client,
+                                      function.__name__ + "Attributes", None))
+        if (self.output_mode == "table" and self.columns and
+                "returnAttributes" in function.__code__.co_varnames):
+            parameters.setdefault("returnAttributes", self.columns)
+
+        if (self.output_mode != "table" or
+                function.__name__ not in self.streamedFunctions):
+            return function(**parameters)
+
+        message = getattr(self.smartt_client,
+                          function.__name__ + "Message")(**parameters)
+        attributes = getattr(self.smartt_client,
+                             function.__name__ + "Attributes")
+        schema = self.smartt_client.schemas.schema(
+            parameters.get("returnAttributes") or attributes, attributes)
+        # The rest of the response is read if the printing stops early (see
+        # SmarttClient.streamMessage)
+        return schema.stream(self.smartt_client.streamMessage(message),
+                             FORMAT_DICTS, self.smartt_client.textTranscoder())
+
     def printValue(self, value):
         if isinstance(value, dict):
-            for (name, value) in value.iteritems():
-                print "%s: %s" % (name, value)
+            for (name, value) in value.items():
+                print("%s: %s" % (name, value))
         elif isinstance(value, list):
             index = 0
             for element in value:
-                print str(index) + ":"
+                print(str(index) + ":")
                 self.printValue(element)
                 index += 1
-                print ""
+                print("")
         else:
-            print value
+            print(value)
+
+    ### Prints rows as a table, with the column widths taken from the first
+    ### rows, writing a chunk of rows at a time
+    def printTable(self, rows):
+        rows = iter(rows)
+        chunk_size = self.page_size or self.table_chunk_size
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            print("(no results)")
+            return
+
+        columns = [column for column in (self.table_columns or [])
+                   if column in chunk[0]] or sorted(chunk[0])
+        widths = [max([len(column)] + [len(str(row.get(column, "")))
+                                       for row in chunk])
+                  for column in columns]
+        line_format = "  ".join("%%-%ds" % width for width in widths)
+
+        sys.stdout.write(
+            (line_format % tuple(columns)).rstrip() + "\n" +
+            (line_format % tuple("-" * width for width in widths)) + "\n")
+        while chunk:
+            sys.stdout.write("".join(
+                (line_format % tuple(row.get(column, "")
+                                     for column in columns)).rstrip() + "\n"
+                for row in chunk))
+            sys.stdout.flush()
+
+            if self.page_size and sys.stdin.isatty():
+                if input("-- more (q to quit) --").strip() == "q":
+                    return
+            chunk = list(itertools.islice(rows, chunk_size))
 
     def printResponse(self, response):
-        print BLUECOLORCODE
+        print(BLUECOLORCODE)
 
-        self.printValue(response)
+        if (self.output_mode == "table" and
+                not isinstance(response, (dict, str, bytes, int))):
+            self.printTable(response)
+        else:
+            self.printValue(response)
 
-        print ENDOFCOLORCODE
+        print(ENDOFCOLORCODE)
 
     ##########################################################################
     ### Smartt Functions ###
@@ -62,12 +191,15 @@ class SmarttConsole(Cmd):
     def do_login(self, arg):
         splitted_args = self.splitArgs(arg)
         if len(splitted_args) == 0:
-            print "Login not specified"
+            print("Login not specified")
             return
 
         username = splitted_args[0]
 
-        print "Logging in as '%s'" % username
+        # Only needed here, and slow to import (terminal handling modules)
+        import getpass
+
+        print("Logging in as '%s'" % username)
         password = getpass.getpass()
 
         self.printResponse(self.smartt_client.login(username, password))
@@ -96,9 +228,8 @@ class SmarttConsole(Cmd):
             self.smartt_client.getStock(stock_code, market_name, attributes))
 
     def do_send_order(self, arg):
-        splitted_args = self.splitArgs(arg)
-
-        print "Not implemented"
+        self.printResponse(
+            self.callFunction(self.smartt_client.sendOrder, arg))
 
     def do_cancel_order(self, arg):
         splitted_args = self.splitArgs(arg)
@@ -108,14 +239,12 @@ class SmarttConsole(Cmd):
         self.printResponse(self.smartt_client.cancelOrder(order_id))
 
     def do_change_order(self, arg):
-        splitted_args = self.splitArgs(arg)
-
-        print "Not implemented"
+        self.printResponse(
+            self.callFunction(self.smartt_client.changeOrder, arg))
 
     def do_send_stop_order(self, arg):
-        splitted_args = self.splitArgs(arg)
-
-        print "Not implemented"
+        self.printResponse(
+            self.callFunction(self.smartt_client.sendStopOrder, arg))
 
     def do_cancel_stop_order(self, arg):
         splitted_args = self.splitArgs(arg)
@@ -125,39 +254,53 @@ class SmarttConsole(Cmd):
         self.printResponse(self.smartt_client.cancelStopOrder(stop_order_id))
 
     def do_get_orders(self, arg):
-        splitted_args = self.splitArgs(arg)
-
-        self.printResponse(self.smartt_client.getOrders())
+        self.printResponse(
+            self.callFunction(self.smartt_client.getOrders, arg))
 
     def do_get_orders_events(self, arg):
-        splitted_args = self.splitArgs(arg)
-
-        self.printResponse(self.smartt_client.getOrdersEvents())
+        self.printResponse(
+            self.callFunction(self.smartt_client.getOrdersEvents, arg))
 
     def do_get_stop_orders(self, arg):
-        splitted_args = self.splitArgs(arg)
-
-        self.printResponse(self.smartt_client.getStopOrders())
+        self.printResponse(
+            self.callFunction(self.smartt_client.getStopOrders, arg))
 
     def do_get_stop_orders_events(self, arg):
-        splitted_args = self.splitArgs(arg)
-
-        self.printResponse(self.smartt_client.getStopOrdersEvents())
+        self.printResponse(
+            self.callFunction(self.smartt_client.getStopOrdersEvents, arg))
 
     def do_get_trades(self, arg):
-        splitted_args = self.splitArgs(arg)
-
-        self.printResponse(self.smartt_client.getTrades())
+        self.printResponse(
+            self.callFunction(self.smartt_client.getTrades, arg))
 
     def do_get_portfolio(self, arg):
-        splitted_args = self.splitArgs(arg)
-
-        self.printResponse(self.smartt_client.getPortfolio())
+        self.printResponse(
+            self.callFunction(self.smartt_client.getPortfolio, arg))
 
     def do_get_available_limits(self, arg):
-        splitted_args = self.splitArgs(arg)
+        self.printResponse(
+            self.callFunction(self.smartt_client.getAvailableLimits, arg))
+    ##########################################################################
 
-        self.printResponse(self.smartt_client.getAvailableLimits())
+    ##########################################################################
+    ### Output settings ###
+    #######################
+    def do_output(self, arg):
+        if arg.strip() not in ["tree", "table"]:
+            raise SmarttClientException("Output mode must be 'tree' or "
+                                        "'table'")
+        self.output_mode = arg.strip()
+
+    def do_columns(self, arg):
+        self.columns = [column for column in re.split(r"[,\s]+", arg)
+                        if column] or None
+
+    def do_page_size(self, arg):
+        try:
+            self.page_size = max(int(arg), 0)
+        except ValueError:
+            raise SmarttClientException("Page size must be a number (0 for "
+                                        "no paging)")
     ##########################################################################
 
     ##########################################################################
@@ -166,14 +309,15 @@ class SmarttConsole(Cmd):
     def do_message(self, arg):
         message = self.splitArgs(arg)
         self.smartt_client.sendMessage(message)
-        print self.smartt_client.receiveMessage()
+        print(self.smartt_client.receiveMessage())
 
     def do_query(self, arg):
         self.do_message(arg)
 
     def do_rawmessage(self, arg):
         self.smartt_client.sendRawMessage(arg)
-        print self.smartt_client.receiveRawMessage()
+        print(self.smartt_client.receiveRawMessage().decode(
+            self.smartt_client.protocol.SERVER_ENCODING))
 
     def do_rawquery(self, arg):
         self.do_rawmessage(arg)
@@ -182,7 +326,7 @@ class SmarttConsole(Cmd):
     ### Quitting commands ###
     #########################
     def do_EOF(self, arg):
-        print ""
+        print("")
         return True
 
     def do_quit(self, arg):
@@ -200,7 +344,7 @@ class SmarttConsole(Cmd):
         try:
             return Cmd.onecmd(self, line)
         except SmarttClientException as e:
-            print REDCOLORCODE + str(e) + ENDOFCOLORCODE
+            print(REDCOLORCODE + str(e) + ENDOFCOLORCODE)
             return False
 
     def emptyline(self):
@@ -217,12 +361,202 @@ class SmarttConsole(Cmd):
 ##############################################################################
 
 
+##############################################################################
+### SmarttBatchConsole class - runs console commands without printing,
+### keeping the response of the command instead; errors are raised to the
+### caller instead of printed
+class SmarttBatchConsole(SmarttConsole):
+
+    # Commands which make no sense in batch mode (sessions are handled by
+    # the batch runner, and the others print to the output of the results)
+    forbiddenCommands = ["login", "logout", "EOF", "quit", "exit", "help",
+                         "message", "query", "rawmessage", "rawquery"]
+    # Commands changing the settings of the console, which only apply to the
+    # commands run on the same connection (see SmarttBatchRunner)
+    settingsCommands = ["output", "columns", "page_size"]
+    # The results are kept whole, for the batch runner to write them
+    streamedFunctions = []
+
+    ### Init function - allow_settings is whether the settings commands
+    ### are allowed (only when all the commands run on this console)
+    def __init__(self, smartt_client, allow_settings=True):
+        SmarttConsole.__init__(self)
+        self.smartt_client = smartt_client
+        self.allow_settings = allow_settings
+        self.response = None
+
+    def execute(self, line):
+        (command, arg, line) = self.parseline(line)
+        if command in self.forbiddenCommands:
+            raise SmarttClientException("Command not allowed in batch mode: "
+                                        + command)
+        if command in self.settingsCommands and not self.allow_settings:
+            raise SmarttClientException("Command not allowed with more than "
+                                        "one connection: " + command)
+
+        self.response = None
+        Cmd.onecmd(self, line)
+        return self.response
+
+    def printResponse(self, response):
+        self.response = response
+
+    def default(self, line):
+        raise SmarttClientException("Unknown command: " + line)
+
+##############################################################################
+
+
+##############################################################################
+### SmarttBatchRunner class - runs a sequence of console commands (one per
+### line) over a pool of connections, each command on the first free one,
+### writing the results in the commands order as soon as they're available,
+### as JSON (one object per line) or CSV (one value per line)
+class SmarttBatchRunner(object):
+
+    OUTPUT_FORMATS = ["json", "csv"]
+
+    ### Init function - client_factory must return a new logged in client
+    def __init__(self, client_factory, connections=1, output_format="json",
+                 output=sys.stdout):
+        if output_format not in self.OUTPUT_FORMATS:
+            raise ValueError("Invalid output format: " + output_format)
+
+        self.client_factory = client_factory
+        self.connections = connections
+        self.output_format = output_format
+        self.output = output
+        self.local = threading.local()
+        self.csv_writer = None
+        # Clients of the pool threads, closed when the run ends
+        self.clients = []
+        self.clients_lock = threading.Lock()
+
+    def run(self, lines):
+        # Slow to import, only needed in batch mode
+        from multiprocessing.pool import ThreadPool
+
+        commands = ((index, line.strip()) for (index, line)
+                    in enumerate(lines, 1)
+                    if line.strip() and not line.strip().startswith("#"))
+
+        pool = ThreadPool(self.connections)
+        try:
+            for result in pool.imap(self.execute, commands):
+                self.write(result)
+        finally:
+            pool.close()
+            pool.join()
+            self.closeClients()
+
+    # Runs in the pool threads, each one with its own connection
+    def execute(self, command):
+        (index, line) = command
+        result = {"line": index, "command": line}
+        try:
+            if not hasattr(self.local, "console"):
+                client = self.client_factory()
+                with self.clients_lock:
+                    self.clients.append(client)
+                self.local.console = SmarttBatchConsole(
+                    client, self.connections == 1)
+            result["result"] = self.local.console.execute(line)
+        except (SmarttClientException, Exception) as e:
+            result["error"] = str(e)
+        return result
+
+    # Logs out and closes the connections of the pool threads
+    def closeClients(self):
+        with self.clients_lock:
+            (clients, self.clients) = (self.clients, [])
+        for client in clients:
+            try:
+                client.logout()
+            except (SmarttClientException, Exception):
+                pass
+            finally:
+                client.close()
+
+    def write(self, result):
+        if self.output_format == "json":
+            self.output.write(json.dumps(result) + "\n")
+        else:
+            self.writeCsv(result)
+        self.output.flush()
+
+    def writeCsv(self, result):
+        if self.csv_writer is None:
+            self.csv_writer = csv.writer(self.output)
+            self.csv_writer.writerow(["line", "command", "row", "field",
+                                      "value"])
+
+        prefix = [result["line"], result["command"]]
+        if "error" in result:
+            rows = [["", "error", result["error"]]]
+        elif isinstance(result["result"], dict):
+            rows = [["", name, value]
+                    for (name, value) in result["result"].items()]
+        elif isinstance(result["result"], list):
+            rows = [[index, name, value]
+                    for (index, row) in enumerate(result["result"])
+                    for (name, value) in row.items()]
+        else:
+            rows = [["", "", result["result"]]]
+
+        self.csv_writer.writerows([prefix + row for row in rows])
+
+##############################################################################
+
+
 ##############################################################################
 ### Main function - application starting point ###
 ##################################################
 def main():
-    smartt_console = SmarttConsole()
-    smartt_console.cmdloop("Welcome to the Smartt Client Console!")
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Smartt Client Console")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run the commands in FILE ('-' for the standard "
+                             "input) instead of the interactive console")
+    parser.add_argument("--format", choices=SmarttBatchRunner.OUTPUT_FORMATS,
+                        default="json", help="batch output format")
+    parser.add_argument("--connections", type=int, default=1,
+                        help="number of connections used in batch mode")
+    parser.add_argument("--login", help="login used in batch mode (the "
+                        "password is read from SMARTT_PASSWORD or asked)")
+    parser.add_argument("--host", default="smartt.s10i.com.br")
+    parser.add_argument("--port", type=int, default=5060)
+    parser.add_argument("--ssl", action="store_true",
+                        help="use SSL in batch mode")
+    args = parser.parse_args()
+
+    if args.batch is None:
+        smartt_console = SmarttConsole()
+        smartt_console.cmdloop("Welcome to the Smartt Client Console!")
+        return
+
+    if args.login is None:
+        parser.error("--login is needed in batch mode")
+    password = os.environ.get("SMARTT_PASSWORD")
+    if password is None:
+        import getpass
+        password = getpass.getpass()
+
+    def client_factory():
+        client = SmarttClient(args.host, args.port, use_ssl=args.ssl)
+        try:
+            client.login(args.login, password)
+        except (SmarttClientException, Exception):
+            client.close()
+            raise
+        return client
+
+    runner = SmarttBatchRunner(client_factory, args.connections, args.format)
+    if args.batch == "-":
+        runner.run(sys.stdin)
+    else:
+        with open(args.batch) as batch_file:
+            runner.run(batch_file)
 ##############################################################################
 
 
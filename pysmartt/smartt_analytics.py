@@ -0,0 +1,299 @@
+
+# Standard library imports
+import bisect
+import datetime
+import warnings
+
+# Third party imports - NumPy is an optional dependency, only needed by this
+# module
+try:
+    import numpy
+    from numpy.lib.stride_tricks import as_strided
+except ImportError:
+    numpy = None
+
+# Local imports
+from .smartt_client import SmarttClientException
+from .smartt_simple_protocol import decodeToken
+
+
+# Format of the daily series returned in the daily_cumulative_performance
+# and daily_drawdown attributes: "date=value" points separated by commas,
+# e.g. "2024-01-02=0.5,2024-01-03=0.7" (the dates may have a time)
+POINTS_SEPARATOR = ","
+POINT_SEPARATOR = "="
+DATE_FORMATS = ["%Y-%m-%d", "%Y-%m-%d %H:%M:%S"]
+
+
+def parseDate(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    raise SmarttClientException("Invalid date in daily series: " + value)
+
+
+### Parses a daily series (text or bytes, see POINTS_SEPARATOR) into a list
+### of dates and a list of values; only surrounding whitespace is ignored,
+### so a point not in the format raises SmarttClientException
+def parseDailySeries(series):
+    series = decodeToken(series).strip()
+    dates = []
+    values = []
+    if not series:
+        return (dates, values)
+
+    for point in series.split(POINTS_SEPARATOR):
+        (date, separator, value) = point.rpartition(POINT_SEPARATOR)
+        if not separator:
+            raise SmarttClientException("Invalid daily series point: " +
+                                        point)
+        dates.append(parseDate(date.strip()))
+        try:
+            values.append(float(value))
+        except ValueError:
+            raise SmarttClientException("Invalid daily series value: " +
+                                        point)
+    return (dates, values)
+
+
+### The dates and values of a series given as text (see parseDailySeries),
+### as a dict of values by date or as a (dates, values) pair
+def dailySeries(series):
+    if isinstance(series, (str, bytes)):
+        return parseDailySeries(series)
+    if isinstance(series, dict):
+        dates = sorted(series)
+        return (dates, [float(series[date]) for date in dates])
+    (dates, values) = series
+    return (list(dates), [float(value) for value in values])
+
+
+# Rolling windows view of the columns of a 2D array, without copying:
+# result[i, j] holds array[i, j:j + window]
+def rollingWindows(array, window):
+    (rows, columns) = array.shape
+    count = max(columns - window + 1, 0)
+    return as_strided(array, shape=(rows, count, window),
+                      strides=(array.strides[0], array.strides[1],
+                               array.strides[1]), writeable=False)
+
+
+##############################################################################
+### SmarttDailyPanel class - daily series of many investments aligned by date
+### in a 2D array (one row per investment); new points are appended as new
+### columns, and the rolling metrics computed over the panel are cached and
+### only computed again for the columns changed since the last time
+class SmarttDailyPanel(object):
+
+    def __init__(self):
+        self.dates = []
+        self.investments = []
+        self.rows = {}
+        self.values = numpy.empty((0, 0))
+        # Rolling metrics cache: (metric, window) -> [values, valid columns]
+        self.cache = {}
+
+    ### Stores the points of the investment not stored yet; returns the
+    ### number of new points
+    def update(self, investment, dates, values):
+        if investment not in self.rows:
+            self.rows[investment] = len(self.investments)
+            self.investments.append(investment)
+            self.values = numpy.vstack(
+                [self.values, numpy.full((1, len(self.dates)), numpy.nan)])
+        row = self.rows[investment]
+
+        new_dates = sorted(set(dates).difference(self.dates))
+        if new_dates and self.dates and new_dates[0] < self.dates[-1]:
+            # Dates in the middle of the panel - rebuild the columns
+            all_dates = sorted(set(self.dates).union(new_dates))
+            columns = [bisect.bisect_left(all_dates, date)
+                       for date in self.dates]
+            rebuilt = numpy.full((len(self.investments), len(all_dates)),
+                                 numpy.nan)
+            rebuilt[:, columns] = self.values
+            self.values = rebuilt
+            self.dates = all_dates
+            # The cached columns after the first new date have moved
+            self.invalidate(bisect.bisect_left(all_dates, new_dates[0]))
+        elif new_dates:
+            self.dates.extend(new_dates)
+            self.values = numpy.hstack(
+                [self.values, numpy.full((len(self.investments),
+                                          len(new_dates)), numpy.nan)])
+
+        new_points = 0
+        first_changed = None
+        for (date, value) in zip(dates, values):
+            column = bisect.bisect_left(self.dates, date)
+            if numpy.isnan(self.values[row, column]):
+                new_points += 1
+            if self.values[row, column] != value:
+                self.values[row, column] = value
+                if first_changed is None or column < first_changed:
+                    first_changed = column
+
+        if first_changed is not None:
+            self.invalidate(first_changed)
+        return new_points
+
+    def invalidate(self, column):
+        for entry in self.cache.values():
+            entry[1] = min(entry[1], column)
+
+    def select(self, array, investments):
+        if investments is None:
+            return array
+        return array[[self.rows[investment] for investment in investments]]
+
+    ### Computes a rolling metric for every investment and date (NaN where
+    ### the window isn't complete), only for the columns not cached yet;
+    ### compute receives the rolling windows view and returns the metric
+    ### for each window
+    def rolling(self, name, window, source, compute):
+        (rows, columns) = source.shape
+        entry = self.cache.get((name, window))
+        if entry is None or entry[0].shape[0] != rows:
+            entry = [numpy.full((rows, 0), numpy.nan), 0]
+            self.cache[(name, window)] = entry
+
+        (cached, valid) = entry
+        if valid < columns or cached.shape[1] != columns:
+            valid = min(valid, cached.shape[1], columns)
+            start = max(valid - window + 1, 0)
+            result = numpy.full((rows, columns - valid), numpy.nan)
+            windows = rollingWindows(source[:, start:], window)
+            if windows.shape[1] > 0:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", RuntimeWarning)
+                    computed = compute(windows)
+                # The first computed window ends at column start + window - 1
+                offset = start + window - 1 - valid
+                result[:, max(offset, 0):] = computed[:, max(-offset, 0):]
+            cached = numpy.hstack([cached[:, :valid], result])
+            self.cache[(name, window)] = [cached, columns]
+        return cached
+
+##############################################################################
+
+
+##############################################################################
+### SmarttAnalytics class - derived metrics over the daily cumulative
+### performance and daily drawdown series of many investments at once,
+### vectorized with NumPy and cached incrementally (see SmarttDailyPanel);
+### the cumulative performance values are multiplied by "scale" to get
+### fractions (e.g. 0.01 if the server reports percentages)
+class SmarttAnalytics(object):
+
+    def __init__(self, periods_per_year=252, scale=1.0):
+        if numpy is None:
+            raise SmarttClientException("NumPy is needed for the analytics")
+
+        self.periods_per_year = periods_per_year
+        self.scale = scale
+        self.performance = SmarttDailyPanel()
+        self.drawdown = SmarttDailyPanel()
+
+    ##########################################################################
+    ### Loading ###
+    ###############
+
+    ### Downloads and stores the series of an investment; returns the number
+    ### of new points of each series
+    def load(self, client, investmentCode, brokerageId=None):
+        key = (investmentCode, brokerageId)
+        performance = client.getDailyCumulativePerformance(investmentCode,
+                                                           brokerageId)
+        drawdown = client.getDailyDrawdown(investmentCode, brokerageId)
+        return (
+            self.update(key, performance["daily_cumulative_performance"]),
+            self.updateDrawdown(key, drawdown["daily_drawdown"]))
+
+    ### Stores the points of a series of the investment (see dailySeries)
+    def update(self, investment, series):
+        return self.performance.update(investment, *dailySeries(series))
+
+    def updateDrawdown(self, investment, series):
+        return self.drawdown.update(investment, *dailySeries(series))
+    ##########################################################################
+
+    ##########################################################################
+    ### Metrics - 2D arrays with one row per investment (all of them, in the
+    ### order they were loaded, unless a list of investments is given) and
+    ### one column per date (see dates)
+    ##########################################################################
+    def dates(self):
+        return list(self.performance.dates)
+
+    def investments(self):
+        return list(self.performance.investments)
+
+    def wealth(self, investments=None):
+        return self.performance.select(
+            1 + self.performance.values * self.scale, investments)
+
+    def returns(self, investments=None):
+        wealth = self.wealth(investments)
+        returns = numpy.full(wealth.shape, numpy.nan)
+        returns[:, 1:] = wealth[:, 1:] / wealth[:, :-1] - 1
+        return returns
+
+    def rollingVolatility(self, window, investments=None):
+        factor = numpy.sqrt(self.periods_per_year)
+        return self.performance.select(self.performance.rolling(
+            "volatility", window, self.returns(),
+            lambda windows: numpy.nanstd(windows, axis=2, ddof=1) * factor),
+            investments)
+
+    def rollingSharpe(self, window, investments=None, risk_free=0.0):
+        factor = numpy.sqrt(self.periods_per_year)
+        excess = risk_free / self.periods_per_year
+
+        def compute(windows):
+            return ((numpy.nanmean(windows, axis=2) - excess) /
+                    numpy.nanstd(windows, axis=2, ddof=1) * factor)
+
+        return self.performance.select(self.performance.rolling(
+            ("sharpe", risk_free), window, self.returns(), compute),
+            investments)
+
+    # Maximum drawdown (as a positive fraction) within each window, computed
+    # from the cumulative performance
+    def rollingMaxDrawdown(self, window, investments=None):
+        def compute(windows):
+            peaks = numpy.maximum.accumulate(numpy.nan_to_num(windows),
+                                             axis=2)
+            return numpy.nanmax(1 - windows / peaks, axis=2)
+
+        return self.performance.select(self.performance.rolling(
+            "max_drawdown", window, self.wealth(), compute), investments)
+
+    # Worst value of the server daily drawdown series within each window
+    def rollingWorstDrawdown(self, window, investments=None):
+        return self.drawdown.select(self.drawdown.rolling(
+            "worst_drawdown", window, self.drawdown.values,
+            lambda windows: numpy.nanmax(numpy.abs(windows), axis=2)),
+            investments)
+
+    def sharpe(self, investments=None, risk_free=0.0):
+        returns = self.returns(investments)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return ((numpy.nanmean(returns, axis=1) -
+                     risk_free / self.periods_per_year) /
+                    numpy.nanstd(returns, axis=1, ddof=1) *
+                    numpy.sqrt(self.periods_per_year))
+
+    # Correlation matrix of the daily returns of the investments (over the
+    # last "window" days, if given), using the dates available for each pair
+    def correlation(self, investments=None, window=None):
+        returns = self.returns(investments)
+        if window is not None:
+            returns = returns[:, -window:]
+        return numpy.ma.corrcoef(numpy.ma.masked_invalid(returns)).filled(
+            numpy.nan)
+    ##########################################################################
+
+##############################################################################
@@ -0,0 +1,632 @@
+
+# Standard library imports
+import collections
+import csv
+import datetime
+import threading
+import time
+
+# Local imports
+from .smartt_client import SmarttClient, SmarttClientException
+from .smartt_simple_protocol import SmarttLazyTokens
+from .smartt_simple_protocol import SmarttSimpleProtocol
+
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+DATE_FORMAT = "%Y-%m-%d"
+
+# Order types, as sent by sendOrder
+BUY = 0
+SELL = 1
+
+# Statuses of the orders which may still be executed
+activeStatuses = frozenset(["hung", "partially_executed"])
+
+# Cost rates of the setup (see SmarttClient.updateSetup), as percentages of
+# the financial volume of each trade - except the income tax, charged over the
+# profit of the trades which close positions: trade attribute, position
+# trading rate and day trading rate
+tradeCostRates = [
+    ("trading_tax_cost", "position_trading_tax", "day_trade_trading_tax"),
+    ("liquidation_tax_cost", "position_liquidation_tax",
+     "day_trade_liquidation_tax"),
+    ("register_tax_cost", "position_register_tax", "day_trade_regiter_tax"),
+    ("income_tax_cost", "position_income_tax", "day_trade_income_tax"),
+    ("withholding_income_tax_cost", "position_withholding_income_tax",
+     "day_trade_withholding_income_tax"),
+    ("other_taxes_cost", "position_other_taxes", "day_trade_other_taxes")
+]
+
+
+### A market data point: a trade of "volume" stocks (None for unlimited) at
+### "price" in the market
+SmarttTick = collections.namedtuple("SmarttTick",
+                                    ["datetime", "stock_code", "price",
+                                     "volume"])
+
+
+### Loads the ticks of a CSV file (path or file object) with a header and
+### the datetime, stock_code and price columns - and optionally volume
+def loadTicks(source):
+    if isinstance(source, str):
+        with open(source, newline="") as csv_file:
+            return loadTicks(csv_file)
+
+    ticks = []
+    for row in csv.DictReader(source):
+        volume = row.get("volume")
+        ticks.append(SmarttTick(
+            datetime.datetime.strptime(row["datetime"], DATETIME_FORMAT),
+            row["stock_code"], float(row["price"]),
+            int(volume) if volume not in (None, "") else None))
+    return ticks
+
+
+def formatValue(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime):
+        return value.strftime(DATETIME_FORMAT)
+    if isinstance(value, datetime.date):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, float):
+        return "%.2f" % value
+    return str(value)
+
+
+def parseDatetime(value):
+    return datetime.datetime.strptime(value, DATETIME_FORMAT)
+
+
+##############################################################################
+### SmarttMatchingEngine class - simulated orders, executed against the market
+### ticks: a buy (sell) order is executed, at the tick price plus (minus) the
+### slippage and up to the tick volume, by any tick at or below (above) its
+### price; the costs are computed from the setup, as returned by getSetups
+class SmarttMatchingEngine(object):
+
+    def __init__(self, setup=None):
+        self.setup = dict((key, float(value))
+                          for (key, value) in (setup or {}).items()
+                          if key in SmarttClient.getSetupsAttributes and
+                          key not in ["name", "code", "income_tax_payment"]
+                          and value not in (None, ""))
+        self.orders = collections.OrderedDict()
+        self.events = []
+        self.trades = []
+        # Active orders ids per stock, the only ones checked for each tick
+        self.active_orders = collections.defaultdict(list)
+        # Positions per (investment, brokerage, stock): [signed number of
+        # stocks, average price, datetime of the trade which opened it]
+        self.positions = {}
+        # Money received (or paid, if negative) by the trades, costs
+        # included, per (investment, brokerage)
+        self.cash = collections.defaultdict(float)
+        self.last_prices = {}
+        self.order_ids = iter(range(1, 2 ** 31))
+
+    def rate(self, name):
+        return self.setup.get(name, 0.0) / 100
+
+    ##########################################################################
+    ### Orders ###
+    ##############
+    def sendOrder(self, now, investmentCode, brokerageId, orderType,
+                  stockCode, marketName, numberOfStocks, price,
+                  validityType=None, validity=None):
+        if numberOfStocks <= 0:
+            raise SmarttClientException("Invalid number of stocks: " +
+                                        str(numberOfStocks))
+        if price <= 0:
+            raise SmarttClientException("Invalid price: " + str(price))
+
+        orderId = next(self.order_ids)
+        self.orders[orderId] = {
+            "order_id": orderId,
+            "order_id_in_brokerage": orderId,
+            "investment_code": investmentCode,
+            "brokerage_id": brokerageId,
+            "is_real": 0,
+            "order_type": orderType,
+            "stock_code": stockCode,
+            "market_name": marketName,
+            "datetime": now,
+            "number_of_stocks": numberOfStocks,
+            "price": price,
+            "financial_volume": numberOfStocks * price,
+            "validity_type": validityType or "HJ",
+            "validity": validity,
+            "number_of_traded_stocks": 0,
+            "average_nominal_price": 0.0,
+            "status": "hung",
+            "absolute_brokerage_tax_cost": 0.0,
+            "percentual_brokerage_tax_cost": 0.0,
+            "iss_tax_cost": 0.0
+        }
+        self.active_orders[stockCode].append(orderId)
+        self.addEvent(now, self.orders[orderId], "order_sent")
+        return orderId
+
+    def cancelOrder(self, now, orderId):
+        order = self.activeOrder(orderId)
+        self.deactivate(order, "canceled"
+                        if order["number_of_traded_stocks"] == 0
+                        else "partially_canceled")
+        self.addEvent(now, order, "order_canceled")
+        return orderId
+
+    def changeOrder(self, now, orderId, newNumberOfStocks=None,
+                    newPrice=None):
+        order = self.activeOrder(orderId)
+        if newNumberOfStocks is not None:
+            if newNumberOfStocks <= order["number_of_traded_stocks"]:
+                raise SmarttClientException(
+                    "New number of stocks not above the traded ones: " +
+                    str(newNumberOfStocks))
+            order["number_of_stocks"] = newNumberOfStocks
+        if newPrice is not None:
+            order["price"] = newPrice
+        order["financial_volume"] = order["number_of_stocks"] * order["price"]
+        self.addEvent(now, order, "order_changed")
+        return orderId
+    ##########################################################################
+
+    ##########################################################################
+    ### Matching ###
+    ################
+
+    ### Executes the active orders of the tick stock crossed by it, oldest
+    ### first, and expires the orders whose validity ended
+    def processTick(self, tick):
+        self.last_prices[tick.stock_code] = tick.price
+        available = tick.volume
+        slippage = self.setup.get("slippage", 0.0)
+
+        for orderId in list(self.active_orders.get(tick.stock_code, [])):
+            order = self.orders[orderId]
+            if self.expired(order, tick.datetime):
+                self.deactivate(order, "expired")
+                self.addEvent(tick.datetime, order, "order_expired")
+                continue
+
+            if order["order_type"] == BUY:
+                crossed = tick.price <= order["price"]
+                price = min(tick.price + slippage, order["price"])
+            else:
+                crossed = tick.price >= order["price"]
+                price = max(tick.price - slippage, order["price"])
+            if not crossed or available == 0:
+                continue
+
+            quantity = order["number_of_stocks"] - \
+                order["number_of_traded_stocks"]
+            if available is not None:
+                quantity = min(quantity, available)
+                available -= quantity
+            self.execute(tick.datetime, order, quantity, price)
+
+    def expired(self, order, now):
+        if order["validity_type"] == "AC":
+            return False
+        if order["validity_type"] == "DE" and order["validity"] is not None:
+            return now.date() > order["validity"]
+        return now.date() > order["datetime"].date()
+
+    def execute(self, now, order, quantity, price):
+        traded = order["number_of_traded_stocks"]
+        order["average_nominal_price"] = (
+            (order["average_nominal_price"] * traded + price * quantity) /
+            (traded + quantity))
+        order["number_of_traded_stocks"] = traded + quantity
+
+        # Brokerage taxes are charged per order
+        volume = quantity * price
+        if traded == 0:
+            order["absolute_brokerage_tax_cost"] = \
+                self.setup.get("absolute_brokerage_tax", 0.0)
+        order["percentual_brokerage_tax_cost"] += \
+            volume * self.rate("percentual_brokerage_tax")
+        order["iss_tax_cost"] = self.rate("iss_tax") * (
+            order["absolute_brokerage_tax_cost"] +
+            order["percentual_brokerage_tax_cost"])
+
+        trade = {
+            "order_id": order["order_id"],
+            "trade_id_in_brokerage": len(self.trades) + 1,
+            "investment_code": order["investment_code"],
+            "brokerage_id": order["brokerage_id"],
+            "is_real": 0,
+            "trade_type": order["order_type"],
+            "stock_code": order["stock_code"],
+            "market_name": order["market_name"],
+            "datetime": now,
+            "number_of_stocks": quantity,
+            "price": price,
+            "financial_volume": volume
+        }
+        (day_trade, profit) = self.updatePosition(order, quantity, price, now)
+        for (attribute, positionRate, dayTradeRate) in tradeCostRates:
+            rate = self.rate(dayTradeRate if day_trade else positionRate)
+            base = max(profit, 0.0) if attribute == "income_tax_cost" \
+                else volume
+            trade[attribute] = base * rate
+        self.trades.append(trade)
+        self.cash[(order["investment_code"], order["brokerage_id"])] += (
+            (-volume if order["order_type"] == BUY else volume) -
+            sum(trade[attribute] for (attribute, _, _) in tradeCostRates))
+
+        if order["number_of_traded_stocks"] == order["number_of_stocks"]:
+            self.deactivate(order, "executed")
+        else:
+            order["status"] = "partially_executed"
+        self.addEvent(now, order, "order_executed")
+
+    # Updates the position with the trade, returning whether it closed
+    # stocks bought or sold in the same day and the profit of the closing
+    def updatePosition(self, order, quantity, price, now):
+        key = (order["investment_code"], order["brokerage_id"],
+               order["stock_code"])
+        (position, average, opened) = self.positions.get(key, (0, 0.0, now))
+        signed = quantity if order["order_type"] == BUY else -quantity
+
+        day_trade = False
+        profit = 0.0
+        if position * signed >= 0:
+            total = position + signed
+            average = (average * abs(position) + price * quantity) / abs(total)
+            if position == 0:
+                opened = now
+            position = total
+        else:
+            closed = min(quantity, abs(position))
+            profit = (price - average) * closed * (1 if position > 0 else -1)
+            day_trade = opened.date() == now.date()
+            position += signed
+            if position * signed > 0:
+                # Reversed the position
+                (average, opened) = (price, now)
+
+        if position == 0:
+            del self.positions[key]
+        else:
+            self.positions[key] = (position, average, opened)
+        return (day_trade, profit)
+    ##########################################################################
+
+    ##########################################################################
+    ### Helper functions ###
+    ########################
+    def activeOrder(self, orderId):
+        order = self.orders.get(orderId)
+        if order is None:
+            raise SmarttClientException("Order not found: " + str(orderId))
+        if order["status"] not in activeStatuses:
+            raise SmarttClientException("Order not active: " + str(orderId))
+        return order
+
+    def deactivate(self, order, status):
+        order["status"] = status
+        self.active_orders[order["stock_code"]].remove(order["order_id"])
+
+    def addEvent(self, now, order, eventType):
+        self.events.append({
+            "order_id": order["order_id"],
+            "investment_code": order["investment_code"],
+            "brokerage_id": order["brokerage_id"],
+            "number_of_events": len(self.events) + 1,
+            "datetime": now,
+            "event_type": eventType,
+            "description": order["status"]
+        })
+    ##########################################################################
+
+##############################################################################
+
+
+##############################################################################
+### SmarttBacktestClient class - a SmarttClient which doesn't connect to any
+### server: its messages are answered by a simulation, with a matching engine
+### fed by the given market ticks, so strategies can be tested with the same
+### API (sendOrder, cancelOrder, changeOrder, getOrders, getOrdersEvents,
+### getTrades, getPortfolio, getAvailableLimits, the stop orders reads -
+### always empty, stop orders aren't simulated - and the login functions,
+### so snapshot works as well); the ticks are replayed
+### "speed" times faster than real time, starting on the first request (and
+### processed as needed before each request), or only when advance or replay
+### are called if speed is None
+class SmarttBacktestClient(SmarttClient):
+
+    # Simulated functions (message names) and their handlers
+    simulatedFunctions = {
+        "login": "simulateLogin",
+        "logout": "simulateLogout",
+        "logged": "simulateLogged",
+        "send_order": "simulateSendOrder",
+        "cancel_order": "simulateCancelOrder",
+        "change_order": "simulateChangeOrder",
+        "get_orders": "simulateGetOrders",
+        "get_orders_events": "simulateGetOrdersEvents",
+        "get_trades": "simulateGetTrades",
+        "get_portfolio": "simulateGetPortfolio",
+        "get_available_limits": "simulateGetAvailableLimits",
+        "get_stop_orders": "simulateGetStopOrders",
+        "get_stop_orders_events": "simulateGetStopOrdersEvents"
+    }
+
+    ### Init function - ticks may be a list of SmarttTick or the path of a
+    ### CSV file (see loadTicks); setup holds the costs parameters (see
+    ### SmarttMatchingEngine); limits holds the initial available limits of
+    ### each investment (spot, option and margin), the spot one changed by
+    ### the trades and reserved by the active buy orders
+    def __init__(self, ticks, setup=None, speed=1000.0,
+                 decode_policy=SmarttSimpleProtocol.DECODE_ALL,
+                 risk_engine=None, latency_tracker=None, limits=None):
+        if isinstance(ticks, str):
+            ticks = loadTicks(ticks)
+        self.engine = SmarttMatchingEngine(setup)
+        self.limits = dict((name, float(value))
+                           for (name, value) in (limits or {}).items())
+        SmarttClient.__init__(self, host=None, port=None, use_ssl=False,
+                              decode_policy=decode_policy,
+                              risk_engine=risk_engine,
+                              latency_tracker=latency_tracker)
+        # The simulation takes the lock again while answering (see advance)
+        self.exchange_lock = threading.RLock()
+
+        self.ticks = sorted(ticks, key=lambda tick: tick.datetime)
+        self.next_tick = 0
+        self.speed = speed
+        self.start_time = self.ticks[0].datetime if self.ticks else None
+        self.current_time = self.start_time
+        self.wall_start = None
+        self.logged_in = False
+
+    ##########################################################################
+    ### Connection handling - nothing to connect to, only the protocol ###
+    ### (for its decode policy) ###
+    ###############################
+    def connect(self, tls_session=None):
+        self.smartt_socket = None
+        self.protocol = SmarttSimpleProtocol(None, None,
+                                             self.print_raw_messages,
+                                             self.decode_policy)
+
+    def close(self):
+        pass
+    ##########################################################################
+
+    ##########################################################################
+    ### Replay ###
+    ##############
+
+    ### Current simulated time
+    def now(self):
+        if self.speed is None or self.start_time is None:
+            return self.current_time
+        if self.wall_start is None:
+            self.wall_start = time.time()
+        return self.start_time + datetime.timedelta(
+            seconds=(time.time() - self.wall_start) * self.speed)
+
+    ### Processes the ticks up to the given simulated time (by default, the
+    ### current one); returns the number of processed ticks
+    def advance(self, until=None):
+        if until is None:
+            until = self.now()
+        processed = 0
+        with self.exchange_lock:
+            while (self.next_tick < len(self.ticks) and
+                   self.ticks[self.next_tick].datetime <= until):
+                self.processNextTick()
+                processed += 1
+            if until is not None and until > self.current_time:
+                self.current_time = until
+        return processed
+
+    ### Processes all the remaining ticks (up to "until", if given), calling
+    ### callback(client, tick) after each one, e.g. to run the strategy;
+    ### waits for the ticks times when there is a replay speed
+    def replay(self, callback=None, until=None):
+        while self.next_tick < len(self.ticks):
+            tick = self.ticks[self.next_tick]
+            if until is not None and tick.datetime > until:
+                break
+            if self.speed is not None:
+                delay = (tick.datetime - self.now()).total_seconds() / \
+                    self.speed
+                if delay > 0:
+                    time.sleep(delay)
+            with self.exchange_lock:
+                # The tick may have been processed by a request meanwhile
+                if (self.next_tick < len(self.ticks) and
+                        self.ticks[self.next_tick] is tick):
+                    self.processNextTick()
+            if callback is not None:
+                callback(self, tick)
+
+    def processNextTick(self):
+        tick = self.ticks[self.next_tick]
+        self.next_tick += 1
+        self.current_time = max(self.current_time, tick.datetime)
+        self.engine.processTick(tick)
+    ##########################################################################
+
+    ##########################################################################
+    ### Simulation ###
+    ##################
+
+    # Answers the message with the simulation instead of the server, errors
+    # included, returning the tokens as the protocol would (bytes, unless
+    # the decode policy is DECODE_ALL, or decoded when accessed with
+    # DECODE_LAZY)
+    def exchangeMessage(self, message):
+        with self.exchange_lock:
+            if self.speed is not None:
+                self.advance()
+            response = self.simulateMessage(message)
+        if self.protocol.decode_policy == SmarttSimpleProtocol.DECODE_ALL:
+            return response
+        response = [token.encode(self.protocol.SERVER_ENCODING)
+                    for token in response]
+        if self.protocol.decode_policy == SmarttSimpleProtocol.DECODE_LAZY:
+            return SmarttLazyTokens(response)
+        return response
+
+    # Nothing to pipeline or stream - the messages are answered in turn
+    def exchangeWindow(self, messages):
+        return [self.exchangeMessage(list(message)) for message in messages]
+
+    def streamMessage(self, message):
+        yield from self.checkResponse(self.requestMessage(list(message)))
+
+    def simulateMessage(self, message):
+        handler = self.simulatedFunctions.get(message[0])
+        if handler is None:
+            return ["ERROR", "Function not supported by the simulation: " +
+                    message[0]]
+        parameters = dict(token.split("=", 1) for token in message[1:])
+        try:
+            return getattr(self, handler)(parameters)
+        except SmarttClientException as e:
+            return ["ERROR", str(e)]
+
+    def simulateLogin(self, parameters):
+        self.logged_in = True
+        return ["Login successful"]
+
+    def simulateLogout(self, parameters):
+        self.logged_in = False
+        return ["Logout successful"]
+
+    def simulateLogged(self, parameters):
+        return ["yes" if self.logged_in else "no"]
+
+    def simulateSendOrder(self, parameters):
+        validity = parameters.get("validity")
+        orderId = self.engine.sendOrder(
+            self.current_time, parameters["investment_code"],
+            parameters.get("brokerage_id"), int(parameters["order_type"]),
+            parameters["stock_code"], parameters.get("market_name"),
+            int(parameters["number_of_stocks"]), float(parameters["price"]),
+            parameters.get("validity_type"),
+            datetime.datetime.strptime(validity, DATE_FORMAT).date()
+            if validity else None)
+        return ["send_order", str(orderId)]
+
+    def simulateCancelOrder(self, parameters):
+        return ["cancel_order", str(self.engine.cancelOrder(
+            self.current_time, int(parameters["order_id"])))]
+
+    def simulateChangeOrder(self, parameters):
+        newNumberOfStocks = parameters.get("new_number_of_stocks")
+        newPrice = parameters.get("new_price")
+        return ["change_order", str(self.engine.changeOrder(
+            self.current_time, int(parameters["order_id"]),
+            int(newNumberOfStocks) if newNumberOfStocks else None,
+            float(newPrice) if newPrice else None))]
+
+    def simulateGetOrders(self, parameters):
+        return self.formatRows(self.filterRows(
+            self.engine.orders.values(), parameters, "order_id",
+            "status"), parameters, self.getOrdersAttributes)
+
+    def simulateGetOrdersEvents(self, parameters):
+        return self.formatRows(self.filterRows(
+            self.engine.events, parameters, "order_id", "event_type"),
+            parameters, self.getOrdersEventsAttributes)
+
+    def simulateGetTrades(self, parameters):
+        return self.formatRows(self.filterRows(
+            self.engine.trades, parameters, "order_id"),
+            parameters, self.getTradesAttributes)
+
+    def simulateGetPortfolio(self, parameters):
+        rows = []
+        for ((investmentCode, brokerageId, stockCode),
+             (position, average, opened)) in \
+                self.engine.positions.items():
+            rows.append({
+                "investment_code": investmentCode,
+                "brokerage_id": brokerageId,
+                "stock_code": stockCode,
+                "position_type": "long" if position > 0 else "short",
+                "number_of_stocks": abs(position),
+                "average_price": average,
+                "financial_volume": abs(position) * average
+            })
+        return self.formatRows(self.filterRows(rows, parameters),
+                               parameters, self.getPortfolioAttributes)
+
+    # The spot limit is the initial one plus the money of the trades minus
+    # the amount of the active buy orders not traded yet
+    def simulateGetAvailableLimits(self, parameters):
+        key = [("investment_code", parameters.get("investment_code")),
+               ("brokerage_id", parameters.get("brokerage_id"))]
+        limits = dict((name, self.limits.get(name, 0.0))
+                      for name in self.getAvailableLimitsAttributes)
+        for ((investmentCode, brokerageId), cash) in self.engine.cash.items():
+            if self.matches(key, [investmentCode, brokerageId]):
+                limits["spot"] += cash
+        for order in self.engine.orders.values():
+            if (order["status"] in activeStatuses and
+                    order["order_type"] == BUY and
+                    self.matches(key, [order["investment_code"],
+                                       order["brokerage_id"]])):
+                limits["spot"] -= order["price"] * (
+                    order["number_of_stocks"] -
+                    order["number_of_traded_stocks"])
+        return self.formatRows([limits], parameters,
+                               self.getAvailableLimitsAttributes)
+
+    # Stop orders aren't simulated (send_stop_order is refused)
+    def simulateGetStopOrders(self, parameters):
+        return self.formatRows([], parameters, self.getStopOrdersAttributes)
+
+    def simulateGetStopOrdersEvents(self, parameters):
+        return self.formatRows([], parameters,
+                               self.getStopOrdersEventsAttributes)
+    ##########################################################################
+
+    ##########################################################################
+    ### Helper functions ###
+    ########################
+
+    # Selects the rows matching the investment, brokerage, date range and
+    # the other given filters (parameter names equal to the attributes)
+    def filterRows(self, rows, parameters, *filters):
+        filters = [(name, parameters[name]) for name in
+                   ("investment_code", "brokerage_id") + filters
+                   if name in parameters]
+        initial = parameters.get("initial_datetime")
+        initial = parseDatetime(initial) if initial else None
+        final = parameters.get("final_datetime")
+        final = parseDatetime(final) if final else None
+
+        for row in rows:
+            if any(formatValue(row[name]) != value
+                   for (name, value) in filters):
+                continue
+            if initial is not None and row["datetime"] < initial:
+                continue
+            if final is not None and row["datetime"] > final:
+                continue
+            yield row
+
+    # Whether the values match the (name, value) filters given (not None)
+    def matches(self, filters, values):
+        return all(value is None or formatValue(actual) == value
+                   for ((name, value), actual) in zip(filters, values))
+
+    # Flattens the rows into a response, projected to the return attributes
+    def formatRows(self, rows, parameters, defaultAttributes):
+        attributes = parameters.get("return_attributes")
+        attributes = (attributes.split(",") if attributes
+                      else defaultAttributes)
+        response = []
+        for row in rows:
+            response.extend(formatValue(row[attribute])
+                            for attribute in attributes)
+        return response
+    ##########################################################################
+
+##############################################################################
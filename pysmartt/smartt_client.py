@@ -1,11 +1,18 @@
 
 # Standard library imports
+# (ssl and select are only imported when needed, keeping the import of this
+# module cheap for short lived scripts)
+import itertools
 import socket
-import ssl
-import select
+import threading
 
 # Local imports
-from smartt_simple_protocol import SmarttSimpleProtocol
+from .smartt_connection import SmarttConnectionConfig
+from .smartt_schema import FORMAT_DICTS
+from .smartt_schema import SmarttSchemaRegistry
+from .smartt_simple_protocol import SmarttSimpleProtocol
+from .smartt_simple_protocol import decodeToken
+from .smartt_single_flight import SmarttSingleFlight
 
 
 class SmarttClientException(BaseException):
@@ -72,36 +79,323 @@ class SmarttClient(object):
         "DE",
         "AC"
     ]
+
+    # Response attributes which may hold free text (and thus non ASCII
+    # characters) - the only ones transcoded when using the
+    # DECODE_TEXT_FIELDS decoding policy
+    textAttributes = frozenset([
+        "message",
+        "name",
+        "description",
+        "company_name",
+        "name_or_corporate_name",
+        "address",
+        "complement",
+        "neighborhood",
+        "city",
+        "state",
+        "country",
+        "company"
+    ])
+
+    # Guards the creation of the order pollers of the clients (see
+    # orderHandle)
+    orderPollerLock = threading.Lock()
     ##########################################################################
 
     ### Init function - connects to the server (possibly initializing the SSL
-    ### protocol as well) and setups the protocol handler
+    ### protocol as well) and setups the protocol handler; unix_socket is the
+    ### path of a local gateway (see smartt_gateway) to connect to instead of
+    ### host and port, always without SSL; connection_config holds the TLS,
+    ### TCP and timeout settings (see smartt_connection.SmarttConnectionConfig)
     def __init__(self, host="smartt.s10i.com.br", port=5060, use_ssl=True,
-                 print_raw_messages=False):
+                 print_raw_messages=False,
+                 decode_policy=SmarttSimpleProtocol.DECODE_ALL,
+                 risk_engine=None, scheduler=None, coalesce_reads=False,
+                 latency_tracker=None, unix_socket=None,
+                 connection_config=None):
         self.host = host
         self.port = port
-        self.smartt_socket = socket.create_connection((self.host, self.port))
-        if use_ssl:
-            self.smartt_socket = ssl.wrap_socket(self.smartt_socket)
+        self.use_ssl = use_ssl
+        self.unix_socket = unix_socket
+        self.print_raw_messages = print_raw_messages
+        self.decode_policy = decode_policy
+        self.connection_config = connection_config or SmarttConnectionConfig()
+        # Pre-trade checks (see smartt_risk.SmarttRiskEngine), if any
+        self.risk_engine = risk_engine
+        # Orders the requests of concurrent threads (see
+        # smartt_scheduler.SmarttRequestScheduler), if any - the requests are
+        # always serialized by the exchange lock anyway
+        self.scheduler = scheduler
+        self.exchange_lock = threading.Lock()
+        # Identical reads made concurrently by different threads share a
+        # single request (writes are never coalesced)
+        self.single_flight = SmarttSingleFlight() if coalesce_reads else None
+        # Functions returning lists return generators instead, building each
+        # row only when needed (e.g. to start printing a big result early)
+        self.lazy_lists = False
+        # Format of the list responses: dicts, row objects or columns (see
+        # smartt_schema.RESPONSE_FORMATS) - the other modules of the package
+        # take the results in any of them (see smartt_schema.iterDicts)
+        self.response_format = FORMAT_DICTS
+        # Timestamps the lifecycle of the orders (see
+        # smartt_latency.SmarttLatencyTracker), if any
+        self.latency_tracker = latency_tracker
+        # Follows the status of the orders sent (see smartt_orders), created
+        # when the first order is sent
+        self.order_poller = None
+        self.connect()
 
-        self.protocol = SmarttSimpleProtocol(self.smartt_socket.recv,
-                                             self.smartt_socket.send,
-                                             print_raw_messages)
+    ##########################################################################
+    ### Connection handling ###
+    ###########################
+    def connect(self, tls_session=None):
+        self.smartt_socket = self.connection_config.connect(
+            self.host, self.port, self.use_ssl, self.unix_socket, tls_session)
+        self.protocol = SmarttSimpleProtocol(
+            self.smartt_socket.recv, self.smartt_socket.send,
+            self.print_raw_messages, self.decode_policy,
+            getattr(self.smartt_socket, "sendmsg", None))
+        self.timed_out = False
+
+    ### Closes the connection and connects again, resuming the TLS session
+    ### (if the server allows it); the Smartt session isn't kept, so login
+    ### has to be called again
+    def reconnect(self):
+        with self.exchange_lock:
+            tls_session = getattr(self.smartt_socket, "session", None)
+            self.close()
+            self.connect(tls_session)
+
+    # Whether the current connection resumed a previous TLS session
+    def tlsSessionReused(self):
+        return getattr(self.smartt_socket, "session_reused", False)
+
+    def close(self):
+        self.smartt_socket.close()
+
+    # A connection which timed out can't be used anymore (the late response
+    # would be taken as the response of the next request), so it's closed
+    # until reconnect is called - expects the exchange lock to be held
+    def timeOut(self):
+        self.timed_out = True
+        self.close()
+
+    def checkConnection(self):
+        if self.timed_out:
+            raise SmarttClientException("Connection closed after a timeout - "
+                                        "reconnect to use it again")
+    ##########################################################################
 
     # Generic Wrapper for all Smartt functions - sends the function message
-    # and returns the response (next message from the server)
+    # (any iterable of tokens) and returns the response (next message from
+    # the server)
     def smarttFunction(self, message):
-        self.protocol.send(message)
-        response = self.protocol.receive()
+        message = list(message)
+        if self.latency_tracker is not None:
+            sent_time = self.latency_tracker.requestSent(message)
+
+        if self.single_flight is not None and self.isReadFunction(message[0]):
+            response = self.single_flight.do(tuple(message),
+                                             self.requestMessage, message)
+            # The response is shared by the coalesced callers - lists are
+            # copied, the lazy tokens are read-only (and copying them would
+            # decode them all)
+            if isinstance(response, list):
+                response = list(response)
+        else:
+            response = self.requestMessage(message)
+
+        if self.latency_tracker is not None:
+            self.latency_tracker.responseReceived(message, response,
+                                                  sent_time)
 
-        if len(response) > 0 and response[0] == "ERROR":
+        return self.checkResponse(response)
+
+    # Raises the errors returned by the server
+    def checkResponse(self, response):
+        if len(response) > 0 and response[0] in ("ERROR", b"ERROR"):
+            response = [decodeToken(token) for token in response]
             if len(response) != 2:
-                print "STRANGE! Error response doesn't have 2 values: %s" % \
-                      str(response)
+                print("STRANGE! Error response doesn't have 2 values: %s" %
+                      str(response))
             raise SmarttClientException(response[0] + ": " + response[1])
 
         return response
 
+    # Sends the message of an order checked by the risk engine, if any: the
+    # check (the name of one of its functions, called with args) is made
+    # once the parameters are formatted, and an order which fails doesn't
+    # count for the throttle
+    def riskCheckedFunction(self, message, check, *args):
+        if self.risk_engine is None:
+            return self.smarttFunction(message)
+
+        sent_time = getattr(self.risk_engine, check)(*args)
+        try:
+            return self.smarttFunction(message)
+        except SmarttClientException:
+            self.risk_engine.orderFailed(sent_time)
+            raise
+
+    # Waits for the turn of the message, if there is a scheduler, and then
+    # exchanges it
+    def requestMessage(self, message):
+        if self.scheduler is None:
+            return self.exchangeMessage(message)
+
+        self.scheduler.acquire(message[0])
+        try:
+            return self.exchangeMessage(message)
+        finally:
+            self.scheduler.release()
+
+    # Sends a message and receives its response, not letting other threads
+    # use the connection in between
+    def exchangeMessage(self, message):
+        with self.exchange_lock:
+            self.checkConnection()
+            try:
+                self.protocol.send(message)
+                return self.protocol.receive()
+            except socket.timeout:
+                self.timeOut()
+                raise
+
+    ### Sends the messages in windows of up to "window" of them, each window
+    ### sent at once, without waiting for the responses, and yields the
+    ### responses in order (errors included, see checkResponse), passing them
+    ### to the latency tracker, if any, as smarttFunction does; each window
+    ### is a turn of the scheduler, if there is one (with the priority of its
+    ### first message), charging each message to the rate limit of its
+    ### function - a window ends early at a message over its limit - and the
+    ### connection is released between windows, so long pipelines don't
+    ### keep the other requests (e.g. order entry) waiting (see
+    ### smartt_pipeline for pipelined function calls)
+    def pipelineMessages(self, messages, window=32):
+        messages = (list(message) for message in messages)
+        window = max(window, 1)
+        # Message over the rate limit, first of the next window
+        refused = None
+        while True:
+            first = refused if refused is not None else next(messages, None)
+            refused = None
+            if first is None:
+                return
+
+            if self.scheduler is not None:
+                self.scheduler.acquire(first[0])
+            try:
+                batch = [first]
+                for message in itertools.islice(messages, window - 1):
+                    if (self.scheduler is not None and
+                            not self.scheduler.charge(message[0])):
+                        refused = message
+                        break
+                    batch.append(message)
+                sent_times = [None] * len(batch)
+                if self.latency_tracker is not None:
+                    sent_times = [self.latency_tracker.requestSent(message)
+                                  for message in batch]
+                responses = self.exchangeWindow(batch)
+            finally:
+                if self.scheduler is not None:
+                    self.scheduler.release()
+
+            for (message, response, sent_time) in zip(batch, responses,
+                                                      sent_times):
+                if self.latency_tracker is not None:
+                    self.latency_tracker.responseReceived(message, response,
+                                                          sent_time)
+                yield response
+
+    # Sends a window of messages at once and receives their responses, not
+    # letting other threads use the connection in between
+    def exchangeWindow(self, messages):
+        with self.exchange_lock:
+            self.checkConnection()
+            responses = []
+            in_flight = 0
+            try:
+                for message in messages:
+                    self.protocol.queue(message)
+                    in_flight += 1
+                self.protocol.flush()
+                while in_flight:
+                    responses.append(self.protocol.receive())
+                    in_flight -= 1
+            except socket.timeout:
+                # Nothing else can be received
+                in_flight = 0
+                self.timeOut()
+                raise
+            finally:
+                # The responses of the messages already sent must be read,
+                # or they would be taken as the responses of the next
+                # requests
+                if in_flight:
+                    try:
+                        self.protocol.flush()
+                        for _ in range(in_flight):
+                            self.protocol.receive()
+                    except socket.timeout:
+                        self.timeOut()
+                    except (EOFError, OSError):
+                        # The connection failed - its error is the one raised
+                        pass
+            return responses
+
+    ### Sends a message and yields the tokens of its response as they are
+    ### received (raising the server errors), without keeping the whole
+    ### response in memory; the request waits for its turn of the scheduler,
+    ### if there is one, and the connection (and the turn) is kept by this
+    ### thread until the response is consumed
+    def streamMessage(self, message):
+        if self.scheduler is not None:
+            self.scheduler.acquire(message[0])
+        try:
+            with self.exchange_lock:
+                self.checkConnection()
+                self.protocol.send(message)
+                tokens = self.protocol.receiveTokens()
+                try:
+                    first = next(tokens, None)
+                    if first in ("ERROR", b"ERROR"):
+                        self.checkResponse([first] + list(tokens))
+                    if first is not None:
+                        yield first
+                        yield from tokens
+                except socket.timeout:
+                    self.timeOut()
+                    raise
+                finally:
+                    # Reads the rest of the response if the caller stopped
+                    # early
+                    try:
+                        for _ in tokens:
+                            pass
+                    except socket.timeout:
+                        self.timeOut()
+                        raise
+        finally:
+            if self.scheduler is not None:
+                self.scheduler.release()
+
+    ### Returns a pipeline of calls of this client's functions (see
+    ### smartt_pipeline.SmarttPipeline)
+    def pipeline(self, window=32):
+        from .smartt_pipeline import SmarttPipeline
+        return SmarttPipeline(self, window)
+
+    ### Reads the portfolio, available limits, orders and stop orders of an
+    ### investment at once, detecting the changes while they are read (see
+    ### smartt_investment_snapshot.takeSnapshot)
+    def snapshot(self, investmentCode, brokerageId=None, attempts=3,
+                 since=None):
+        from .smartt_investment_snapshot import takeSnapshot
+        return takeSnapshot(self, investmentCode, brokerageId, attempts,
+                            since)
+
     ##########################################################################
     ### Generic messages (list of strings) handling ###
     ###################################################
@@ -112,14 +406,36 @@ class SmarttClient(object):
         return self.protocol.receive()
     ##########################################################################
 
+    ##########################################################################
+    ### Order handles ###
+    #####################
+
+    ### Returns the handle of an order (stop, for stop orders) sent through
+    ### this client, followed by the order poller of the client (see
+    ### smartt_orders.SmarttOrderHandle)
+    def orderHandle(self, orderId, stop, investmentCode, brokerageId):
+        if self.order_poller is None:
+            from .smartt_orders import SmarttOrderPoller
+
+            with self.orderPollerLock:
+                if self.order_poller is None:
+                    self.order_poller = SmarttOrderPoller(self)
+        return self.order_poller.handle(orderId, stop, investmentCode,
+                                        brokerageId)
+    ##########################################################################
+
     ##########################################################################
     ### Raw messages handling ###
     #############################
     def sendRawMessage(self, message):
-        self.smartt_socket.send(message)
+        if not isinstance(message, bytes):
+            message = message.encode(self.protocol.SERVER_ENCODING)
+        self.smartt_socket.sendall(message)
 
     # Reads everything available until timing out
     def receiveRawMessage(self):
+        import select
+
         # Read in chunks of at most 4K - the magical number for recv calls :)
         receive_size = 4096
         # Timeout of half a second - just enough so that a continuous
@@ -140,9 +456,31 @@ class SmarttClient(object):
     ##########################################################################
     ### Helper functions ###
     ########################
+    # Functions which don't change anything in the server
+    def isReadFunction(self, functionName):
+        return functionName.startswith("get_") or functionName == "logged"
+
+    # Caches of the attributes handling functions below - the attributes are
+    # validated against frozensets of the possible values and the encoded
+    # return_attributes parameter of each projection is computed only once
+    # (the caches are shared by all the clients and keyed by the possible
+    # values lists, which are the class attributes); the rows of each
+    # projection are built by the schemas registry (see smartt_schema)
+    MAXIMUM_CACHE_SIZE = 4096
+    attributesIndexes = {}
+    formattedAttributesCache = {}
+
+    def attributesIndex(self, possibleValues):
+        cached = self.attributesIndexes.get(id(possibleValues))
+        if cached is None or cached[0] is not possibleValues:
+            cached = (possibleValues, frozenset(possibleValues))
+            self.attributesIndexes[id(possibleValues)] = cached
+        return cached[1]
+
     def checkAttributes(self, attributes, possibleValues):
+        index = self.attributesIndex(possibleValues)
         for attribute in attributes:
-            if attribute not in possibleValues:
+            if attribute not in index:
                 raise SmarttClientException("Invalid attribute: " + attribute)
 
 
@@ -150,9 +488,17 @@ class SmarttClient(object):
         if not attributes:
             return ""
 
-        self.checkAttributes(attributes, possibleValues)
+        key = (name, id(possibleValues), tuple(attributes))
+        cached = self.formattedAttributesCache.get(key)
+        if cached is None or cached[0] is not possibleValues:
+            self.checkAttributes(attributes, possibleValues)
+            cached = (possibleValues,
+                      self.formatString(name, ",".join(attributes)))
+            if len(self.formattedAttributesCache) >= self.MAXIMUM_CACHE_SIZE:
+                self.formattedAttributesCache.clear()
+            self.formattedAttributesCache[key] = cached
 
-        return self.formatString(name, ",".join(attributes))
+        return cached[1]
 
     def formatString(self, name, value, optional=True):
         if value is None:
@@ -208,23 +554,43 @@ class SmarttClient(object):
 
         return self.formatString(name, value, optional)
 
-    def formatDictResponse(self, values, attributes, defaultAttributes=[]):
-        if len(attributes) == 0:
-            attributes = defaultAttributes
+    def formatMessageResponse(self, response):
+        if (self.protocol.decode_policy ==
+                SmarttSimpleProtocol.DECODE_TEXT_FIELDS):
+            return self.protocol.transcode(response[0])
 
-        return dict(zip(attributes, values))
+        return response[0]
 
-    def formatListOfDictsResponse(self, values, attributes, defaultAttributes):
-        if not attributes:
-            attributes = defaultAttributes
+    # Only the text fields are transcoded, and only with the
+    # DECODE_TEXT_FIELDS policy (with DECODE_RAW every field stays as bytes)
+    def textTranscoder(self):
+        if (self.protocol.decode_policy ==
+                SmarttSimpleProtocol.DECODE_TEXT_FIELDS):
+            return self.protocol.transcode
+        return None
 
-        k = len(attributes)
-        return [self.formatDictResponse(values[i:i + k], attributes) for i in
-                xrange(0, len(values), k)]
+    # A single row, always as a dict
+    def formatDictResponse(self, values, attributes, defaultAttributes=[]):
+        schema = self.schemas.schema(attributes or defaultAttributes,
+                                     defaultAttributes)
+        rows = schema.build(values[:schema.size], FORMAT_DICTS,
+                            self.textTranscoder())
+        return rows[0] if rows else {}
+
+    # The rows in the response format of the client (see response_format and
+    # lazy_lists)
+    def formatListOfDictsResponse(self, values, attributes, defaultAttributes):
+        schema = self.schemas.schema(attributes or defaultAttributes,
+                                     defaultAttributes)
+        return schema.build(values, self.response_format,
+                            self.textTranscoder(), self.lazy_lists)
 
     ##########################################################################
     ### Smartt functions ###
     ########################
+    # The message of each function is built by <function>Message and, for the
+    # functions without side effects besides the request, its result by
+    # <function>Response (used to pipeline them, see smartt_pipeline)
 
 
     loginAttributes = [
@@ -232,29 +598,47 @@ class SmarttClient(object):
 
 
     def login(self, s10iLogin = None, s10iPassword = None):
+        response = self.smarttFunction(self.loginMessage(s10iLogin, s10iPassword))
+        return self.loginResponse(response)
+
+    def loginMessage(self, s10iLogin = None, s10iPassword = None):
         message = ["login"]
         message += self.formatString("s10i_login", s10iLogin, optional=False)
         message += self.formatString("s10i_password", s10iPassword, optional=False)
-        response = self.smarttFunction(filter(None, message))
-        return unicode(response[0])
+        return list(filter(None, message))
+
+    def loginResponse(self, response):
+        return self.formatMessageResponse(response)
 
     logoutAttributes = [
         "message"]
 
 
     def logout(self):
+        response = self.smarttFunction(self.logoutMessage())
+        return self.logoutResponse(response)
+
+    def logoutMessage(self):
         message = ["logout"]
-        response = self.smarttFunction(filter(None, message))
-        return unicode(response[0])
+        return list(filter(None, message))
+
+    def logoutResponse(self, response):
+        return self.formatMessageResponse(response)
 
     loggedAttributes = [
         "message"]
 
 
     def logged(self):
+        response = self.smarttFunction(self.loggedMessage())
+        return self.loggedResponse(response)
+
+    def loggedMessage(self):
         message = ["logged"]
-        response = self.smarttFunction(filter(None, message))
-        return unicode(response[0])
+        return list(filter(None, message))
+
+    def loggedResponse(self, response):
+        return self.formatMessageResponse(response)
 
     getClientAttributes = [
         "natural_person_or_legal_person",
@@ -278,9 +662,15 @@ class SmarttClient(object):
 
 
     def getClient(self, returnAttributes = None):
+        response = self.smarttFunction(self.getClientMessage(returnAttributes))
+        return self.getClientResponse(response, returnAttributes)
+
+    def getClientMessage(self, returnAttributes = None):
         message = ["get_client"]
         message += self.formatAttributes("return_attributes", returnAttributes, self.getClientAttributes)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getClientResponse(self, response, returnAttributes = None):
         return self.formatDictResponse(response, returnAttributes, self.getClientAttributes)
 
     updateClientAttributes = [
@@ -288,6 +678,10 @@ class SmarttClient(object):
 
 
     def updateClient(self, s10iPassword = None, naturalPersonOrLegalPerson = None, nameOrCorporateName = None, gender = None, document = None, email = None, s10iLogin = None, newS10iPassword = None, address = None, number = None, complement = None, neighborhood = None, postalCode = None, city = None, state = None, country = None, birthday = None, mainPhone = None, secondaryPhone = None, company = None):
+        response = self.smarttFunction(self.updateClientMessage(s10iPassword, naturalPersonOrLegalPerson, nameOrCorporateName, gender, document, email, s10iLogin, newS10iPassword, address, number, complement, neighborhood, postalCode, city, state, country, birthday, mainPhone, secondaryPhone, company))
+        return self.updateClientResponse(response)
+
+    def updateClientMessage(self, s10iPassword = None, naturalPersonOrLegalPerson = None, nameOrCorporateName = None, gender = None, document = None, email = None, s10iLogin = None, newS10iPassword = None, address = None, number = None, complement = None, neighborhood = None, postalCode = None, city = None, state = None, country = None, birthday = None, mainPhone = None, secondaryPhone = None, company = None):
         message = ["update_client"]
         message += self.formatString("s10i_password", s10iPassword, optional=True)
         message += self.formatBoolean("natural_person_or_legal_person", naturalPersonOrLegalPerson, optional=True)
@@ -309,8 +703,10 @@ class SmarttClient(object):
         message += self.formatString("main_phone", mainPhone, optional=True)
         message += self.formatString("secondary_phone", secondaryPhone, optional=True)
         message += self.formatString("company", company, optional=True)
-        response = self.smarttFunction(filter(None, message))
-        return unicode(response[0])
+        return list(filter(None, message))
+
+    def updateClientResponse(self, response):
+        return self.formatMessageResponse(response)
 
     getClientBrokeragesAttributes = [
         "brokerage_id",
@@ -318,11 +714,17 @@ class SmarttClient(object):
 
 
     def getClientBrokerages(self, brokerageId = None, brokerageLogin = None, returnAttributes = None):
+        response = self.smarttFunction(self.getClientBrokeragesMessage(brokerageId, brokerageLogin, returnAttributes))
+        return self.getClientBrokeragesResponse(response, returnAttributes)
+
+    def getClientBrokeragesMessage(self, brokerageId = None, brokerageLogin = None, returnAttributes = None):
         message = ["get_client_brokerages"]
         message += self.formatInteger("brokerage_id", brokerageId, optional=True)
         message += self.formatString("brokerage_login", brokerageLogin, optional=True)
         message += self.formatAttributes("return_attributes", returnAttributes, self.getClientBrokeragesAttributes)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getClientBrokeragesResponse(self, response, returnAttributes = None):
         return self.formatDictResponse(response, returnAttributes, self.getClientBrokeragesAttributes)
 
     insertClientBrokerageAttributes = [
@@ -330,38 +732,56 @@ class SmarttClient(object):
 
 
     def insertClientBrokerage(self, brokerageId = None, brokerageLogin = None, brokeragePassword = None, brokerageDigitalSignature = None):
+        response = self.smarttFunction(self.insertClientBrokerageMessage(brokerageId, brokerageLogin, brokeragePassword, brokerageDigitalSignature))
+        return self.insertClientBrokerageResponse(response)
+
+    def insertClientBrokerageMessage(self, brokerageId = None, brokerageLogin = None, brokeragePassword = None, brokerageDigitalSignature = None):
         message = ["insert_client_brokerage"]
         message += self.formatInteger("brokerage_id", brokerageId, optional=False)
         message += self.formatString("brokerage_login", brokerageLogin, optional=False)
         message += self.formatString("brokerage_password", brokeragePassword, optional=False)
         message += self.formatString("brokerage_digital_signature", brokerageDigitalSignature, optional=False)
-        response = self.smarttFunction(filter(None, message))
-        return unicode(response[0])
+        return list(filter(None, message))
+
+    def insertClientBrokerageResponse(self, response):
+        return self.formatMessageResponse(response)
 
     updateClientBrokerageAttributes = [
         "message"]
 
 
     def updateClientBrokerage(self, brokerageId = None, newBrokerageId = None, brokerageLogin = None, brokeragePassword = None, brokerageDigiralSignature = None):
+        response = self.smarttFunction(self.updateClientBrokerageMessage(brokerageId, newBrokerageId, brokerageLogin, brokeragePassword, brokerageDigiralSignature))
+        return self.updateClientBrokerageResponse(response)
+
+    def updateClientBrokerageMessage(self, brokerageId = None, newBrokerageId = None, brokerageLogin = None, brokeragePassword = None, brokerageDigiralSignature = None):
         message = ["update_client_brokerage"]
         message += self.formatInteger("brokerage_id", brokerageId, optional=False)
         message += self.formatInteger("new_brokerage_id", newBrokerageId, optional=True)
         message += self.formatString("brokerage_login", brokerageLogin, optional=True)
         message += self.formatString("brokerage_password", brokeragePassword, optional=True)
         message += self.formatString("brokerage_digiral_signature", brokerageDigiralSignature, optional=True)
-        response = self.smarttFunction(filter(None, message))
-        return unicode(response[0])
+        return list(filter(None, message))
+
+    def updateClientBrokerageResponse(self, response):
+        return self.formatMessageResponse(response)
 
     deleteClientBrokeragesAttributes = [
         "message"]
 
 
     def deleteClientBrokerages(self, brokerageId = None, brokerageLogin = None):
+        response = self.smarttFunction(self.deleteClientBrokeragesMessage(brokerageId, brokerageLogin))
+        return self.deleteClientBrokeragesResponse(response)
+
+    def deleteClientBrokeragesMessage(self, brokerageId = None, brokerageLogin = None):
         message = ["delete_client_brokerages"]
         message += self.formatInteger("brokerage_id", brokerageId, optional=True)
         message += self.formatString("brokerage_login", brokerageLogin, optional=True)
-        response = self.smarttFunction(filter(None, message))
-        return unicode(response[0])
+        return list(filter(None, message))
+
+    def deleteClientBrokeragesResponse(self, response):
+        return self.formatMessageResponse(response)
 
     getStockAttributes = [
         "stock_code",
@@ -378,11 +798,17 @@ class SmarttClient(object):
 
 
     def getStock(self, stockCode = None, marketName = None, returnAttributes = None):
+        response = self.smarttFunction(self.getStockMessage(stockCode, marketName, returnAttributes))
+        return self.getStockResponse(response, returnAttributes)
+
+    def getStockMessage(self, stockCode = None, marketName = None, returnAttributes = None):
         message = ["get_stock"]
         message += self.formatString("stock_code", stockCode, optional=False)
         message += self.formatString("market_name", marketName, optional=True)
         message += self.formatAttributes("return_attributes", returnAttributes, self.getStockAttributes)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getStockResponse(self, response, returnAttributes = None):
         return self.formatDictResponse(response, returnAttributes, self.getStockAttributes)
 
     sendOrderAttributes = [
@@ -390,6 +816,14 @@ class SmarttClient(object):
 
 
     def sendOrder(self, investmentCode = None, brokerageId = None, orderType = None, stockCode = None, marketName = None, numberOfStocks = None, price = None, validityType = None, validity = None):
+        response = self.riskCheckedFunction(self.sendOrderMessage(investmentCode, brokerageId, orderType, stockCode, marketName, numberOfStocks, price, validityType, validity), "checkOrder", investmentCode, brokerageId, orderType, stockCode, numberOfStocks, price)
+        handle = self.orderHandle(int(response[1]), False, investmentCode, brokerageId)
+        if self.risk_engine is not None:
+            self.risk_engine.orderSent(int(handle), investmentCode, brokerageId, orderType, stockCode, numberOfStocks, price)
+            handle.follow()
+        return handle
+
+    def sendOrderMessage(self, investmentCode = None, brokerageId = None, orderType = None, stockCode = None, marketName = None, numberOfStocks = None, price = None, validityType = None, validity = None):
         message = ["send_order"]
         message += self.formatString("investment_code", investmentCode, optional=False)
         message += self.formatInteger("brokerage_id", brokerageId, optional=True)
@@ -400,30 +834,39 @@ class SmarttClient(object):
         message += self.formatDecimal2("price", price, optional=False)
         message += self.formatString("validity_type", validityType, optional=True)
         message += self.formatDate("validity", validity, optional=True)
-        response = self.smarttFunction(filter(None, message))
-        return int(response[1])
+        return list(filter(None, message))
 
     cancelOrderAttributes = [
         "order_id"]
 
 
     def cancelOrder(self, orderId = None):
+        response = self.smarttFunction(self.cancelOrderMessage(orderId))
+        if self.risk_engine is not None:
+            self.risk_engine.orderCanceled(orderId)
+        return int(response[1])
+
+    def cancelOrderMessage(self, orderId = None):
         message = ["cancel_order"]
         message += self.formatInteger("order_id", orderId, optional=False)
-        response = self.smarttFunction(filter(None, message))
-        return int(response[1])
+        return list(filter(None, message))
 
     changeOrderAttributes = [
         "order_id"]
 
 
     def changeOrder(self, orderId = None, newNumberOfStocks = None, newPrice = None):
+        response = self.riskCheckedFunction(self.changeOrderMessage(orderId, newNumberOfStocks, newPrice), "checkChangeOrder", orderId, newNumberOfStocks, newPrice)
+        if self.risk_engine is not None:
+            self.risk_engine.orderChanged(orderId, newNumberOfStocks, newPrice)
+        return int(response[1])
+
+    def changeOrderMessage(self, orderId = None, newNumberOfStocks = None, newPrice = None):
         message = ["change_order"]
         message += self.formatInteger("order_id", orderId, optional=False)
         message += self.formatInteger("new_number_of_stocks", newNumberOfStocks, optional=True)
         message += self.formatDecimal2("new_price", newPrice, optional=True)
-        response = self.smarttFunction(filter(None, message))
-        return int(response[1])
+        return list(filter(None, message))
 
     getOrdersAttributes = [
         "order_id",
@@ -449,6 +892,10 @@ class SmarttClient(object):
 
 
     def getOrders(self, orderId = None, investmentCode = None, brokerageId = None, initialDatetime = None, finalDatetime = None, status = None, returnAttributes = None):
+        response = self.smarttFunction(self.getOrdersMessage(orderId, investmentCode, brokerageId, initialDatetime, finalDatetime, status, returnAttributes))
+        return self.getOrdersResponse(response, returnAttributes)
+
+    def getOrdersMessage(self, orderId = None, investmentCode = None, brokerageId = None, initialDatetime = None, finalDatetime = None, status = None, returnAttributes = None):
         message = ["get_orders"]
         message += self.formatInteger("order_id", orderId, optional=True)
         message += self.formatString("investment_code", investmentCode, optional=True)
@@ -457,7 +904,9 @@ class SmarttClient(object):
         message += self.formatDatetime("final_datetime", finalDatetime, optional=True)
         message += self.formatString("status", status, optional=True)
         message += self.formatAttributes("return_attributes", returnAttributes, self.getOrdersAttributes)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getOrdersResponse(self, response, returnAttributes = None):
         return self.formatListOfDictsResponse(response, returnAttributes, self.getOrdersAttributes)
 
     getOrdersEventsAttributes = [
@@ -471,6 +920,10 @@ class SmarttClient(object):
 
 
     def getOrdersEvents(self, orderId = None, investmentCode = None, brokerageId = None, initialDatetime = None, finalDatetime = None, eventType = None, returnAttributes = None):
+        response = self.smarttFunction(self.getOrdersEventsMessage(orderId, investmentCode, brokerageId, initialDatetime, finalDatetime, eventType, returnAttributes))
+        return self.getOrdersEventsResponse(response, returnAttributes)
+
+    def getOrdersEventsMessage(self, orderId = None, investmentCode = None, brokerageId = None, initialDatetime = None, finalDatetime = None, eventType = None, returnAttributes = None):
         message = ["get_orders_events"]
         message += self.formatInteger("order_id", orderId, optional=True)
         message += self.formatString("investment_code", investmentCode, optional=True)
@@ -479,7 +932,9 @@ class SmarttClient(object):
         message += self.formatDatetime("final_datetime", finalDatetime, optional=True)
         message += self.formatString("event_type", eventType, optional=True)
         message += self.formatAttributes("return_attributes", returnAttributes, self.getOrdersEventsAttributes)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getOrdersEventsResponse(self, response, returnAttributes = None):
         return self.formatListOfDictsResponse(response, returnAttributes, self.getOrdersEventsAttributes)
 
     getOrderIdAttributes = [
@@ -487,10 +942,16 @@ class SmarttClient(object):
 
 
     def getOrderId(self, orderIdInBrokerage = None, brokerageId = None):
+        response = self.smarttFunction(self.getOrderIdMessage(orderIdInBrokerage, brokerageId))
+        return self.getOrderIdResponse(response)
+
+    def getOrderIdMessage(self, orderIdInBrokerage = None, brokerageId = None):
         message = ["get_order_id"]
         message += self.formatString("order_id_in_brokerage", orderIdInBrokerage, optional=False)
         message += self.formatInteger("brokerage_id", brokerageId, optional=False)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getOrderIdResponse(self, response):
         return int(response[0])
 
     sendStopOrderAttributes = [
@@ -498,6 +959,14 @@ class SmarttClient(object):
 
 
     def sendStopOrder(self, investmentCode = None, brokerageId = None, orderType = None, stopOrderType = None, stockCode = None, marketName = None, numberOfStocks = None, stopPrice = None, limitPrice = None, validity = None, validAfterMarket = None):
+        response = self.riskCheckedFunction(self.sendStopOrderMessage(investmentCode, brokerageId, orderType, stopOrderType, stockCode, marketName, numberOfStocks, stopPrice, limitPrice, validity, validAfterMarket), "checkStopOrder", investmentCode, brokerageId, orderType, stockCode, numberOfStocks, stopPrice, limitPrice)
+        handle = self.orderHandle(int(response[1]), True, investmentCode, brokerageId)
+        if self.risk_engine is not None:
+            self.risk_engine.stopOrderSent(int(handle), investmentCode, brokerageId, orderType, stockCode, numberOfStocks, limitPrice)
+            handle.follow()
+        return handle
+
+    def sendStopOrderMessage(self, investmentCode = None, brokerageId = None, orderType = None, stopOrderType = None, stockCode = None, marketName = None, numberOfStocks = None, stopPrice = None, limitPrice = None, validity = None, validAfterMarket = None):
         message = ["send_stop_order"]
         message += self.formatString("investment_code", investmentCode, optional=False)
         message += self.formatInteger("brokerage_id", brokerageId, optional=True)
@@ -510,18 +979,22 @@ class SmarttClient(object):
         message += self.formatDecimal2("limit_price", limitPrice, optional=False)
         message += self.formatDate("validity", validity, optional=False)
         message += self.formatBoolean("valid_after_market", validAfterMarket, optional=False)
-        response = self.smarttFunction(filter(None, message))
-        return int(response[1])
+        return list(filter(None, message))
 
     cancelStopOrderAttributes = [
         "stop_order_id"]
 
 
     def cancelStopOrder(self, stopOrderId = None):
+        response = self.smarttFunction(self.cancelStopOrderMessage(stopOrderId))
+        if self.risk_engine is not None:
+            self.risk_engine.stopOrderCanceled(stopOrderId)
+        return int(response[1])
+
+    def cancelStopOrderMessage(self, stopOrderId = None):
         message = ["cancel_stop_order"]
         message += self.formatInteger("stop_order_id", stopOrderId, optional=False)
-        response = self.smarttFunction(filter(None, message))
-        return int(response[1])
+        return list(filter(None, message))
 
     getStopOrdersAttributes = [
         "stop_order_id",
@@ -544,6 +1017,10 @@ class SmarttClient(object):
 
 
     def getStopOrders(self, stopOrderId = None, investmentCode = None, brokerageId = None, initialDatetime = None, finalDatetime = None, status = None, returnAttributes = None):
+        response = self.smarttFunction(self.getStopOrdersMessage(stopOrderId, investmentCode, brokerageId, initialDatetime, finalDatetime, status, returnAttributes))
+        return self.getStopOrdersResponse(response, returnAttributes)
+
+    def getStopOrdersMessage(self, stopOrderId = None, investmentCode = None, brokerageId = None, initialDatetime = None, finalDatetime = None, status = None, returnAttributes = None):
         message = ["get_stop_orders"]
         message += self.formatInteger("stop_order_id", stopOrderId, optional=True)
         message += self.formatString("investment_code", investmentCode, optional=True)
@@ -552,7 +1029,9 @@ class SmarttClient(object):
         message += self.formatDatetime("final_datetime", finalDatetime, optional=True)
         message += self.formatString("status", status, optional=True)
         message += self.formatAttributes("return_attributes", returnAttributes, self.getStopOrdersAttributes)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getStopOrdersResponse(self, response, returnAttributes = None):
         return self.formatListOfDictsResponse(response, returnAttributes, self.getStopOrdersAttributes)
 
     getStopOrdersEventsAttributes = [
@@ -566,6 +1045,10 @@ class SmarttClient(object):
 
 
     def getStopOrdersEvents(self, stopOrderId = None, investmentCode = None, brokerageId = None, initialDatetime = None, finalDatetime = None, eventType = None, returnAttributes = None):
+        response = self.smarttFunction(self.getStopOrdersEventsMessage(stopOrderId, investmentCode, brokerageId, initialDatetime, finalDatetime, eventType, returnAttributes))
+        return self.getStopOrdersEventsResponse(response, returnAttributes)
+
+    def getStopOrdersEventsMessage(self, stopOrderId = None, investmentCode = None, brokerageId = None, initialDatetime = None, finalDatetime = None, eventType = None, returnAttributes = None):
         message = ["get_stop_orders_events"]
         message += self.formatInteger("stop_order_id", stopOrderId, optional=True)
         message += self.formatString("investment_code", investmentCode, optional=True)
@@ -574,7 +1057,9 @@ class SmarttClient(object):
         message += self.formatDatetime("final_datetime", finalDatetime, optional=True)
         message += self.formatString("event_type", eventType, optional=True)
         message += self.formatAttributes("return_attributes", returnAttributes, self.getStopOrdersEventsAttributes)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getStopOrdersEventsResponse(self, response, returnAttributes = None):
         return self.formatListOfDictsResponse(response, returnAttributes, self.getStopOrdersEventsAttributes)
 
     getStopOrderIdAttributes = [
@@ -582,10 +1067,16 @@ class SmarttClient(object):
 
 
     def getStopOrderId(self, stopOrderIdInBrokerage = None, brokerageId = None):
+        response = self.smarttFunction(self.getStopOrderIdMessage(stopOrderIdInBrokerage, brokerageId))
+        return self.getStopOrderIdResponse(response)
+
+    def getStopOrderIdMessage(self, stopOrderIdInBrokerage = None, brokerageId = None):
         message = ["get_stop_order_id"]
         message += self.formatString("stop_order_id_in_brokerage", stopOrderIdInBrokerage, optional=False)
         message += self.formatInteger("brokerage_id", brokerageId, optional=False)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getStopOrderIdResponse(self, response):
         return int(response[0])
 
     getTradesAttributes = [
@@ -610,6 +1101,10 @@ class SmarttClient(object):
 
 
     def getTrades(self, orderId = None, investmentCode = None, brokerageId = None, initialDatetime = None, finalDatetime = None, returnAttributes = None):
+        response = self.smarttFunction(self.getTradesMessage(orderId, investmentCode, brokerageId, initialDatetime, finalDatetime, returnAttributes))
+        return self.getTradesResponse(response, returnAttributes)
+
+    def getTradesMessage(self, orderId = None, investmentCode = None, brokerageId = None, initialDatetime = None, finalDatetime = None, returnAttributes = None):
         message = ["get_trades"]
         message += self.formatInteger("order_id", orderId, optional=True)
         message += self.formatString("investment_code", investmentCode, optional=True)
@@ -617,7 +1112,9 @@ class SmarttClient(object):
         message += self.formatDatetime("initial_datetime", initialDatetime, optional=True)
         message += self.formatDatetime("final_datetime", finalDatetime, optional=True)
         message += self.formatAttributes("return_attributes", returnAttributes, self.getTradesAttributes)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getTradesResponse(self, response, returnAttributes = None):
         return self.formatListOfDictsResponse(response, returnAttributes, self.getTradesAttributes)
 
     getInvestmentsAttributes = [
@@ -631,11 +1128,17 @@ class SmarttClient(object):
 
 
     def getInvestments(self, investmentCode = None, brokerageId = None, returnAttributes = None):
+        response = self.smarttFunction(self.getInvestmentsMessage(investmentCode, brokerageId, returnAttributes))
+        return self.getInvestmentsResponse(response, returnAttributes)
+
+    def getInvestmentsMessage(self, investmentCode = None, brokerageId = None, returnAttributes = None):
         message = ["get_investments"]
         message += self.formatString("investment_code", investmentCode, optional=True)
         message += self.formatInteger("brokerage_id", brokerageId, optional=True)
         message += self.formatAttributes("return_attributes", returnAttributes, self.getInvestmentsAttributes)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getInvestmentsResponse(self, response, returnAttributes = None):
         return self.formatDictResponse(response, returnAttributes, self.getInvestmentsAttributes)
 
     getReportAttributes = [
@@ -699,11 +1202,17 @@ class SmarttClient(object):
 
 
     def getReport(self, investmentCode = None, brokerageId = None, returnAttributes = None):
+        response = self.smarttFunction(self.getReportMessage(investmentCode, brokerageId, returnAttributes))
+        return self.getReportResponse(response, returnAttributes)
+
+    def getReportMessage(self, investmentCode = None, brokerageId = None, returnAttributes = None):
         message = ["get_report"]
         message += self.formatString("investment_code", investmentCode, optional=False)
         message += self.formatInteger("brokerage_id", brokerageId, optional=True)
         message += self.formatAttributes("return_attributes", returnAttributes, self.getReportAttributes)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getReportResponse(self, response, returnAttributes = None):
         return self.formatDictResponse(response, returnAttributes, self.getReportAttributes)
 
     getDailyCumulativePerformanceAttributes = [
@@ -713,10 +1222,16 @@ class SmarttClient(object):
 
 
     def getDailyCumulativePerformance(self, investmentCode = None, brokerageId = None):
+        response = self.smarttFunction(self.getDailyCumulativePerformanceMessage(investmentCode, brokerageId))
+        return self.getDailyCumulativePerformanceResponse(response)
+
+    def getDailyCumulativePerformanceMessage(self, investmentCode = None, brokerageId = None):
         message = ["get_daily_cumulative_performance"]
         message += self.formatString("investment_code", investmentCode, optional=False)
         message += self.formatInteger("brokerage_id", brokerageId, optional=True)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getDailyCumulativePerformanceResponse(self, response):
         return self.formatDictResponse(response, [], self.getDailyCumulativePerformanceAttributes)
 
     getDailyDrawdownAttributes = [
@@ -726,10 +1241,16 @@ class SmarttClient(object):
 
 
     def getDailyDrawdown(self, investmentCode = None, brokerageId = None):
+        response = self.smarttFunction(self.getDailyDrawdownMessage(investmentCode, brokerageId))
+        return self.getDailyDrawdownResponse(response)
+
+    def getDailyDrawdownMessage(self, investmentCode = None, brokerageId = None):
         message = ["get_daily_drawdown"]
         message += self.formatString("investment_code", investmentCode, optional=False)
         message += self.formatInteger("brokerage_id", brokerageId, optional=True)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getDailyDrawdownResponse(self, response):
         return self.formatDictResponse(response, [], self.getDailyDrawdownAttributes)
 
     getPortfolioAttributes = [
@@ -743,11 +1264,17 @@ class SmarttClient(object):
 
 
     def getPortfolio(self, investmentCode = None, brokerageId = None, returnAttributes = None):
+        response = self.smarttFunction(self.getPortfolioMessage(investmentCode, brokerageId, returnAttributes))
+        return self.getPortfolioResponse(response, returnAttributes)
+
+    def getPortfolioMessage(self, investmentCode = None, brokerageId = None, returnAttributes = None):
         message = ["get_portfolio"]
         message += self.formatString("investment_code", investmentCode, optional=False)
         message += self.formatInteger("brokerage_id", brokerageId, optional=True)
         message += self.formatAttributes("return_attributes", returnAttributes, self.getPortfolioAttributes)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getPortfolioResponse(self, response, returnAttributes = None):
         return self.formatListOfDictsResponse(response, returnAttributes, self.getPortfolioAttributes)
 
     getAvailableLimitsAttributes = [
@@ -757,11 +1284,17 @@ class SmarttClient(object):
 
 
     def getAvailableLimits(self, investmentCode = None, brokerageId = None, returnAttributes = None):
+        response = self.smarttFunction(self.getAvailableLimitsMessage(investmentCode, brokerageId, returnAttributes))
+        return self.getAvailableLimitsResponse(response, returnAttributes)
+
+    def getAvailableLimitsMessage(self, investmentCode = None, brokerageId = None, returnAttributes = None):
         message = ["get_available_limits"]
         message += self.formatString("investment_code", investmentCode, optional=True)
         message += self.formatInteger("brokerage_id", brokerageId, optional=True)
         message += self.formatAttributes("return_attributes", returnAttributes, self.getAvailableLimitsAttributes)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getAvailableLimitsResponse(self, response, returnAttributes = None):
         return self.formatListOfDictsResponse(response, returnAttributes, self.getAvailableLimitsAttributes)
 
     getSetupsAttributes = [
@@ -790,10 +1323,16 @@ class SmarttClient(object):
 
 
     def getSetups(self, code = None, returnAttributes = None):
+        response = self.smarttFunction(self.getSetupsMessage(code, returnAttributes))
+        return self.getSetupsResponse(response, returnAttributes)
+
+    def getSetupsMessage(self, code = None, returnAttributes = None):
         message = ["get_setups"]
         message += self.formatString("code", code, optional=True)
         message += self.formatAttributes("return_attributes", returnAttributes, self.getSetupsAttributes)
-        response = self.smarttFunction(filter(None, message))
+        return list(filter(None, message))
+
+    def getSetupsResponse(self, response, returnAttributes = None):
         return self.formatDictResponse(response, returnAttributes, self.getSetupsAttributes)
 
     updateSetupAttributes = [
@@ -801,6 +1340,10 @@ class SmarttClient(object):
 
 
     def updateSetup(self, code = None, name = None, newCode = None, initialCapital = None, slippage = None, absoluteBrokerageTax = None, percentualBrokerageTax = None, positionTradingTax = None, positionLiquidationTax = None, positionRegisterTax = None, positionIncomeTax = None, positionWithholdingIncomeTax = None, positionOtherTaxes = None, dayTradeTradingTax = None, dayTradeLiquidationTax = None, dayTradeRegiterTax = None, dayTradeIncomeTax = None, dayTradeWithholdingIncomeTax = None, dayTradeOtherTaxes = None, issTax = None, custodyTax = None, leaseTax = None, incomeTaxPayment = None):
+        response = self.smarttFunction(self.updateSetupMessage(code, name, newCode, initialCapital, slippage, absoluteBrokerageTax, percentualBrokerageTax, positionTradingTax, positionLiquidationTax, positionRegisterTax, positionIncomeTax, positionWithholdingIncomeTax, positionOtherTaxes, dayTradeTradingTax, dayTradeLiquidationTax, dayTradeRegiterTax, dayTradeIncomeTax, dayTradeWithholdingIncomeTax, dayTradeOtherTaxes, issTax, custodyTax, leaseTax, incomeTaxPayment))
+        return self.updateSetupResponse(response)
+
+    def updateSetupMessage(self, code = None, name = None, newCode = None, initialCapital = None, slippage = None, absoluteBrokerageTax = None, percentualBrokerageTax = None, positionTradingTax = None, positionLiquidationTax = None, positionRegisterTax = None, positionIncomeTax = None, positionWithholdingIncomeTax = None, positionOtherTaxes = None, dayTradeTradingTax = None, dayTradeLiquidationTax = None, dayTradeRegiterTax = None, dayTradeIncomeTax = None, dayTradeWithholdingIncomeTax = None, dayTradeOtherTaxes = None, issTax = None, custodyTax = None, leaseTax = None, incomeTaxPayment = None):
         message = ["update_setup"]
         message += self.formatString("code", code, optional=False)
         message += self.formatString("name", name, optional=True)
@@ -825,8 +1368,10 @@ class SmarttClient(object):
         message += self.formatDecimal2("custody_tax", custodyTax, optional=True)
         message += self.formatDecimal2("lease_tax", leaseTax, optional=True)
         message += self.formatString("income_tax_payment", incomeTaxPayment, optional=True)
-        response = self.smarttFunction(filter(None, message))
-        return unicode(response[0])
+        return list(filter(None, message))
+
+    def updateSetupResponse(self, response):
+        return self.formatMessageResponse(response)
 
     getFinancialTransactionsAttributes = [
         "financial_transaction_id",
@@ -840,19 +1385,29 @@ class SmarttClient(object):
 
 
     def getFinancialTransactions(self, financialTransactionId = None, investmentCode = None, brokerageId = None, returnAttributes = None):
+        response = self.smarttFunction(self.getFinancialTransactionsMessage(financialTransactionId, investmentCode, brokerageId, returnAttributes))
+        return self.getFinancialTransactionsResponse(response, returnAttributes)
+
+    def getFinancialTransactionsMessage(self, financialTransactionId = None, investmentCode = None, brokerageId = None, returnAttributes = None):
         message = ["get_financial_transactions"]
         message += self.formatString("financial_transaction_id", financialTransactionId, optional=True)
         message += self.formatString("investment_code", investmentCode, optional=True)
         message += self.formatInteger("brokerage_id", brokerageId, optional=True)
         message += self.formatAttributes("return_attributes", returnAttributes, self.getFinancialTransactionsAttributes)
-        response = self.smarttFunction(filter(None, message))
-        return self.formatDictResponse(response, returnAttributes, self.getFinancialTransactionsAttributes)
+        return list(filter(None, message))
+
+    def getFinancialTransactionsResponse(self, response, returnAttributes = None):
+        return self.formatListOfDictsResponse(response, returnAttributes, self.getFinancialTransactionsAttributes)
 
     insertFinancialTransactionAttributes = [
         "message"]
 
 
     def insertFinancialTransaction(self, investmentCode = None, brokerageId = None, datetime = None, contributionOrWithdrawal = None, value = None, operationalTaxCost = None, description = None):
+        response = self.smarttFunction(self.insertFinancialTransactionMessage(investmentCode, brokerageId, datetime, contributionOrWithdrawal, value, operationalTaxCost, description))
+        return self.insertFinancialTransactionResponse(response)
+
+    def insertFinancialTransactionMessage(self, investmentCode = None, brokerageId = None, datetime = None, contributionOrWithdrawal = None, value = None, operationalTaxCost = None, description = None):
         message = ["insert_financial_transaction"]
         message += self.formatString("investment_code", investmentCode, optional=False)
         message += self.formatInteger("brokerage_id", brokerageId, optional=True)
@@ -861,14 +1416,20 @@ class SmarttClient(object):
         message += self.formatDecimal2("value", value, optional=False)
         message += self.formatDecimal2("operational_tax_cost", operationalTaxCost, optional=False)
         message += self.formatString("description", description, optional=True)
-        response = self.smarttFunction(filter(None, message))
-        return unicode(response[0])
+        return list(filter(None, message))
+
+    def insertFinancialTransactionResponse(self, response):
+        return self.formatMessageResponse(response)
 
     updateFinancialTransactionAttributes = [
         "message"]
 
 
     def updateFinancialTransaction(self, financialTransactionId = None, investmentCode = None, brokerageId = None, datetime = None, contributionOrWithdrawal = None, value = None, operationalTaxCost = None, description = None):
+        response = self.smarttFunction(self.updateFinancialTransactionMessage(financialTransactionId, investmentCode, brokerageId, datetime, contributionOrWithdrawal, value, operationalTaxCost, description))
+        return self.updateFinancialTransactionResponse(response)
+
+    def updateFinancialTransactionMessage(self, financialTransactionId = None, investmentCode = None, brokerageId = None, datetime = None, contributionOrWithdrawal = None, value = None, operationalTaxCost = None, description = None):
         message = ["update_financial_transaction"]
         message += self.formatString("financial_transaction_id", financialTransactionId, optional=False)
         message += self.formatString("investment_code", investmentCode, optional=True)
@@ -878,18 +1439,32 @@ class SmarttClient(object):
         message += self.formatDecimal2("value", value, optional=True)
         message += self.formatDecimal2("operational_tax_cost", operationalTaxCost, optional=True)
         message += self.formatString("description", description, optional=True)
-        response = self.smarttFunction(filter(None, message))
-        return unicode(response[0])
+        return list(filter(None, message))
+
+    def updateFinancialTransactionResponse(self, response):
+        return self.formatMessageResponse(response)
 
     deleteFinancialTransactionsAttributes = [
         "message"]
 
 
     def deleteFinancialTransactions(self, financialTransactionId = None, investmentCode = None, brokerageId = None):
+        response = self.smarttFunction(self.deleteFinancialTransactionsMessage(financialTransactionId, investmentCode, brokerageId))
+        return self.deleteFinancialTransactionsResponse(response)
+
+    def deleteFinancialTransactionsMessage(self, financialTransactionId = None, investmentCode = None, brokerageId = None):
         message = ["delete_financial_transactions"]
         message += self.formatString("financial_transaction_id", financialTransactionId, optional=True)
         message += self.formatString("investment_code", investmentCode, optional=True)
         message += self.formatInteger("brokerage_id", brokerageId, optional=True)
-        response = self.smarttFunction(filter(None, message))
-        return unicode(response[0])
+        return list(filter(None, message))
+
+    def deleteFinancialTransactionsResponse(self, response):
+        return self.formatMessageResponse(response)
+
+##############################################################################
+
 
+# Schemas of the responses of the functions, generated from the *Attributes
+# lists of the class
+SmarttClient.schemas = SmarttSchemaRegistry(SmarttClient)
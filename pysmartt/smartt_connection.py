@@ -0,0 +1,105 @@
+
+# Standard library imports
+# (ssl is only imported when needed, keeping the import of this module cheap)
+import socket
+
+
+##############################################################################
+### SmarttConnectionConfig class - how the client connections are made: TLS
+### settings (the SSL context is created once and shared by the connections
+### using this configuration, so a reconnection can resume the previous TLS
+### session instead of making a full handshake), TCP options, socket buffer
+### sizes and timeouts (in seconds, None for blocking - a client connection
+### which times out is closed, see SmarttClient.timeOut)
+class SmarttConnectionConfig(object):
+
+    ### Init function - by default the server certificate isn't verified
+    ### (as in the previous versions of the client); ssl_context may be
+    ### given to control every TLS setting
+    def __init__(self, ssl_context=None, verify_certificate=False,
+                 ca_file=None, reuse_tls_session=True, tcp_nodelay=True,
+                 send_buffer_size=None, receive_buffer_size=None,
+                 connect_timeout=None, timeout=None):
+        self.ssl_context = ssl_context
+        self.verify_certificate = verify_certificate
+        self.ca_file = ca_file
+        self.reuse_tls_session = reuse_tls_session
+        self.tcp_nodelay = tcp_nodelay
+        self.send_buffer_size = send_buffer_size
+        self.receive_buffer_size = receive_buffer_size
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+
+    def sslContext(self):
+        if self.ssl_context is None:
+            import ssl
+
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            if self.verify_certificate:
+                if self.ca_file is not None:
+                    context.load_verify_locations(self.ca_file)
+                else:
+                    context.load_default_certs()
+            else:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            self.ssl_context = context
+        return self.ssl_context
+
+    ### Connects to a server (or to a Unix socket, if its path is given),
+    ### resuming the given TLS session if possible
+    def connect(self, host, port, use_ssl=True, unix_socket=None,
+                tls_session=None):
+        if unix_socket is not None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.configureSocket(connection)
+            connection.settimeout(self.connect_timeout)
+            try:
+                connection.connect(unix_socket)
+            except BaseException:
+                connection.close()
+                raise
+        else:
+            connection = self.connectTcp(host, port)
+
+        if use_ssl and unix_socket is None:
+            # The handshake is part of connecting
+            connection = self.sslContext().wrap_socket(
+                connection, server_hostname=host,
+                session=tls_session if self.reuse_tls_session else None)
+
+        connection.settimeout(self.timeout)
+        return connection
+
+    # Same as socket.create_connection, but configuring the sockets before
+    # connecting (the buffer sizes affect the TCP window negotiation)
+    def connectTcp(self, host, port):
+        error = None
+        for (family, socket_type, protocol, _, address) in \
+                socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+            connection = socket.socket(family, socket_type, protocol)
+            try:
+                self.configureSocket(connection)
+                if self.tcp_nodelay:
+                    connection.setsockopt(socket.IPPROTO_TCP,
+                                          socket.TCP_NODELAY, 1)
+                connection.settimeout(self.connect_timeout)
+                connection.connect(address)
+                return connection
+            except OSError as e:
+                error = e
+                connection.close()
+
+        if error is None:
+            error = OSError("No addresses found for %s" % host)
+        raise error
+
+    def configureSocket(self, connection):
+        if self.send_buffer_size is not None:
+            connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                                  self.send_buffer_size)
+        if self.receive_buffer_size is not None:
+            connection.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                  self.receive_buffer_size)
+
+##############################################################################
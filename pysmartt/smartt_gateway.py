@@ -0,0 +1,273 @@
+
+# Standard library imports
+import hmac
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+
+# Local imports
+from .smartt_client import SmarttClient
+from .smartt_client import SmarttClientException
+from .smartt_simple_protocol import SmarttSimpleProtocol
+
+
+# Functions answered by the gateway itself: the upstream sessions are shared
+# and already logged in, so the local clients log in and out of the gateway
+# only (with its access token as the password, if it has one)
+LOGIN_RESPONSE = b"Logged in through the gateway"
+LOGOUT_RESPONSE = b"Logged out of the gateway"
+LOGIN_ERROR = b"Invalid gateway access token"
+NOT_LOGGED_ERROR = b"Not logged in to the gateway"
+
+# Reference data functions, whose responses are cached and shared by all
+# the local clients
+cachedFunctions = frozenset([
+    "get_stock",
+    "get_client",
+    "get_client_brokerages",
+    "get_investments",
+    "get_setups"
+])
+
+
+##############################################################################
+### SmarttGatewayHandler class - serves one local client connection: reads
+### its messages with the Smartt protocol and answers each one through the
+### gateway, until the client disconnects; the client must log in first if
+### the gateway has an access token
+class SmarttGatewayHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        gateway = self.server.gateway
+        protocol = SmarttSimpleProtocol(
+            self.request.recv, self.request.sendall,
+            decode_policy=SmarttSimpleProtocol.DECODE_RAW)
+        logged = gateway.token is None
+        while True:
+            try:
+                message = protocol.receive()
+            except (EOFError, OSError):
+                return
+            if not message:
+                continue
+
+            if message[0] == b"login":
+                logged = gateway.checkLogin(message)
+                response = ([LOGIN_RESPONSE] if logged else
+                            [b"ERROR", LOGIN_ERROR])
+            elif message[0] == b"logout":
+                logged = gateway.token is None
+                response = [LOGOUT_RESPONSE]
+            elif not logged:
+                response = [b"ERROR", NOT_LOGGED_ERROR]
+            else:
+                response = gateway.answer(message)
+            protocol.send(response)
+
+##############################################################################
+
+
+class SmarttThreadingTcpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class SmarttThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+##############################################################################
+### SmarttGateway class - accepts local clients (speaking the same protocol
+### as the server, so a SmarttClient just has to point host and port, or
+### unix_socket, at it) and multiplexes their requests onto a small pool of
+### upstream sessions created by client_factory, which must return logged in
+### clients using the DECODE_RAW policy, so the responses go back exactly as
+### received; reference data responses are cached for cache_ttl seconds;
+### the local clients share the upstream sessions, so they must log in with
+### the access token as their password (any login) - without a token, the
+### gateway only serves on a Unix socket, accessible by its user only
+class SmarttGateway(object):
+
+    MAXIMUM_CACHE_SIZE = 4096
+
+    def __init__(self, client_factory, sessions=2, cache_ttl=60.0,
+                 token=None):
+        self.client_factory = client_factory
+        self.cache_ttl = cache_ttl
+        self.token = (token.encode(SmarttSimpleProtocol.SERVER_ENCODING)
+                      if isinstance(token, str) else token)
+        self.cache = {}
+        self.cache_lock = threading.Lock()
+        self.server = None
+        # Idle upstream sessions
+        self.sessions = queue.Queue()
+        for _ in range(sessions):
+            self.sessions.put(self.newSession())
+
+    def newSession(self):
+        client = self.client_factory()
+        if client.protocol.decode_policy != SmarttSimpleProtocol.DECODE_RAW:
+            raise SmarttClientException("Gateway sessions must use the "
+                                        "DECODE_RAW policy")
+        return client
+
+    ##########################################################################
+    ### Serving ###
+    ###############
+
+    ### Serves local clients on a Unix socket (path, created with mode 0600)
+    ### or on a TCP port (only with an access token, as any local user can
+    ### connect to it) - blocks until shutdown is called (from another
+    ### thread)
+    def serve(self, path=None, host="127.0.0.1", port=5060):
+        if path is not None:
+            if os.path.exists(path):
+                os.unlink(path)
+            # Only the user of the gateway may connect, from the start
+            umask = os.umask(0o177)
+            try:
+                self.server = SmarttThreadingUnixServer(path,
+                                                        SmarttGatewayHandler)
+            finally:
+                os.umask(umask)
+        elif self.token is None:
+            raise SmarttClientException("An access token is needed to serve "
+                                        "on TCP")
+        else:
+            self.server = SmarttThreadingTcpServer((host, port),
+                                                   SmarttGatewayHandler)
+        self.server.gateway = self
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if path is not None and os.path.exists(path):
+                os.unlink(path)
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+    ##########################################################################
+
+    ##########################################################################
+    ### Requests ###
+    ################
+
+    ### Whether a login message (bytes tokens) of a local client has the
+    ### access token as its password
+    def checkLogin(self, message):
+        if self.token is None:
+            return True
+        for token in message[1:]:
+            (name, _, value) = token.partition(b"=")
+            if name == b"s10i_password":
+                return hmac.compare_digest(value, self.token)
+        return False
+
+    ### Returns the response to a message (bytes tokens) of a logged in
+    ### local client - login and logout are handled by the connection (see
+    ### SmarttGatewayHandler)
+    def answer(self, message):
+        function = message[0].decode(SmarttSimpleProtocol.SERVER_ENCODING)
+        if function not in cachedFunctions:
+            return self.forward(message)
+
+        key = tuple(message)
+        now = time.time()
+        with self.cache_lock:
+            cached = self.cache.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        response = self.forward(message)
+        if not response or response[0] != b"ERROR":
+            with self.cache_lock:
+                if len(self.cache) >= self.MAXIMUM_CACHE_SIZE:
+                    self.cache.clear()
+                self.cache[key] = (now + self.cache_ttl, response)
+        return response
+
+    # Exchanges the message through the first idle upstream session; a
+    # session which fails is replaced by a new one
+    def forward(self, message):
+        client = self.sessions.get()
+        try:
+            response = client.requestMessage(message)
+        except (EOFError, OSError) as e:
+            try:
+                client = self.newSession()
+            except (SmarttClientException, OSError) as new_session_error:
+                e = new_session_error
+            return [b"ERROR", ("Gateway upstream failure: %s" % e).encode(
+                SmarttSimpleProtocol.SERVER_ENCODING, "replace")]
+        finally:
+            self.sessions.put(client)
+        return response
+
+    def clearCache(self):
+        with self.cache_lock:
+            self.cache.clear()
+    ##########################################################################
+
+##############################################################################
+
+
+##############################################################################
+### Main function - runs a gateway as a daemon process ###
+##########################################################
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Smartt Client Gateway")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="serve on a Unix socket instead of TCP")
+    parser.add_argument("--listen-host", default="127.0.0.1")
+    parser.add_argument("--listen-port", type=int, default=5060)
+    parser.add_argument("--sessions", type=int, default=2,
+                        help="number of upstream sessions")
+    parser.add_argument("--cache-ttl", type=float, default=60.0,
+                        help="seconds the reference data is cached")
+    parser.add_argument("--login", required=True, help="login of the "
+                        "upstream sessions (the password is read from "
+                        "SMARTT_PASSWORD or asked)")
+    parser.add_argument("--host", default="smartt.s10i.com.br")
+    parser.add_argument("--port", type=int, default=5060)
+    parser.add_argument("--no-ssl", action="store_true",
+                        help="don't use SSL upstream")
+    args = parser.parse_args()
+
+    # Password of the local clients
+    token = os.environ.get("SMARTT_GATEWAY_TOKEN")
+    if args.socket is None and token is None:
+        parser.error("SMARTT_GATEWAY_TOKEN is needed to serve on TCP (or "
+                     "use --socket)")
+
+    password = os.environ.get("SMARTT_PASSWORD")
+    if password is None:
+        import getpass
+        password = getpass.getpass()
+
+    def client_factory():
+        client = SmarttClient(args.host, args.port, use_ssl=not args.no_ssl,
+                              decode_policy=SmarttSimpleProtocol.DECODE_RAW)
+        client.login(args.login, password)
+        return client
+
+    gateway = SmarttGateway(client_factory, args.sessions, args.cache_ttl,
+                            token)
+    sys.stderr.write("Gateway serving on %s\n" % (
+        args.socket or "%s:%d" % (args.listen_host, args.listen_port)))
+    try:
+        gateway.serve(args.socket, args.listen_host, args.listen_port)
+    except KeyboardInterrupt:
+        pass
+##############################################################################
+
+
+### If trying to run from here, you're welcome!
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+
+# Standard library imports
+import datetime
+import itertools
+import threading
+
+# Local imports
+from .smartt_client import SmarttClientException
+from .smartt_schema import asDicts
+
+
+# Smallest datetime step understood by the server (see formatDatetime)
+ONE_SECOND = datetime.timedelta(seconds=1)
+
+
+##############################################################################
+### SmarttHistoryFetcher class - splits history queries over long periods of
+### time in smaller windows, so each reply has a manageable size, and merges
+### the results back in order; the window size adapts to the number of rows
+### returned by the previous windows, and if more than one client is given
+### the windows are fetched in parallel (one connection per client)
+class SmarttHistoryFetcher(object):
+
+    # Functions which take the initialDatetime/finalDatetime parameters
+    historyFunctions = [
+        "getOrders",
+        "getOrdersEvents",
+        "getStopOrders",
+        "getStopOrdersEvents",
+        "getTrades"
+    ]
+
+    ### Init function - clients may be a single (logged in) SmarttClient or a
+    ### list of them; target_rows is the desired number of rows per reply
+    def __init__(self, clients, window=datetime.timedelta(days=7),
+                 minimum_window=datetime.timedelta(hours=1),
+                 maximum_window=datetime.timedelta(days=180),
+                 target_rows=5000):
+        if not isinstance(clients, (list, tuple)):
+            clients = [clients]
+        if len(clients) == 0:
+            raise SmarttClientException("No clients given to fetch history")
+
+        self.clients = list(clients)
+        self.window = window
+        self.minimum_window = minimum_window
+        self.maximum_window = maximum_window
+        self.target_rows = target_rows
+        # Maximum number of fetched windows waiting to be consumed
+        self.maximum_pending_windows = 2 * len(self.clients)
+
+    ##########################################################################
+    ### Public interface ###
+    ########################
+
+    ### Returns a generator of the rows returned by the function between the
+    ### initial and final datetimes (both inclusive), in order, as dicts
+    ### (whatever the response format of the clients); the other parameters
+    ### are passed untouched to the client function; finalDatetime may be
+    ### None for no final datetime: the windows go up to the current time of
+    ### the client and the last one is left open, so no rows are missed
+    ### whatever the difference between the client and server clocks
+    def iterate(self, functionName, initialDatetime, finalDatetime,
+                **parameters):
+        return itertools.chain.from_iterable(self.iterateWindows(
+            functionName, initialDatetime, finalDatetime, **parameters))
+
+    ### Same as iterate, but yields the rows of each window as a list
+    def iterateWindows(self, functionName, initialDatetime, finalDatetime,
+                       **parameters):
+        if functionName not in self.historyFunctions:
+            raise SmarttClientException("Function doesn't support datetime "
+                                        "windows: " + functionName)
+        openEnded = finalDatetime is None
+        if openEnded:
+            finalDatetime = max(datetime.datetime.now().replace(microsecond=0),
+                                initialDatetime)
+        if initialDatetime > finalDatetime:
+            raise SmarttClientException("Initial datetime after final "
+                                        "datetime")
+
+        if len(self.clients) == 1:
+            return self.iterateSequential(functionName, initialDatetime,
+                                          finalDatetime, openEnded,
+                                          parameters)
+        return self.iterateParallel(functionName, initialDatetime,
+                                    finalDatetime, openEnded, parameters)
+
+    ### Same as iterate, but returns the complete list of rows
+    def fetch(self, functionName, initialDatetime, finalDatetime,
+              **parameters):
+        return list(self.iterate(functionName, initialDatetime,
+                                 finalDatetime, **parameters))
+    ##########################################################################
+
+    ##########################################################################
+    ### Helper functions ###
+    ########################
+    # The rows of a window as a list of dicts, so they can be counted (the
+    # last window is left open if openEnded)
+    def fetchWindow(self, client, functionName, start, end, finalDatetime,
+                    openEnded, parameters):
+        if openEnded and end >= finalDatetime:
+            end = None
+        function = getattr(client, functionName)
+        return asDicts(function(initialDatetime=start, finalDatetime=end,
+                                **parameters))
+
+    def windowEnd(self, start, window, finalDatetime):
+        return min(start + window - ONE_SECOND, finalDatetime)
+
+    # Computes the next window size from the number of rows returned in the
+    # last one, limiting the change to a factor of 4 in each direction
+    def adaptWindow(self, start, end, rows):
+        used_seconds = ((end - start) + ONE_SECOND).total_seconds()
+        factor = float(self.target_rows) / max(rows, 1)
+        factor = min(max(factor, 0.25), 4.0)
+
+        window = datetime.timedelta(seconds=int(used_seconds * factor))
+        return min(max(window, self.minimum_window), self.maximum_window)
+
+    def iterateSequential(self, functionName, initialDatetime, finalDatetime,
+                          openEnded, parameters):
+        client = self.clients[0]
+        window = self.window
+        start = initialDatetime
+
+        while start <= finalDatetime:
+            end = self.windowEnd(start, window, finalDatetime)
+            rows = self.fetchWindow(client, functionName, start, end,
+                                    finalDatetime, openEnded, parameters)
+            yield rows
+
+            window = self.adaptWindow(start, end, len(rows))
+            start = end + ONE_SECOND
+
+    # Each client gets its own worker thread, which takes the next window
+    # not yet fetched; the results are yielded in the windows order, as soon
+    # as they are available
+    def iterateParallel(self, functionName, initialDatetime, finalDatetime,
+                        openEnded, parameters):
+        condition = threading.Condition()
+        state = {
+            "next_start": initialDatetime,
+            "window": self.window,
+            "issued": 0,
+            "consumed": 0,
+            "running": len(self.clients),
+            "stopped": False
+        }
+        results = {}
+
+        def worker(client):
+            try:
+                while True:
+                    with condition:
+                        while (not state["stopped"] and
+                               state["issued"] - state["consumed"] >=
+                               self.maximum_pending_windows):
+                            condition.wait()
+                        if (state["stopped"] or
+                                state["next_start"] > finalDatetime):
+                            return
+
+                        index = state["issued"]
+                        start = state["next_start"]
+                        end = self.windowEnd(start, state["window"],
+                                             finalDatetime)
+                        state["issued"] += 1
+                        state["next_start"] = end + ONE_SECOND
+
+                    try:
+                        result = self.fetchWindow(client, functionName,
+                                                  start, end, finalDatetime,
+                                                  openEnded, parameters)
+                    except BaseException as e:
+                        result = e
+
+                    with condition:
+                        results[index] = result
+                        if not isinstance(result, BaseException):
+                            state["window"] = self.adaptWindow(start, end,
+                                                               len(result))
+                        else:
+                            state["stopped"] = True
+                        condition.notify_all()
+            finally:
+                with condition:
+                    state["running"] -= 1
+                    condition.notify_all()
+
+        for client in self.clients:
+            thread = threading.Thread(target=worker, args=(client,))
+            thread.daemon = True
+            thread.start()
+
+        try:
+            index = 0
+            while True:
+                with condition:
+                    while (index not in results and
+                           (state["running"] > 0 or index < state["issued"])):
+                        condition.wait()
+                    if index not in results:
+                        return
+
+                    result = results.pop(index)
+                    state["consumed"] += 1
+                    condition.notify_all()
+
+                if isinstance(result, BaseException):
+                    raise result
+                yield result
+                index += 1
+        finally:
+            with condition:
+                state["stopped"] = True
+                condition.notify_all()
+    ##########################################################################
+
+##############################################################################
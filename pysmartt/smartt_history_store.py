@@ -0,0 +1,303 @@
+
+# Standard library imports
+import datetime
+import re
+import sqlite3
+import threading
+
+# Local imports
+from .smartt_client import SmarttClient
+from .smartt_client import SmarttClientException
+from .smartt_history import SmarttHistoryFetcher
+from .smartt_orders import FINAL_ORDER_STATUSES
+from .smartt_schema import decodeRow
+from .smartt_schema import iterDicts
+
+
+# Datetime and date formats used by the server (see
+# SmarttClient.formatDatetime)
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+DATE_FORMAT = "%Y-%m-%d"
+
+
+##############################################################################
+### SmarttHistoryStore class - keeps a local SQLite copy of the orders, trades
+### and orders events of the investments, so that only the records newer
+### than the ones already stored have to be downloaded from the server; the
+### local queries take the same filters as the equivalent client functions
+class SmarttHistoryStore(object):
+
+    # Stored tables: client function, attributes (columns), unique key,
+    # whether an already stored record should be replaced by a new version
+    # and the statuses after which a record doesn't change anymore (the
+    # stored records in other statuses are downloaded again on each sync)
+    tables = {
+        "trades": {
+            "function": "getTrades",
+            "attributes": SmarttClient.getTradesAttributes,
+            "key": ["brokerage_id", "order_id", "trade_id_in_brokerage"],
+            "replace": False,
+            "final_statuses": None
+        },
+        "orders": {
+            "function": "getOrders",
+            "attributes": SmarttClient.getOrdersAttributes,
+            "key": ["order_id"],
+            "replace": True,
+            "final_statuses": FINAL_ORDER_STATUSES
+        },
+        "orders_events": {
+            "function": "getOrdersEvents",
+            "attributes": SmarttClient.getOrdersEventsAttributes,
+            "key": ["order_id", "number_of_events", "event_type", "datetime"],
+            "replace": False,
+            "final_statuses": None
+        }
+    }
+
+    ### Init function - opens (creating if needed) the database file; the
+    ### fetcher_options are passed to the SmarttHistoryFetcher used to
+    ### download the missing records
+    def __init__(self, path, **fetcher_options):
+        self.path = path
+        self.fetcher_options = fetcher_options
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.createTables()
+
+    def close(self):
+        self.connection.close()
+
+    ##########################################################################
+    ### Synchronization with the server ###
+    #######################################
+
+    ### Downloads the records of the investment newer than the latest one
+    ### already stored and stores them, along with the new versions of the
+    ### stored records which may still change (e.g. orders not executed or
+    ### canceled yet); the first synchronization starts at initialDatetime
+    ### or, if not given, at the initial datetime of the investment, and goes
+    ### up to finalDatetime or, if not given, to the latest records of the
+    ### server; each window of records is downloaded first and then stored
+    ### in its own transaction, so the local queries aren't blocked by the
+    ### download and a failed one keeps the windows already stored; returns
+    ### the number of records written (the new ones and the ones downloaded
+    ### again)
+    def sync(self, clients, tableName, investmentCode=None, brokerageId=None,
+             initialDatetime=None, finalDatetime=None):
+        table = self.table(tableName)
+        client = clients[0] if isinstance(clients, (list, tuple)) else clients
+
+        latest = self.latestDatetime(tableName, investmentCode, brokerageId)
+        if latest is not None:
+            # The latest second may have records not received yet - the
+            # ones already stored are ignored by the unique key
+            initialDatetime = latest
+        elif initialDatetime is None:
+            initialDatetime = self.investmentStart(client, investmentCode,
+                                                   brokerageId)
+        changing = self.changingRecords(tableName, investmentCode,
+                                        brokerageId)
+
+        fetcher = SmarttHistoryFetcher(clients, **self.fetcher_options)
+        changes = 0
+        for rows in fetcher.iterateWindows(
+                table["function"], initialDatetime, finalDatetime,
+                investmentCode=investmentCode, brokerageId=brokerageId,
+                returnAttributes=table["attributes"]):
+            changes += self.insert(tableName, rows)
+
+        if changing:
+            changes += self.insert(tableName, self.fetchRecords(
+                client, tableName, changing))
+        return changes
+
+    def syncTrades(self, clients, investmentCode=None, brokerageId=None,
+                   initialDatetime=None):
+        return self.sync(clients, "trades", investmentCode, brokerageId,
+                         initialDatetime)
+
+    def syncOrders(self, clients, investmentCode=None, brokerageId=None,
+                   initialDatetime=None):
+        return self.sync(clients, "orders", investmentCode, brokerageId,
+                         initialDatetime)
+
+    def syncOrdersEvents(self, clients, investmentCode=None, brokerageId=None,
+                         initialDatetime=None):
+        return self.sync(clients, "orders_events", investmentCode,
+                         brokerageId, initialDatetime)
+
+    ### Stores the rows of a list response (as returned by the client, in any
+    ### response format and decoding policy - the values are stored as text)
+    ### in a single transaction; the rows are read before taking the lock,
+    ### so lazy ones are received from the server outside of it
+    def insert(self, tableName, rows):
+        table = self.table(tableName)
+        attributes = table["attributes"]
+        statement = "INSERT OR %s INTO %s (%s) VALUES (%s)" % (
+            "REPLACE" if table["replace"] else "IGNORE", tableName,
+            ", ".join(attributes), ", ".join(["?"] * len(attributes)))
+        values = [tuple(row.get(attribute) for attribute in attributes)
+                  for row in iterDicts(rows)]
+
+        with self.lock:
+            before = self.connection.total_changes
+            with self.connection:
+                self.connection.executemany(statement, values)
+            return self.connection.total_changes - before
+
+    # Start of the history of the investment, for its first synchronization
+    def investmentStart(self, client, investmentCode, brokerageId):
+        if investmentCode is None:
+            raise SmarttClientException("The initial datetime is needed to "
+                                        "synchronize all the investments")
+        investment = decodeRow(client.getInvestments(
+            investmentCode, brokerageId, ["initial_datetime"]))
+        value = investment.get("initial_datetime")
+        for datetime_format in [DATETIME_FORMAT, DATE_FORMAT]:
+            try:
+                return datetime.datetime.strptime(value, datetime_format)
+            except (TypeError, ValueError):
+                pass
+        raise SmarttClientException("Invalid initial datetime of the "
+                                    "investment: " + str(value))
+
+    # Keys (the first key attribute) of the stored records which may still
+    # change
+    def changingRecords(self, tableName, investmentCode=None,
+                        brokerageId=None):
+        table = self.table(tableName)
+        if table["final_statuses"] is None:
+            return []
+
+        (where, values) = self.formatConditions(investmentCode=investmentCode,
+                                                brokerageId=brokerageId)
+        statuses = sorted(table["final_statuses"])
+        where += (" AND " if where else " WHERE ") + \
+            "status NOT IN (%s)" % ", ".join(["?"] * len(statuses))
+        with self.lock:
+            return [row[0] for row in self.connection.execute(
+                "SELECT %s FROM %s%s" % (table["key"][0], tableName, where),
+                values + statuses)]
+
+    # Downloads the current version of the records, in a single pipelined
+    # round trip
+    def fetchRecords(self, client, tableName, keys):
+        table = self.table(tableName)
+        parameter = re.sub("_([a-z0-9])", lambda m: m.group(1).upper(),
+                           table["key"][0])
+        pipeline = client.pipeline()
+        for (arguments, future) in pipeline.map(
+                table["function"],
+                ({parameter: key, "returnAttributes": table["attributes"]}
+                 for key in keys)):
+            for row in iterDicts(future.result()):
+                yield row
+
+    def latestDatetime(self, tableName, investmentCode=None,
+                       brokerageId=None):
+        self.table(tableName)
+        (where, values) = self.formatConditions(investmentCode=investmentCode,
+                                                brokerageId=brokerageId)
+        with self.lock:
+            latest = self.connection.execute(
+                "SELECT MAX(datetime) FROM %s%s" % (tableName, where),
+                values).fetchone()[0]
+
+        if latest is None:
+            return None
+        return datetime.datetime.strptime(latest, DATETIME_FORMAT)
+    ##########################################################################
+
+    ##########################################################################
+    ### Local queries - same parameters as the client functions ###
+    ###############################################################
+    def getTrades(self, orderId = None, investmentCode = None, brokerageId = None, initialDatetime = None, finalDatetime = None, returnAttributes = None):
+        return self.query("trades", returnAttributes, orderId=orderId,
+                          investmentCode=investmentCode,
+                          brokerageId=brokerageId,
+                          initialDatetime=initialDatetime,
+                          finalDatetime=finalDatetime)
+
+    def getOrders(self, orderId = None, investmentCode = None, brokerageId = None, initialDatetime = None, finalDatetime = None, status = None, returnAttributes = None):
+        return self.query("orders", returnAttributes, orderId=orderId,
+                          investmentCode=investmentCode,
+                          brokerageId=brokerageId,
+                          initialDatetime=initialDatetime,
+                          finalDatetime=finalDatetime, status=status)
+
+    def getOrdersEvents(self, orderId = None, investmentCode = None, brokerageId = None, initialDatetime = None, finalDatetime = None, eventType = None, returnAttributes = None):
+        return self.query("orders_events", returnAttributes, orderId=orderId,
+                          investmentCode=investmentCode,
+                          brokerageId=brokerageId,
+                          initialDatetime=initialDatetime,
+                          finalDatetime=finalDatetime, eventType=eventType)
+    ##########################################################################
+
+    ##########################################################################
+    ### Helper functions ###
+    ########################
+    def table(self, tableName):
+        if tableName not in self.tables:
+            raise SmarttClientException("Invalid history table: " + tableName)
+        return self.tables[tableName]
+
+    def createTables(self):
+        with self.lock:
+            with self.connection:
+                for (tableName, table) in self.tables.items():
+                    self.connection.execute(
+                        "CREATE TABLE IF NOT EXISTS %s (%s, UNIQUE (%s))" % (
+                            tableName, ", ".join(table["attributes"]),
+                            ", ".join(table["key"])))
+                    self.connection.execute(
+                        "CREATE INDEX IF NOT EXISTS %s_investment ON %s "
+                        "(investment_code, brokerage_id, datetime)" % (
+                            tableName, tableName))
+                    self.connection.execute(
+                        "CREATE INDEX IF NOT EXISTS %s_datetime ON %s "
+                        "(datetime)" % (tableName, tableName))
+                    self.connection.execute(
+                        "CREATE INDEX IF NOT EXISTS %s_order ON %s "
+                        "(order_id)" % (tableName, tableName))
+
+    def formatConditions(self, orderId=None, investmentCode=None,
+                         brokerageId=None, initialDatetime=None,
+                         finalDatetime=None, status=None, eventType=None):
+        conditions = []
+        values = []
+        for (condition, value) in [
+                ("order_id = ?", orderId),
+                ("investment_code = ?", investmentCode),
+                ("brokerage_id = ?", brokerageId),
+                ("datetime >= ?", initialDatetime),
+                ("datetime <= ?", finalDatetime),
+                ("status = ?", status),
+                ("event_type = ?", eventType)]:
+            if value is None:
+                continue
+            if isinstance(value, datetime.datetime):
+                value = value.strftime(DATETIME_FORMAT)
+            conditions.append(condition)
+            values.append(str(value))
+
+        if not conditions:
+            return ("", values)
+        return (" WHERE " + " AND ".join(conditions), values)
+
+    def query(self, tableName, returnAttributes, **filters):
+        table = self.table(tableName)
+        attributes = returnAttributes or table["attributes"]
+        for attribute in attributes:
+            if attribute not in table["attributes"]:
+                raise SmarttClientException("Invalid attribute: " + attribute)
+
+        (where, values) = self.formatConditions(**filters)
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT %s FROM %s%s ORDER BY datetime" % (
+                    ", ".join(attributes), tableName, where), values)
+            return [dict(zip(attributes, row)) for row in cursor]
+    ##########################################################################
+
+##############################################################################
@@ -0,0 +1,127 @@
+
+# Standard library imports
+import datetime
+import time
+
+# Local imports
+from .smartt_schema import asDicts
+
+
+# Format of the server datetimes
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Period before the current time (of the client) from which the events are
+# compared on the first attempt, unless a start is given - wide enough for
+# any difference between the client and server clocks
+EVENTS_WINDOW = datetime.timedelta(days=1)
+
+
+# Latest server datetime of the rows (decoded dicts), or latest if later or
+# if there is none
+def latestDatetime(rows, latest=None):
+    values = [row["datetime"] for row in rows if row.get("datetime")]
+    if values:
+        value = datetime.datetime.strptime(max(values), DATETIME_FORMAT)
+        if latest is None or value > latest:
+            return value
+    return latest
+
+
+# Events of the second read which weren't in the first one (both decoded
+# dicts, see asDicts)
+def newEvents(before, after):
+    seen = set(tuple(sorted(event.items())) for event in before)
+    return [event for event in after
+            if tuple(sorted(event.items())) not in seen]
+
+
+##############################################################################
+### SmarttInvestmentSnapshot class - the state of an investment read at once
+### (see takeSnapshot): the results of getPortfolio, getAvailableLimits,
+### getOrders and getStopOrders (in the client response format), the
+### datetime when they were requested (by the client clock - the server
+### doesn't tell its time) and the order and stop order events which
+### happened while they were read (changes) - consistent if none
+class SmarttInvestmentSnapshot(object):
+
+    def __init__(self, investmentCode, brokerageId, timestamp, elapsed,
+                 portfolio, limits, orders, stopOrders, changes, attempts):
+        self.investment_code = investmentCode
+        self.brokerage_id = brokerageId
+        self.timestamp = timestamp
+        self.elapsed = elapsed
+        self.portfolio = portfolio
+        self.limits = limits
+        self.orders = orders
+        self.stop_orders = stopOrders
+        self.changes = changes
+        self.attempts = attempts
+
+    @property
+    def consistent(self):
+        return not self.changes
+
+    def __repr__(self):
+        return ("SmarttInvestmentSnapshot(%r, timestamp=%s, consistent=%s, "
+                "attempts=%d)" % (self.investment_code, self.timestamp,
+                                  self.consistent, self.attempts))
+
+##############################################################################
+
+
+### Reads the portfolio, available limits, orders and stop orders of an
+### investment in a single pipelined round trip, between two reads of the
+### order and stop order events (all of them in the same pipeline, answered
+### in order by the server): events found only by the second read changed
+### the investment while it was read, and the reads are repeated, up to
+### "attempts" times - the last snapshot is returned even if inconsistent
+### (see SmarttInvestmentSnapshot.changes); the events are read since
+### "since" (a server datetime, by default EVENTS_WINDOW before the current
+### time) and, on the next attempts, since the latest server datetime of
+### the events already read, so the events of the read window are always
+### included
+def takeSnapshot(client, investmentCode, brokerageId=None, attempts=3,
+                 since=None):
+    if since is None:
+        since = datetime.datetime.now().replace(microsecond=0) - EVENTS_WINDOW
+
+    attempt = 0
+    while True:
+        attempt += 1
+        timestamp = datetime.datetime.now()
+        start = time.monotonic()
+
+        with client.pipeline() as pipeline:
+            ordersEvents = pipeline.getOrdersEvents(
+                investmentCode=investmentCode, brokerageId=brokerageId,
+                initialDatetime=since)
+            stopOrdersEvents = pipeline.getStopOrdersEvents(
+                investmentCode=investmentCode, brokerageId=brokerageId,
+                initialDatetime=since)
+            portfolio = pipeline.getPortfolio(investmentCode, brokerageId)
+            limits = pipeline.getAvailableLimits(investmentCode, brokerageId)
+            orders = pipeline.getOrders(investmentCode=investmentCode,
+                                        brokerageId=brokerageId)
+            stopOrders = pipeline.getStopOrders(investmentCode=investmentCode,
+                                                brokerageId=brokerageId)
+            lastOrdersEvents = pipeline.getOrdersEvents(
+                investmentCode=investmentCode, brokerageId=brokerageId,
+                initialDatetime=since)
+            lastStopOrdersEvents = pipeline.getStopOrdersEvents(
+                investmentCode=investmentCode, brokerageId=brokerageId,
+                initialDatetime=since)
+
+        # Each read is decoded once (lazy lists can only be iterated once)
+        lastEvents = [asDicts(lastOrdersEvents.result()),
+                      asDicts(lastStopOrdersEvents.result())]
+        changes = (newEvents(asDicts(ordersEvents.result()), lastEvents[0]) +
+                   newEvents(asDicts(stopOrdersEvents.result()),
+                             lastEvents[1]))
+        snapshot = SmarttInvestmentSnapshot(
+            investmentCode, brokerageId, timestamp, time.monotonic() - start,
+            portfolio.result(), limits.result(), orders.result(),
+            stopOrders.result(), changes, attempt)
+        if snapshot.consistent or attempt >= attempts:
+            return snapshot
+        for events in lastEvents:
+            since = latestDatetime(events, since)
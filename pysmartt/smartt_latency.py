@@ -0,0 +1,241 @@
+
+# Standard library imports
+import collections
+import csv
+import datetime
+import threading
+import time
+
+# Local imports
+from .smartt_client import SmarttClient
+from .smartt_client import SmarttClientException
+from .smartt_schema import asDicts
+from .smartt_simple_protocol import decodeToken
+
+
+# Order lifecycle stages, in order - all timestamped locally (as the order
+# replies are received or the events observed)
+STAGES = ["sent", "acknowledged", "order_sent", "first_execution",
+          "cancel_sent", "canceled"]
+
+# Measured latencies: name, initial stage and final stage
+LATENCIES = [
+    ("acknowledgment", "sent", "acknowledged"),
+    ("order_sent", "sent", "order_sent"),
+    ("first_execution", "sent", "first_execution"),
+    ("cancel", "cancel_sent", "canceled")
+]
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Events of getOrdersEvents which mark a stage of the order
+EVENT_STAGES = {
+    "order_sent": "order_sent",
+    "order_executed": "first_execution",
+    "order_canceled": "canceled"
+}
+
+
+def percentile(sorted_values, fraction):
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+##############################################################################
+### SmarttLatencyTracker class - timestamps the stages of the lifecycle of the
+### orders sent through a client (send, reply, "order_sent" event, first
+### execution and cancel), correlating them by the order id returned by
+### sendOrder, and reports latency percentiles per stock or market; the
+### events are observed whenever the client receives a getOrdersEvents
+### response (see poll), so their timestamps are as precise as the polling
+class SmarttLatencyTracker(object):
+
+    ### Init function - only the last max_orders orders are kept
+    def __init__(self, max_orders=100000):
+        self.max_orders = max_orders
+        self.lock = threading.Lock()
+        self.orders = collections.OrderedDict()
+
+    ##########################################################################
+    ### Client hooks (see SmarttClient.smarttFunction and ###
+    ### SmarttClient.pipelineMessages) ###
+    ######################################
+    def requestSent(self, message):
+        return time.time()
+
+    def responseReceived(self, message, response, sent_time):
+        now = time.time()
+        if len(response) > 0 and response[0] in ("ERROR", b"ERROR"):
+            return
+
+        function = message[0]
+        if function == "send_order":
+            parameters = self.parseMessage(message)
+            record = dict((stage, None) for stage in STAGES)
+            record.update({
+                "order_id": int(response[1]),
+                # Server datetime of the order, known once polled
+                "datetime": None,
+                "stock_code": parameters.get("stock_code"),
+                "market_name": parameters.get("market_name"),
+                "sent": sent_time,
+                "acknowledged": now
+            })
+            with self.lock:
+                self.orders[record["order_id"]] = record
+                while len(self.orders) > self.max_orders:
+                    self.orders.popitem(last=False)
+        elif function == "cancel_order":
+            order_id = int(self.parseMessage(message)["order_id"])
+            with self.lock:
+                record = self.orders.get(order_id)
+                # Canceled when the "order_canceled" event is seen
+                if record is not None:
+                    record["cancel_sent"] = sent_time
+        elif function == "get_orders_events":
+            attributes = self.parseMessage(message).get("return_attributes")
+            attributes = (attributes.split(",") if attributes
+                          else SmarttClient.getOrdersEventsAttributes)
+            k = len(attributes)
+            self.observeOrdersEvents(
+                [dict(zip(attributes, map(decodeToken, response[i:i + k])))
+                 for i in range(0, len(response), k)], now)
+    ##########################################################################
+
+    ##########################################################################
+    ### Events ###
+    ##############
+
+    ### Marks the stages of the events (as returned by getOrdersEvents, with
+    ### at least the order_id and event_type attributes) not seen before,
+    ### and the server datetimes of the orders (if the events have them)
+    def observeOrdersEvents(self, events, observed_time=None):
+        if observed_time is None:
+            observed_time = time.time()
+
+        with self.lock:
+            for event in events:
+                stage = EVENT_STAGES.get(event.get("event_type"))
+                if stage is None or "order_id" not in event:
+                    continue
+                record = self.orders.get(int(event["order_id"]))
+                if record is None:
+                    continue
+                if record["datetime"] is None and event.get("datetime"):
+                    record["datetime"] = event["datetime"]
+                if record[stage] is None:
+                    record[stage] = observed_time
+
+    ### Asks the server for the events of the investment since the oldest
+    ### order still waiting for an event (by the server datetimes of the
+    ### orders, asked first for the ones not known yet); the response is
+    ### observed through the client hooks
+    def poll(self, client, investmentCode, brokerageId=None):
+        with self.lock:
+            # Orders waiting for their cancel, and the other ones for their
+            # first execution
+            pending = [record for record in self.orders.values()
+                       if record["canceled"] is None and
+                       (record["cancel_sent"] is not None or
+                        record["first_execution"] is None)]
+            unknown = [record["order_id"] for record in pending
+                       if record["datetime"] is None]
+        if not pending:
+            return
+
+        if unknown:
+            self.fetchDatetimes(client, unknown)
+        with self.lock:
+            datetimes = [record["datetime"] for record in pending
+                         if record["datetime"] is not None]
+        if not datetimes:
+            return
+
+        client.getOrdersEvents(
+            investmentCode=investmentCode, brokerageId=brokerageId,
+            initialDatetime=datetime.datetime.strptime(min(datetimes),
+                                                       DATETIME_FORMAT),
+            returnAttributes=["order_id", "event_type", "datetime"])
+
+    # Asks the server datetimes of the orders, in a single pipelined round
+    # trip (orders not found are asked again on the next poll)
+    def fetchDatetimes(self, client, orderIds):
+        calls = client.pipeline().map(
+            "getOrders", ({"orderId": orderId,
+                           "returnAttributes": ["order_id", "datetime"]}
+                          for orderId in orderIds))
+        for (arguments, future) in calls:
+            try:
+                orders = asDicts(future.result())
+            except SmarttClientException:
+                continue
+            with self.lock:
+                for order in orders:
+                    record = self.orders.get(int(order["order_id"]))
+                    if record is not None and record["datetime"] is None:
+                        record["datetime"] = order["datetime"]
+    ##########################################################################
+
+    ##########################################################################
+    ### Reports ###
+    ###############
+
+    ### Returns, for each value of the group attribute ("stock_code" or
+    ### "market_name"), the count and percentiles (in seconds) of each
+    ### latency
+    def report(self, groupBy="stock_code",
+               percentiles=(0.5, 0.9, 0.99)):
+        samples = collections.defaultdict(lambda: collections.defaultdict(list))
+        with self.lock:
+            for record in self.orders.values():
+                for (name, start, end) in LATENCIES:
+                    if record[start] is not None and record[end] is not None:
+                        samples[record[groupBy]][name].append(
+                            record[end] - record[start])
+
+        report = {}
+        for (group, latencies) in samples.items():
+            report[group] = {}
+            for (name, values) in latencies.items():
+                values.sort()
+                statistics = {"count": len(values), "max": values[-1]}
+                for fraction in percentiles:
+                    statistics["p%g" % (fraction * 100)] = \
+                        percentile(values, fraction)
+                report[group][name] = statistics
+        return report
+
+    ### Writes the report in the Prometheus text format, for monitoring
+    def exportMetrics(self, output, groupBy="stock_code",
+                      prefix="smartt_order_latency_seconds"):
+        output.write("# TYPE %s summary\n" % prefix)
+        for (group, latencies) in sorted(self.report(groupBy).items(),
+                                         key=lambda item: str(item[0])):
+            for (name, statistics) in sorted(latencies.items()):
+                labels = '%s="%s",stage="%s"' % (groupBy, group, name)
+                for (key, value) in sorted(statistics.items()):
+                    if key.startswith("p"):
+                        output.write('%s{%s,quantile="%s"} %f\n' % (
+                            prefix, labels, float(key[1:]) / 100, value))
+                output.write("%s_count{%s} %d\n" % (prefix, labels,
+                                                    statistics["count"]))
+
+    ### Writes the timestamps of every tracked order as CSV
+    def exportCsv(self, output):
+        columns = ["order_id", "stock_code", "market_name"] + STAGES
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        with self.lock:
+            for record in self.orders.values():
+                writer.writerow([record[column] for column in columns])
+    ##########################################################################
+
+    ##########################################################################
+    ### Helper functions ###
+    ########################
+    def parseMessage(self, message):
+        return dict(token.split("=", 1) for token in message[1:]
+                    if "=" in token)
+    ##########################################################################
+
+##############################################################################
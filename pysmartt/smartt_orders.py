@@ -0,0 +1,345 @@
+
+# Standard library imports
+import concurrent.futures
+import datetime
+import threading
+import time
+import traceback
+
+# Local imports
+from .smartt_client import SmarttClient
+from .smartt_client import SmarttClientException
+from .smartt_schema import asDicts
+from .smartt_simple_protocol import decodeToken
+
+
+# Statuses after which orders and stop orders don't change anymore (a stop
+# order is "sent" when triggered, the order sent being a new one)
+FINAL_ORDER_STATUSES = frozenset([
+    "canceled",
+    "executed",
+    "partially_canceled",
+    "rejected",
+    "expired"
+])
+
+FINAL_STOP_ORDER_STATUSES = frozenset(
+    status for status in SmarttClient.stopOrderStatuses if status != "hung")
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Attributes requested by the poller
+ORDER_ATTRIBUTES = ["order_id", "datetime", "status", "number_of_traded_stocks",
+                    "average_nominal_price"]
+STOP_ORDER_ATTRIBUTES = ["stop_order_id", "datetime", "status",
+                         "sent_order_id"]
+
+
+##############################################################################
+### SmarttOrderHandle class - the id of an order (or stop order) sent by a
+### client, as returned by sendOrder and sendStopOrder: an int, so it can be
+### used as before, which also follows the status of the order - waitFor,
+### future and onTransition make the poller of the client (see
+### SmarttOrderPoller) watch the order until it reaches a final status
+class SmarttOrderHandle(int):
+
+    def __new__(cls, orderId, poller=None, stop=False, investmentCode=None,
+                brokerageId=None):
+        handle = int.__new__(cls, orderId)
+        handle.poller = poller
+        handle.stop = stop
+        handle.investment_code = investmentCode
+        handle.brokerage_id = brokerageId
+        # Last status and attributes received (see ORDER_ATTRIBUTES and
+        # STOP_ORDER_ATTRIBUTES), None until the first poll
+        handle.status = None
+        handle.previous_status = None
+        handle.order = None
+        # Server datetime of the order, which bounds the polled orders
+        handle.datetime = None
+        # Error of the last poll, if it failed
+        handle.error = None
+        handle.callbacks = []
+        # Futures and the statuses which resolve them
+        handle.futures = []
+        return handle
+
+    # Handles are pickled as plain ints (the poller stays in this process)
+    def __reduce__(self):
+        return (int, (int(self),))
+
+    def finalStatuses(self):
+        return FINAL_STOP_ORDER_STATUSES if self.stop else FINAL_ORDER_STATUSES
+
+    def done(self):
+        return self.status in self.finalStatuses()
+
+    def statuses(self, status):
+        if status is None:
+            return self.finalStatuses()
+        if isinstance(status, str):
+            return frozenset([status])
+        return frozenset(status)
+
+    ### Waits for the order to reach the status (or any of the statuses, if
+    ### a list is given, or any final status, if None); returns False if the
+    ### timeout (in seconds) expires or the order ends in another status
+    def waitFor(self, status=None, timeout=None):
+        statuses = self.statuses(status)
+        condition = self.poller.condition
+        with condition:
+            self.poller.watch(self)
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self.status not in statuses:
+                if self.error is not None:
+                    raise SmarttClientException("Order %d polling failed: %s"
+                                                % (self, self.error))
+                if self.done():
+                    return False
+                if deadline is None:
+                    condition.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    condition.wait(remaining)
+        return True
+
+    # The same name as threading.Condition.wait_for
+    wait_for = waitFor
+
+    ### Returns a concurrent.futures.Future resolved with the order
+    ### attributes when it reaches the status (as in waitFor), or failed
+    ### (with SmarttClientException) if it ends in another status
+    def future(self, status=None):
+        future = concurrent.futures.Future()
+        with self.poller.condition:
+            self.futures.append((self.statuses(status), future))
+            self.poller.watch(self)
+        self.resolveFutures()
+        return future
+
+    ### Makes the poller follow the order until it ends, without waiting
+    ### for it (e.g. for the risk engine of the client to see its trades)
+    def follow(self):
+        with self.poller.condition:
+            self.poller.watch(self)
+
+    ### Calls callback(handle, previousStatus, status) on each status change
+    ### seen by the poller (previousStatus is None on the first poll), from
+    ### the poller thread
+    def onTransition(self, callback):
+        with self.poller.condition:
+            self.callbacks.append(callback)
+            self.poller.watch(self)
+
+    # Updates the attributes with a row of the poll; returns whether the
+    # status changed (must hold the poller condition)
+    def update(self, row):
+        order = dict((name, decodeToken(value))
+                     for (name, value) in row.items())
+        if self.datetime is None and order.get("datetime"):
+            self.datetime = datetime.datetime.strptime(order["datetime"],
+                                                       DATETIME_FORMAT)
+        self.order = order
+        if order["status"] == self.status:
+            return False
+        self.previous_status = self.status
+        self.status = order["status"]
+        return True
+
+    # Resolves the futures whose status was reached (or can't be reached
+    # anymore), outside the poller condition
+    def resolveFutures(self):
+        with self.poller.condition:
+            resolved = []
+            for (statuses, future) in self.futures:
+                if self.status in statuses:
+                    resolved.append((future, self.order, None))
+                elif self.error is not None:
+                    resolved.append((future, None, SmarttClientException(
+                        "Order %d polling failed: %s" % (self, self.error))))
+                elif self.done():
+                    resolved.append((future, None, SmarttClientException(
+                        "Order %d ended as %s" % (self, self.status))))
+            resolved_futures = [future for (future, _, _) in resolved]
+            self.futures = [(statuses, future) for (statuses, future)
+                            in self.futures
+                            if future not in resolved_futures]
+
+        for (future, order, error) in resolved:
+            if future.set_running_or_notify_cancel():
+                if error is None:
+                    future.set_result(order)
+                else:
+                    future.set_exception(error)
+
+    # Calls the callbacks of the last transition, outside the poller condition
+    def notifyTransition(self):
+        for callback in list(self.callbacks):
+            try:
+                callback(self, self.previous_status, self.status)
+            except Exception:
+                traceback.print_exc()
+
+##############################################################################
+
+
+##############################################################################
+### SmarttOrderPoller class - follows the status of the orders watched
+### through their handles with a single thread per client, making a single
+### getOrders (or getStopOrders) request per investment for all of them,
+### instead of one poll per order; the interval between polls starts at
+### minimum_interval and doubles (up to maximum_interval) while nothing
+### changes, going back to the minimum on any change or newly watched order
+class SmarttOrderPoller(object):
+
+    def __init__(self, client, minimum_interval=0.1, maximum_interval=2.0):
+        self.client = client
+        self.minimum_interval = minimum_interval
+        self.maximum_interval = maximum_interval
+        self.condition = threading.Condition()
+        # Watched handles by (stop, order id)
+        self.watched = {}
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.stopping = False
+        # Number of requests made, for monitoring
+        self.requests = 0
+
+    ### Returns the handle of an order (stop, for stop orders) sent through
+    ### the client
+    def handle(self, orderId, stop=False, investmentCode=None,
+               brokerageId=None):
+        return SmarttOrderHandle(orderId, self, stop, investmentCode,
+                                 brokerageId)
+
+    # Starts following a handle (must hold the condition)
+    def watch(self, handle):
+        handle.error = None
+        if handle.done():
+            return
+        self.watched[(handle.stop, int(handle))] = handle
+        self.stopping = False
+        self.wakeup.set()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run,
+                                           name="smartt-order-poller",
+                                           daemon=True)
+            self.thread.start()
+
+    ### Stops polling (the watched orders are polled again if waited for)
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.wakeup.set()
+
+    ##########################################################################
+    ### Polling ###
+    ###############
+    def run(self):
+        interval = self.minimum_interval
+        while True:
+            self.wakeup.wait(interval)
+            if self.wakeup.is_set():
+                self.wakeup.clear()
+                interval = self.minimum_interval
+
+            with self.condition:
+                if self.stopping or not self.watched:
+                    self.thread = None
+                    return
+                groups = {}
+                for handle in self.watched.values():
+                    groups.setdefault((handle.stop, handle.investment_code,
+                                       handle.brokerage_id), []).append(handle)
+
+            try:
+                changed = self.poll(groups)
+            except (Exception, SmarttClientException) as e:
+                self.fail(e)
+                interval = self.maximum_interval
+                continue
+
+            interval = (self.minimum_interval if changed else
+                        min(interval * 2, self.maximum_interval))
+
+    # Makes one request per investment; returns whether any status changed
+    def poll(self, groups):
+        changed = []
+        updated = []
+        for ((stop, investmentCode, brokerageId), handles) in groups.items():
+            rows = self.request(stop, investmentCode, brokerageId, handles)
+            key = "stop_order_id" if stop else "order_id"
+            handles = dict((int(handle), handle) for handle in handles)
+            with self.condition:
+                for row in rows:
+                    handle = handles.get(int(row[key]))
+                    if handle is None:
+                        continue
+                    updated.append((handle, handle.order))
+                    if handle.update(row):
+                        changed.append(handle)
+                        if handle.done():
+                            self.watched.pop((stop, int(handle)), None)
+                self.condition.notify_all()
+
+        # The trades (and ends) of the orders, for the risk engine
+        risk_engine = self.client.risk_engine
+        if risk_engine is not None:
+            for (handle, previous) in updated:
+                if handle.order == previous:
+                    continue
+                if handle.stop:
+                    risk_engine.stopOrderUpdated(int(handle), handle.order,
+                                                 handle.finalStatuses())
+                else:
+                    risk_engine.orderUpdated(int(handle), handle.order,
+                                             handle.finalStatuses())
+
+        for handle in changed:
+            handle.notifyTransition()
+            handle.resolveFutures()
+        return bool(changed)
+
+    # Requests the orders of the investment since the oldest watched one,
+    # and the orders not seen yet (without datetime) by their ids, in a
+    # single pipelined round trip; returns the rows
+    def request(self, stop, investmentCode, brokerageId, handles):
+        if stop:
+            (function, idParameter, attributes) = (
+                "getStopOrders", "stopOrderId", STOP_ORDER_ATTRIBUTES)
+        else:
+            (function, idParameter, attributes) = (
+                "getOrders", "orderId", ORDER_ATTRIBUTES)
+        datetimes = [handle.datetime for handle in handles
+                     if handle.datetime is not None]
+        calls = [{idParameter: int(handle), "returnAttributes": attributes}
+                 for handle in handles if handle.datetime is None]
+        if datetimes:
+            calls.append({"investmentCode": investmentCode,
+                          "brokerageId": brokerageId,
+                          "initialDatetime": min(datetimes),
+                          "returnAttributes": attributes})
+
+        self.requests += 1
+        rows = []
+        for (arguments, future) in self.client.pipeline().map(function,
+                                                              calls):
+            rows.extend(asDicts(future.result()))
+        return rows
+
+    # Stops watching the orders after a failed poll, failing their waits
+    # and futures
+    def fail(self, error):
+        with self.condition:
+            handles = list(self.watched.values())
+            self.watched.clear()
+            for handle in handles:
+                handle.error = error
+            self.condition.notify_all()
+        for handle in handles:
+            handle.resolveFutures()
+    ##########################################################################
+
+##############################################################################
@@ -0,0 +1,202 @@
+
+# Standard library imports
+import collections
+import concurrent.futures
+
+# Local imports
+from .smartt_client import SmarttClient
+from .smartt_client import SmarttClientException
+
+
+# The client functions which can be pipelined: the ones whose results are
+# built from their responses alone (see the *Message and *Response functions
+# of SmarttClient) - not the order functions, which have risk checks and
+# hooks around their requests
+pipelineFunctions = frozenset(
+    name for name in SmarttClient.schemas.functionAttributes()
+    if hasattr(SmarttClient, name + "Response"))
+
+
+# Position of the returnAttributes parameter of a function (self excluded),
+# None if it has none
+def returnAttributesPosition(functionName):
+    code = getattr(SmarttClient, functionName).__code__
+    names = code.co_varnames[1:code.co_argcount]
+    if "returnAttributes" not in names:
+        return None
+    return names.index("returnAttributes")
+
+
+returnAttributesPositions = dict(
+    (name, returnAttributesPosition(name)) for name in pipelineFunctions)
+
+
+# Fails the futures of the calls which weren't resolved
+def failCalls(calls, error):
+    for call in calls:
+        if not call[-1].done():
+            call[-1].set_exception(error)
+
+
+##############################################################################
+### SmarttPipeline class - calls client functions pipelined: the message of
+### each call is built at once (with the same parameters checks and encoding
+### of the function), then the messages are sent without waiting for the
+### responses (see SmarttClient.pipelineMessages) and the result of each call
+### is built from its response; the results are concurrent.futures.Future
+### objects, failed with the errors of each call (and all the pending ones
+### with the error of the connection, if it fails); only the functions
+### without side effects besides their requests can be pipelined (see
+### pipelineFunctions):
+###     with client.pipeline() as pipeline:
+###         portfolio = pipeline.getPortfolio("paper")
+###         limits = pipeline.getAvailableLimits("paper")
+###     print(portfolio.result(), limits.result())
+class SmarttPipeline(object):
+
+    def __init__(self, client, window=32):
+        self.client = client
+        self.window = window
+        self.calls = []
+
+    # The client functions, recorded (see call)
+    def __getattr__(self, name):
+        if name not in pipelineFunctions:
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+        call.__name__ = name
+        return call
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        if exception_type is None:
+            self.execute()
+
+    ##########################################################################
+    ### Calls ###
+    #############
+
+    ### Records a call of a client function, to be sent by execute; returns
+    ### the Future of its result (failed at once if the parameters are
+    ### invalid)
+    def call(self, functionName, *args, **kwargs):
+        call = self.record(functionName, args, kwargs)
+        if call[2] is not None:
+            self.calls.append(call)
+        return call[-1]
+
+    ### Sends the recorded calls and resolves their futures, in order;
+    ### returns the futures
+    def execute(self):
+        (calls, self.calls) = (self.calls, [])
+        try:
+            for _ in self.exchange(calls):
+                pass
+        except (Exception, SmarttClientException) as e:
+            # The calls which weren't sent
+            failCalls([call for call in calls if not call[-1].done()], e)
+            raise
+        return [call[-1] for call in calls]
+
+    ### Calls a client function with each of the arguments (a tuple of
+    ### positional arguments or a dict of keyword arguments), streaming:
+    ### the calls are recorded as the window advances, instead of all of
+    ### them at first; yields (arguments, future) as the calls are resolved
+    ### (the ones with invalid parameters as soon as they are found)
+    def map(self, functionName, argumentsIterable):
+        invalid = collections.deque()
+
+        def calls():
+            for arguments in argumentsIterable:
+                if isinstance(arguments, dict):
+                    call = self.record(functionName, (), arguments)
+                else:
+                    call = self.record(functionName, tuple(arguments), {})
+                if call[2] is None:
+                    invalid.append((arguments, call[-1]))
+                else:
+                    yield call[:-1] + (arguments, call[-1])
+
+        for call in self.exchange(calls()):
+            while invalid:
+                yield invalid.popleft()
+            yield (call[-2], call[-1])
+        while invalid:
+            yield invalid.popleft()
+    ##########################################################################
+
+    ##########################################################################
+    ### Building and resolving ###
+    ##############################
+
+    # Builds the message of a call - returns the call (function name, return
+    # attributes, message and future), without message if the parameters are
+    # invalid
+    def record(self, functionName, args, kwargs):
+        if functionName not in pipelineFunctions:
+            raise SmarttClientException("Function can't be pipelined: " +
+                                        str(functionName))
+
+        future = concurrent.futures.Future()
+        position = returnAttributesPositions[functionName]
+        returnAttributes = None
+        if position is not None:
+            returnAttributes = (args[position] if position < len(args) else
+                                kwargs.get("returnAttributes"))
+        try:
+            message = getattr(self.client, functionName + "Message")(
+                *args, **kwargs)
+        except SmarttClientException as e:
+            future.set_exception(e)
+            return (functionName, returnAttributes, None, future)
+        return (functionName, returnAttributes, message, future)
+
+    # Exchanges the messages of the calls and resolves their futures,
+    # yielding each call once resolved; if the exchange fails (or stops
+    # early), the futures of the calls already sent are failed
+    def exchange(self, calls):
+        sent = collections.deque()
+        error = None
+
+        def messages():
+            for call in calls:
+                sent.append(call)
+                yield call[2]
+
+        try:
+            for response in self.client.pipelineMessages(messages(),
+                                                         self.window):
+                call = sent.popleft()
+                self.resolve(call, response)
+                yield call
+        except (Exception, SmarttClientException) as e:
+            error = e
+            raise
+        finally:
+            if error is None:
+                error = SmarttClientException("Pipeline stopped before the "
+                                              "response")
+            failCalls(sent, error)
+
+    # Builds the result of a call from its response
+    def resolve(self, call, response):
+        (functionName, returnAttributes, future) = (call[0], call[1],
+                                                    call[-1])
+        try:
+            response = self.client.checkResponse(response)
+            responseFunction = getattr(self.client, functionName + "Response")
+            if returnAttributes is None:
+                result = responseFunction(response)
+            else:
+                result = responseFunction(response, returnAttributes)
+        except (Exception, SmarttClientException) as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+    ##########################################################################
+
+##############################################################################
@@ -0,0 +1,263 @@
+
+# Standard library imports
+import inspect
+import threading
+import time
+import tracemalloc
+
+# Local imports
+from .smartt_client import SmarttClient
+
+
+# Phases of an API call: formatting the parameters and the message, waiting
+# for the socket (sending and receiving), splitting the received message,
+# building the result (rows, dicts) and everything else (waiting for the
+# exchange lock or scheduler, hooks, simulation)
+PHASES = ["encode", "network", "parse", "shape", "other"]
+
+# Measures of each phase: wall time and CPU time (seconds) and traced memory
+# allocated minus freed (bytes)
+METRICS = ["wall_time", "cpu_time", "allocated"]
+
+# CPU time of the current thread (Python 3.7), or of the process
+threadTime = getattr(time, "thread_time", time.process_time)
+
+# The public API functions - the ones with the attributes of their responses
+apiFunctions = sorted(
+    name for (name, value) in vars(SmarttClient).items()
+    if inspect.isfunction(value) and name + "Attributes" in vars(SmarttClient))
+
+
+##############################################################################
+### SmarttProfiler class - opt-in profiling of clients: attach wraps the API
+### functions of a client (and its protocol), recording the wall time, CPU
+### time and traced allocations of each phase of each call (see PHASES);
+### the results are aggregated per function (calls made from inside other
+### API functions count as their own) and exported as a report or in the
+### collapsed stacks format of the flamegraph tools; allocations are traced
+### with tracemalloc, which makes everything slower and also counts the
+### allocations of the other threads, so trace_allocations may be disabled;
+### lazy lists (see SmarttClient.lazy_lists) are shaped after their calls
+### return, so their shaping isn't measured
+class SmarttProfiler(object):
+
+    def __init__(self, trace_allocations=True):
+        self.trace_allocations = trace_allocations
+        self.lock = threading.Lock()
+        # Calls in progress in each thread (see enter)
+        self.local = threading.local()
+        # Totals per stack of function names: number of calls and the
+        # metrics of each phase
+        self.totals = {}
+        # Wrapped objects and their original attributes (None for the ones
+        # which were only class attributes)
+        self.originals = []
+        self.started_tracing = False
+
+    ##########################################################################
+    ### Attaching ###
+    #################
+
+    ### Starts profiling the calls of the client
+    def attach(self, client):
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+        for name in apiFunctions:
+            self.wrap(client, name, self.wrapFunction(name,
+                                                      getattr(client, name)))
+        self.wrap(client, "smarttFunction", self.wrapPhase(
+            client.smarttFunction, "other", "shape"))
+        self.wrap(client, "connect", self.wrapConnect(client,
+                                                      client.connect))
+        self.wrapProtocol(client.protocol)
+
+    ### Stops profiling all the attached clients (the results are kept)
+    def detach(self):
+        for (target, name, original) in reversed(self.originals):
+            if original is None:
+                delattr(target, name)
+            else:
+                setattr(target, name, original)
+        self.originals = []
+
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def wrap(self, target, name, wrapper):
+        self.originals.append((target, name, vars(target).get(name)))
+        setattr(target, name, wrapper)
+
+    def wrapProtocol(self, protocol):
+        self.wrap(protocol, "send", self.wrapPhase(protocol.send, "encode",
+                                                   "other"))
+        self.wrap(protocol, "receive", self.wrapPhase(protocol.receive,
+                                                      "parse", "other"))
+        for name in ("read_function", "write_function",
+                     "write_vector_function"):
+            function = getattr(protocol, name, None)
+            if function is not None:
+                # Back to the phase of the caller (send or receive)
+                self.wrap(protocol, name, self.wrapPhase(
+                    function, "network",
+                    "parse" if name == "read_function" else "encode"))
+
+    # A reconnection creates a new protocol, which has to be wrapped again
+    def wrapConnect(self, client, connect):
+        def wrapper(*args, **kwargs):
+            result = connect(*args, **kwargs)
+            self.wrapProtocol(client.protocol)
+            return result
+        return wrapper
+
+    def wrapFunction(self, name, function):
+        def wrapper(*args, **kwargs):
+            self.enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.exit()
+        wrapper.__name__ = name
+        wrapper.__wrapped__ = function
+        return wrapper
+
+    def wrapPhase(self, function, phase, nextPhase):
+        def wrapper(*args, **kwargs):
+            self.switch(phase)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.switch(nextPhase)
+        wrapper.__wrapped__ = function
+        return wrapper
+    ##########################################################################
+
+    ##########################################################################
+    ### Measuring ###
+    #################
+    def sample(self):
+        return (time.perf_counter(), threadTime(),
+                tracemalloc.get_traced_memory()[0]
+                if self.trace_allocations else 0)
+
+    def calls(self):
+        calls = getattr(self.local, "calls", None)
+        if calls is None:
+            calls = self.local.calls = []
+        return calls
+
+    # Starts measuring a call - a call made by another one interrupts it
+    # (the time of the inner call isn't counted in the outer one)
+    def enter(self, name):
+        calls = self.calls()
+        now = self.sample()
+        if calls:
+            self.accumulate(calls[-1], now)
+            stack = calls[-1]["stack"] + (name,)
+        else:
+            stack = (name,)
+        calls.append({"stack": stack, "phase": "encode", "mark": now,
+                      "phases": dict((phase, [0.0, 0.0, 0])
+                                     for phase in PHASES)})
+
+    def exit(self):
+        calls = self.calls()
+        now = self.sample()
+        call = calls.pop()
+        self.accumulate(call, now)
+        if calls:
+            calls[-1]["mark"] = self.sample()
+
+        with self.lock:
+            totals = self.totals.get(call["stack"])
+            if totals is None:
+                totals = self.totals[call["stack"]] = {
+                    "calls": 0,
+                    "phases": dict((phase, [0.0, 0.0, 0]) for phase in PHASES)
+                }
+            totals["calls"] += 1
+            for (phase, values) in call["phases"].items():
+                measures = totals["phases"][phase]
+                for i in range(len(METRICS)):
+                    measures[i] += values[i]
+
+    # Ends the current phase of the call in progress, if any (the protocol
+    # may also be used outside the API functions)
+    def switch(self, phase):
+        calls = getattr(self.local, "calls", None)
+        if not calls:
+            return
+        call = calls[-1]
+        self.accumulate(call, self.sample())
+        call["phase"] = phase
+
+    def accumulate(self, call, now):
+        measures = call["phases"][call["phase"]]
+        for i in range(len(METRICS)):
+            measures[i] += now[i] - call["mark"][i]
+        call["mark"] = now
+    ##########################################################################
+
+    ##########################################################################
+    ### Reports ###
+    ###############
+
+    ### Returns, for each function, the number of calls and the totals of
+    ### each metric per phase
+    def report(self):
+        report = {}
+        with self.lock:
+            for (stack, totals) in self.totals.items():
+                function = report.get(stack[-1])
+                if function is None:
+                    function = report[stack[-1]] = dict(
+                        [("calls", 0)] +
+                        [(metric, dict((phase, 0) for phase in PHASES))
+                         for metric in METRICS])
+                function["calls"] += totals["calls"]
+                for (phase, measures) in totals["phases"].items():
+                    for (metric, value) in zip(METRICS, measures):
+                        function[metric][phase] += value
+        return report
+
+    ### Writes the report as a table, the functions taking more time first
+    def writeReport(self, output):
+        report = self.report()
+        output.write("%-32s %8s %-8s %12s %12s %12s\n" % (
+            "function", "calls", "phase", "wall (ms)", "cpu (ms)",
+            "alloc (KiB)"))
+        for (name, function) in sorted(
+                report.items(),
+                key=lambda item: -sum(item[1]["wall_time"].values())):
+            for phase in PHASES:
+                output.write("%-32s %8d %-8s %12.3f %12.3f %12.1f\n" % (
+                    name, function["calls"], phase,
+                    function["wall_time"][phase] * 1000,
+                    function["cpu_time"][phase] * 1000,
+                    function["allocated"][phase] / 1024.0))
+
+    ### Writes the totals in the collapsed stacks format (a line per stack
+    ### of calls and phase, followed by its value), the input of
+    ### flamegraph.pl and compatible tools; times in microseconds,
+    ### allocations in bytes (only the positive ones)
+    def exportCollapsed(self, output, metric="cpu_time"):
+        index = METRICS.index(metric)
+        scale = 1 if metric == "allocated" else 1000000
+        with self.lock:
+            lines = []
+            for (stack, totals) in self.totals.items():
+                for (phase, measures) in totals["phases"].items():
+                    value = int(round(measures[index] * scale))
+                    if value > 0:
+                        lines.append("%s %d\n" % (";".join(stack + (phase,)),
+                                                  value))
+        output.writelines(sorted(lines))
+
+    def clear(self):
+        with self.lock:
+            self.totals.clear()
+    ##########################################################################
+
+##############################################################################
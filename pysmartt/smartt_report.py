@@ -0,0 +1,299 @@
+
+# Standard library imports
+import collections
+import datetime
+
+# Third party imports - NumPy is an optional dependency, only needed by this
+# module
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Local imports
+from .smartt_client import SmarttClientException
+from .smartt_schema import decodeRow
+from .smartt_schema import iterDicts
+
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+DATE_FORMAT = "%Y-%m-%d"
+
+# Value of the trade_type attribute of sell trades - encoded as the
+# order_type of the orders (see SmarttClient.formatBoolean: "0" for buys)
+SELL_TRADE_TYPE = "1"
+
+# Trade attributes holding costs
+costAttributes = [
+    "trading_tax_cost",
+    "liquidation_tax_cost",
+    "register_tax_cost",
+    "income_tax_cost",
+    "withholding_income_tax_cost",
+    "other_taxes_cost"
+]
+
+
+def parseDatetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    try:
+        return datetime.datetime.strptime(value, DATETIME_FORMAT)
+    except ValueError:
+        return datetime.datetime.strptime(value, DATE_FORMAT)
+
+
+def floatOrZero(value):
+    return float(value) if value not in (None, "") else 0.0
+
+
+### Matches the trades of an investment (in any order) in FIFO order, per
+### stock, returning one elimination for each trade which reduces a position:
+### (datetime, is_long, gross result, net result); the costs of the trades
+### are split proportionally among the quantities they open and close
+### (each trade is matched against the lots left by the previous ones, so
+### this is a plain sequential pass - only the metrics are vectorized)
+def computeEliminations(trades):
+    trades = sorted(trades, key=lambda trade: parseDatetime(trade["datetime"]))
+    lots = collections.defaultdict(collections.deque)
+    eliminations = []
+
+    for trade in trades:
+        quantity = int(trade["number_of_stocks"])
+        if quantity == 0:
+            continue
+        price = float(trade["price"])
+        cost_per_stock = (sum(floatOrZero(trade.get(attribute))
+                              for attribute in costAttributes) / quantity)
+        sign = -1 if str(trade["trade_type"]) == SELL_TRADE_TYPE else 1
+        stock_lots = lots[trade["stock_code"]]
+
+        gross = 0.0
+        net = 0.0
+        closed = 0
+        # Each lot is [signed quantity, price, cost per stock]
+        while quantity > 0 and stock_lots and stock_lots[0][0] * sign < 0:
+            lot = stock_lots[0]
+            matched = min(quantity, abs(lot[0]))
+            result = (price - lot[1]) * matched * -sign
+            gross += result
+            net += result - (lot[2] + cost_per_stock) * matched
+            closed += matched
+            quantity -= matched
+            lot[0] += matched * sign
+            if lot[0] == 0:
+                stock_lots.popleft()
+
+        if closed > 0:
+            # Selling closes long positions and buying closes short ones
+            eliminations.append((parseDatetime(trade["datetime"]), sign < 0,
+                                 gross, net))
+        if quantity > 0:
+            stock_lots.append([quantity * sign, price, cost_per_stock])
+
+    return eliminations
+
+
+# Length and total of the first longest run of True values in the mask
+def longestRun(mask, values):
+    if not mask.any():
+        return (0, 0.0)
+
+    padded = numpy.concatenate([[False], mask, [False]]).astype(int)
+    changes = numpy.diff(padded)
+    starts = numpy.flatnonzero(changes == 1)
+    ends = numpy.flatnonzero(changes == -1)
+    longest = numpy.argmax(ends - starts)
+    return (int(ends[longest] - starts[longest]),
+            float(values[starts[longest]:ends[longest]].sum()))
+
+
+def percentual(count, total):
+    return 100.0 * float(count) / total if total else 0.0
+
+
+### Computes the getReport attributes which can be derived from the
+### eliminations and costs of an investment, with vectorized NumPy
+### operations
+def computeReportMetrics(eliminations, costs=0.0):
+    count = len(eliminations)
+    is_long = numpy.array([elimination[1] for elimination in eliminations],
+                          dtype=bool)
+    gross = numpy.array([elimination[2] for elimination in eliminations],
+                        dtype=float)
+    net = numpy.array([elimination[3] for elimination in eliminations],
+                      dtype=float)
+
+    profit = net > 0
+    loss = net < 0
+    gross_profit = float(gross[gross > 0].sum())
+    gross_loss = float(gross[gross < 0].sum())
+    (consecutive_profits, consecutive_profits_total) = longestRun(profit, net)
+    (consecutive_losses, consecutive_losses_total) = longestRun(loss, net)
+
+    report = {
+        "taxes_and_operational_costs": costs,
+        "gross_profit": gross_profit,
+        "gross_loss": gross_loss,
+        "total_gross_profit": float(gross.sum()),
+        "net_profit": float(net[profit].sum()),
+        "net_loss": float(net[loss].sum()),
+        "total_net_profit": float(net.sum()),
+        "profit_factor": (gross_profit / -gross_loss if gross_loss
+                          else 0.0),
+        "number_of_eliminations": count,
+        "expected_payoff": float(net.mean()) if count else 0.0,
+        "absolute_number_of_profit_eliminations": int(profit.sum()),
+        "percentual_number_of_profit_eliminations":
+            percentual(profit.sum(), count),
+        "absolute_largest_profit_elimination":
+            float(net[profit].max()) if profit.any() else 0.0,
+        "average_profit_in_profit_eliminations":
+            float(net[profit].mean()) if profit.any() else 0.0,
+        "maximum_consecutive_profit_eliminations": consecutive_profits,
+        "total_profit_in_maximum_consecutive_profit_eliminatons":
+            consecutive_profits_total,
+        "absolute_number_of_loss_eliminations": int(loss.sum()),
+        "percentual_number_of_loss_eliminations":
+            percentual(loss.sum(), count),
+        "absolute_largest_loss_elimination":
+            float(net[loss].min()) if loss.any() else 0.0,
+        "average_loss_in_loss_eliminations":
+            float(net[loss].mean()) if loss.any() else 0.0,
+        "maximum_consecutive_loss_eliminations": consecutive_losses,
+        "total_loss_in_maximum_consecutive_loss_eliminations":
+            consecutive_losses_total
+    }
+
+    for (side, mask) in [("long", is_long), ("short", ~is_long)]:
+        side_count = int(mask.sum())
+        side_profits = int((mask & profit).sum())
+        side_losses = int((mask & loss).sum())
+        report.update({
+            "absolute_number_of_eliminations_of_%s_positions" % side:
+                side_count,
+            "percentual_number_of_eliminations_of_%s_positions" % side:
+                percentual(side_count, count),
+            "absolute_number_of_profit_eliminations_of_%s_positions" % side:
+                side_profits,
+            "percentual_number_of_profit_eliminations_of_%s_positions" % side:
+                percentual(side_profits, side_count),
+            "absolute_number_of_loss_eliminations_of_%s_positions" % side:
+                side_losses,
+            "percentual_number_of_loss_eliminations_of_%s_positions" % side:
+                percentual(side_losses, side_count)
+        })
+
+    return report
+
+
+### Computes the reports of every investment in the trades (as returned by
+### getTrades, with all the attributes, in any response format) for each
+### time window, a list of
+### (initial datetime, final datetime) pairs, or for the whole period - given
+### for each investment by periods, {(investment_code, brokerage_id):
+### (initial datetime, final datetime)}, or else from its first to its last
+### trade; the positions are matched over the whole history, so the windows
+### only select the eliminations (and costs) which happened inside them;
+### returns a dict keyed by (investment_code, brokerage_id, window)
+def computeReports(trades, windows=None, periods=None):
+    if numpy is None:
+        raise SmarttClientException("NumPy is needed for the local reports")
+
+    investments = collections.defaultdict(list)
+    for trade in iterDicts(trades):
+        investments[(trade["investment_code"],
+                     trade["brokerage_id"])].append(trade)
+
+    reports = {}
+    for ((investmentCode, brokerageId), investment_trades) in \
+            investments.items():
+        eliminations = computeEliminations(investment_trades)
+        trade_times = numpy.array([parseDatetime(trade["datetime"])
+                                   for trade in investment_trades])
+        trade_costs = numpy.array([sum(floatOrZero(trade.get(attribute))
+                                       for attribute in costAttributes)
+                                   for trade in investment_trades])
+        elimination_times = numpy.array([elimination[0]
+                                         for elimination in eliminations])
+
+        for window in (windows or [None]):
+            if window is None:
+                (initial, final) = (periods or {}).get(
+                    (investmentCode, brokerageId),
+                    (trade_times.min(), trade_times.max()))
+            else:
+                (initial, final) = window
+
+            selected = [elimination for (elimination, selected) in zip(
+                eliminations, (elimination_times >= initial) &
+                (elimination_times <= final)) if selected]
+            costs = float(trade_costs[(trade_times >= initial) &
+                                      (trade_times <= final)].sum())
+
+            report = computeReportMetrics(selected, costs)
+            report.update({
+                "investment_code": investmentCode,
+                "brokerage_id": brokerageId,
+                "initial_datetime": initial,
+                "final_datetime": final,
+                "number_of_days": (final.date() - initial.date()).days + 1
+            })
+            reports[(investmentCode, brokerageId, window)] = report
+
+    return reports
+
+
+### Compares the local report of an investment (over all its trades, from
+### the initial datetime of the investment to now) with the one computed by
+### the server; returns the numeric attributes which differ by more than the
+### tolerance, {attribute: (local, server)}, and the ones which couldn't be
+### compared - not computed locally, or without a numeric value from the
+### server - {attribute: server value}; the period attributes (datetimes
+### and number_of_days, counted by the server in its own way) aren't
+### compared
+def validateReport(client, trades, investmentCode, brokerageId=None,
+                   tolerance=0.01):
+    trades = [trade for trade in iterDicts(trades)
+              if trade["investment_code"] == investmentCode and
+              (brokerageId is None or
+               str(trade["brokerage_id"]) == str(brokerageId))]
+    if not trades:
+        raise SmarttClientException("No trades of the investment: " +
+                                    investmentCode)
+    investment = decodeRow(client.getInvestments(investmentCode, brokerageId,
+                                                 ["initial_datetime"]))
+    try:
+        initial = parseDatetime(investment.get("initial_datetime"))
+    except (TypeError, ValueError):
+        raise SmarttClientException("Invalid initial datetime of the "
+                                    "investment: " +
+                                    str(investment.get("initial_datetime")))
+    final = max([datetime.datetime.now()] +
+                [parseDatetime(trade["datetime"]) for trade in trades])
+    periods = dict(((trade["investment_code"], trade["brokerage_id"]),
+                    (initial, final)) for trade in trades)
+
+    # The last report, if the trades are of several brokerages (without
+    # brokerageId)
+    local = list(computeReports(trades, periods=periods).values())[-1]
+
+    attributes = [attribute for attribute in client.getReportAttributes
+                  if attribute not in
+                  ["investment_code", "brokerage_id", "initial_datetime",
+                   "final_datetime", "number_of_days"]]
+    server = decodeRow(client.getReport(investmentCode, brokerageId,
+                                        attributes))
+
+    differences = {}
+    uncompared = {}
+    for attribute in attributes:
+        try:
+            server_value = float(server[attribute])
+        except (KeyError, TypeError, ValueError):
+            server_value = None
+        if attribute not in local or server_value is None:
+            uncompared[attribute] = server.get(attribute)
+        elif abs(server_value - local[attribute]) > tolerance:
+            differences[attribute] = (local[attribute], server_value)
+    return (differences, uncompared)
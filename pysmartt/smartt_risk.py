@@ -0,0 +1,367 @@
+
+# Standard library imports
+import collections
+import threading
+import time
+
+# Local imports
+from .smartt_client import SmarttClientException
+from .smartt_schema import asDicts
+
+
+class SmarttRiskException(SmarttClientException):
+    pass
+
+
+##############################################################################
+### SmarttRiskBook class - the cached state of an investment: its available
+### limits and positions (see SmarttRiskEngine.refresh) and the quantities
+### of its open orders sent since then, not traded yet (pending)
+class SmarttRiskBook(object):
+
+    def __init__(self):
+        self.available_limits = {}
+        self.positions = collections.defaultdict(int)
+        self.pending = collections.defaultdict(int)
+
+##############################################################################
+
+
+##############################################################################
+### SmarttRiskEngine class - pre-trade checks run by the client before
+### sending, changing or sending stop orders, so that orders which would
+### break the configured limits are rejected locally, without a round trip to
+### the server; the available limits and positions of each investment are
+### cached from getAvailableLimits and getPortfolio (see the refresh
+### function) and the quantities of the orders sent since then are accounted
+### as pending until traded (moved to the positions, as the order poller of
+### the client sees them - see smartt_orders) or canceled
+class SmarttRiskEngine(object):
+
+    # Values of the order type parameter meaning a sell order (see
+    # SmarttClient.formatBoolean)
+    sellOrderTypes = [1, True, "1", "yes"]
+
+    # Values of the portfolio position type meaning a short position
+    shortPositionTypes = ["short", "1"]
+
+    ### Init function - every limit is optional:
+    ###   - max_notional: maximum financial volume of a single order
+    ###   - price_band: maximum relative distance from the reference price of
+    ###     the stock (see setReferencePrice), e.g. 0.1 for 10%
+    ###   - position_limits: maximum absolute position per stock code, with
+    ###     default_position_limit for the stocks not in it
+    ###   - max_orders / throttle_interval: maximum number of orders accepted
+    ###     in any interval of throttle_interval seconds
+    ###   - check_available_limits: if buy orders must fit in the available
+    ###     "spot" limit
+    def __init__(self, max_notional=None, price_band=None,
+                 position_limits=None, default_position_limit=None,
+                 max_orders=None, throttle_interval=1.0,
+                 check_available_limits=True):
+        self.max_notional = max_notional
+        self.price_band = price_band
+        self.position_limits = dict(position_limits or {})
+        self.default_position_limit = default_position_limit
+        self.max_orders = max_orders
+        self.throttle_interval = throttle_interval
+        self.check_available_limits = check_available_limits
+
+        self.lock = threading.Lock()
+        # Books by (investment code, brokerage id)
+        self.books = {}
+        self.reference_prices = {}
+        # Open orders and stop orders sent through the engine, by id: their
+        # book key, order type, stock code, number of stocks, price and
+        # traded number of stocks
+        self.orders = {}
+        self.stop_orders = {}
+        self.sent_times = collections.deque()
+
+    ##########################################################################
+    ### Cached state ###
+    ####################
+
+    ### Reloads the available limits and the positions of the investment
+    ### from the server; the pending quantities are kept, but only for the
+    ### part of the open orders not traded yet
+    def refresh(self, client, investmentCode, brokerageId=None):
+        limits = asDicts(client.getAvailableLimits(investmentCode,
+                                                   brokerageId))
+        portfolio = asDicts(client.getPortfolio(investmentCode, brokerageId))
+
+        with self.lock:
+            if brokerageId is None:
+                # The books of each brokerage of the investment are replaced
+                for key in list(self.books):
+                    if key[0] == investmentCode:
+                        del self.books[key]
+            book = self.books[self.bookKey(investmentCode, brokerageId)] = \
+                SmarttRiskBook()
+            if limits:
+                for (name, value) in limits[0].items():
+                    # Limits not given by the brokerage are left unchecked
+                    if value not in (None, ""):
+                        book.available_limits[name] = float(value)
+
+            for position in portfolio:
+                number_of_stocks = int(position["number_of_stocks"])
+                if (str(position.get("position_type")).lower()
+                        in self.shortPositionTypes):
+                    number_of_stocks = -number_of_stocks
+                book.positions[position["stock_code"]] += number_of_stocks
+
+            for orders in (self.orders, self.stop_orders):
+                for order in orders.values():
+                    if self.book(order[0]) is book:
+                        book.pending[order[2]] += self.signedQuantity(
+                            order[1], order[3] - order[5])
+
+    def setReferencePrice(self, stockCode, price):
+        self.reference_prices[stockCode] = float(price)
+
+    def setPositionLimit(self, stockCode, limit):
+        self.position_limits[stockCode] = limit
+    ##########################################################################
+
+    ##########################################################################
+    ### Checks - raise SmarttRiskException if an order breaks any limit; ###
+    ### an accepted order counts for the throttle, until orderFailed ###
+    ####################################################################
+    def checkOrder(self, investmentCode, brokerageId, orderType, stockCode,
+                   numberOfStocks, price):
+        with self.lock:
+            book = self.book(self.bookKey(investmentCode, brokerageId))
+            self.checkOrderLimits(book, orderType, stockCode, numberOfStocks,
+                                  price)
+            return self.checkThrottle()
+
+    def checkChangeOrder(self, orderId, newNumberOfStocks=None,
+                         newPrice=None):
+        with self.lock:
+            order = self.orders.get(int(orderId))
+            if order is None:
+                # Not sent through this engine - only the throttle applies
+                return self.checkThrottle()
+
+            (key, orderType, stockCode, numberOfStocks, price, traded) = order
+            if newNumberOfStocks is None:
+                newNumberOfStocks = numberOfStocks
+            newNumberOfStocks = int(newNumberOfStocks)
+            if newPrice is None:
+                newPrice = price
+
+            # The quantity of the order being changed is already pending,
+            # and the amount of the part not traded is already reserved in
+            # the spot limit
+            required = ((newNumberOfStocks - traded) * float(newPrice) -
+                        (numberOfStocks - traded) * price)
+            self.checkOrderLimits(self.book(key), orderType, stockCode,
+                                  newNumberOfStocks - numberOfStocks,
+                                  newPrice, notionalQuantity=newNumberOfStocks,
+                                  required=required)
+            return self.checkThrottle()
+
+    def checkStopOrder(self, investmentCode, brokerageId, orderType,
+                       stockCode, numberOfStocks, stopPrice, limitPrice):
+        with self.lock:
+            book = self.book(self.bookKey(investmentCode, brokerageId))
+            self.checkPriceBand(stockCode, stopPrice)
+            self.checkOrderLimits(book, orderType, stockCode, numberOfStocks,
+                                  limitPrice)
+            return self.checkThrottle()
+    ##########################################################################
+
+    ##########################################################################
+    ### Notifications of accepted, failed and updated orders ###
+    ############################################################
+
+    ### The order checked with the throttle time returned by the check
+    ### wasn't accepted (invalid parameters or refused by the server), so it
+    ### doesn't count for the throttle
+    def orderFailed(self, sentTime):
+        with self.lock:
+            try:
+                self.sent_times.remove(sentTime)
+            except ValueError:
+                pass
+
+    def orderSent(self, orderId, investmentCode, brokerageId, orderType,
+                  stockCode, numberOfStocks, price):
+        with self.lock:
+            self.record(self.orders, int(orderId),
+                        self.bookKey(investmentCode, brokerageId), orderType,
+                        stockCode, int(numberOfStocks), float(price), 0)
+
+    ### Stop orders are accounted as pending until canceled or ended (the
+    ### trades of the orders they send are seen on the next refresh)
+    def stopOrderSent(self, stopOrderId, investmentCode, brokerageId,
+                      orderType, stockCode, numberOfStocks, limitPrice):
+        with self.lock:
+            self.record(self.stop_orders, int(stopOrderId),
+                        self.bookKey(investmentCode, brokerageId), orderType,
+                        stockCode, int(numberOfStocks), float(limitPrice), 0)
+
+    def orderChanged(self, orderId, newNumberOfStocks=None, newPrice=None):
+        with self.lock:
+            order = self.release(self.orders, int(orderId))
+            if order is None:
+                return
+
+            (key, orderType, stockCode, numberOfStocks, price, traded) = order
+            self.record(self.orders, int(orderId), key, orderType, stockCode,
+                        numberOfStocks if newNumberOfStocks is None
+                        else int(newNumberOfStocks),
+                        price if newPrice is None else float(newPrice),
+                        traded)
+
+    def orderCanceled(self, orderId):
+        with self.lock:
+            self.release(self.orders, int(orderId))
+
+    def stopOrderCanceled(self, stopOrderId):
+        with self.lock:
+            self.release(self.stop_orders, int(stopOrderId))
+
+    ### Accounts the trades of an order (the attributes polled by the order
+    ### poller, see smartt_orders.ORDER_ATTRIBUTES): the traded quantity
+    ### moves from pending to the position, and the rest of a finished
+    ### order (in one of the final statuses) is released
+    def orderUpdated(self, orderId, order, finalStatuses):
+        with self.lock:
+            record = self.orders.get(int(orderId))
+            if record is None:
+                return
+
+            (key, orderType, stockCode, numberOfStocks, price, traded) = record
+            now_traded = min(int(order.get("number_of_traded_stocks") or 0),
+                             numberOfStocks)
+            if now_traded > traded:
+                book = self.book(key)
+                quantity = self.signedQuantity(orderType, now_traded - traded)
+                book.pending[stockCode] -= quantity
+                book.positions[stockCode] += quantity
+                self.orders[int(orderId)] = record[:5] + (now_traded,)
+            if order.get("status") in finalStatuses:
+                self.release(self.orders, int(orderId))
+
+    ### The same for a stop order, released when it ends
+    def stopOrderUpdated(self, stopOrderId, order, finalStatuses):
+        if order.get("status") in finalStatuses:
+            self.stopOrderCanceled(stopOrderId)
+    ##########################################################################
+
+    ##########################################################################
+    ### Helper functions - expect the lock to be held ###
+    #####################################################
+    def bookKey(self, investmentCode, brokerageId):
+        return (investmentCode,
+                None if brokerageId is None else int(brokerageId))
+
+    # The book of the investment - the one refreshed without brokerage if
+    # there is none for the brokerage, or an empty one (nothing known)
+    def book(self, key):
+        book = self.books.get(key)
+        if book is None:
+            book = self.books.get((key[0], None))
+        if book is None:
+            book = self.books[key] = SmarttRiskBook()
+        return book
+
+    # Records an open order, accounting its quantity not traded yet as
+    # pending (and its amount in the spot limit, for buys)
+    def record(self, orders, orderId, key, orderType, stockCode,
+               numberOfStocks, price, traded):
+        orders[orderId] = (key, orderType, stockCode, numberOfStocks, price,
+                           traded)
+        book = self.book(key)
+        book.pending[stockCode] += self.signedQuantity(
+            orderType, numberOfStocks - traded)
+        if not self.isSell(orderType) and "spot" in book.available_limits:
+            book.available_limits["spot"] -= (numberOfStocks - traded) * price
+
+    # Forgets an open order, releasing its pending quantity (and the spot
+    # amount of the part not traded); returns the order
+    def release(self, orders, orderId):
+        order = orders.pop(orderId, None)
+        if order is None:
+            return None
+
+        (key, orderType, stockCode, numberOfStocks, price, traded) = order
+        book = self.book(key)
+        book.pending[stockCode] -= self.signedQuantity(
+            orderType, numberOfStocks - traded)
+        if not self.isSell(orderType) and "spot" in book.available_limits:
+            book.available_limits["spot"] += (numberOfStocks - traded) * price
+        return order
+
+    def isSell(self, orderType):
+        return orderType in self.sellOrderTypes
+
+    def signedQuantity(self, orderType, numberOfStocks):
+        return -numberOfStocks if self.isSell(orderType) else numberOfStocks
+
+    # Checks the limits of an order of numberOfStocks (notionalQuantity for
+    # the notional, and required of the spot limit, if they are different)
+    def checkOrderLimits(self, book, orderType, stockCode, numberOfStocks,
+                         price, notionalQuantity=None, required=None):
+        numberOfStocks = int(numberOfStocks)
+        if notionalQuantity is None:
+            notionalQuantity = numberOfStocks
+        notional = int(notionalQuantity) * float(price)
+
+        if self.max_notional is not None and notional > self.max_notional:
+            raise SmarttRiskException(
+                "Order notional %.2f above maximum of %.2f"
+                % (notional, self.max_notional))
+
+        self.checkPriceBand(stockCode, price)
+
+        if (self.check_available_limits and not self.isSell(orderType) and
+                "spot" in book.available_limits):
+            if required is None:
+                required = numberOfStocks * float(price)
+            if required > book.available_limits["spot"]:
+                raise SmarttRiskException(
+                    "Order requires %.2f, above available limit of %.2f"
+                    % (required, book.available_limits["spot"]))
+
+        limit = self.position_limits.get(stockCode,
+                                         self.default_position_limit)
+        if limit is not None:
+            position = (book.positions[stockCode] + book.pending[stockCode] +
+                        self.signedQuantity(orderType, numberOfStocks))
+            if abs(position) > limit:
+                raise SmarttRiskException(
+                    "Position of %d in %s above limit of %d"
+                    % (position, stockCode, limit))
+
+    def checkPriceBand(self, stockCode, price):
+        if self.price_band is None or stockCode not in self.reference_prices:
+            return
+
+        reference = self.reference_prices[stockCode]
+        if abs(float(price) - reference) > reference * self.price_band:
+            raise SmarttRiskException(
+                "Price %.2f of %s outside band of %.2f%% around %.2f"
+                % (float(price), stockCode, self.price_band * 100, reference))
+
+    # Counts an order for the throttle, returning its time (see orderFailed)
+    def checkThrottle(self):
+        if self.max_orders is None:
+            return None
+
+        now = time.time()
+        while (self.sent_times and
+               self.sent_times[0] <= now - self.throttle_interval):
+            self.sent_times.popleft()
+
+        if len(self.sent_times) >= self.max_orders:
+            raise SmarttRiskException(
+                "More than %d orders in %.3f seconds"
+                % (self.max_orders, self.throttle_interval))
+        self.sent_times.append(now)
+        return now
+    ##########################################################################
+
+##############################################################################
@@ -0,0 +1,200 @@
+
+# Standard library imports
+import collections
+import itertools
+import threading
+import time
+
+
+# Priority classes - lower values are served first
+PRIORITY_ORDER_ENTRY = 0
+PRIORITY_READ = 1
+PRIORITY_BULK = 2
+PRIORITIES = [PRIORITY_ORDER_ENTRY, PRIORITY_READ, PRIORITY_BULK]
+
+# Priority class of the Smartt functions (message names); the ones not
+# listed here are regular reads
+functionPriorities = {
+    "send_order": PRIORITY_ORDER_ENTRY,
+    "cancel_order": PRIORITY_ORDER_ENTRY,
+    "change_order": PRIORITY_ORDER_ENTRY,
+    "send_stop_order": PRIORITY_ORDER_ENTRY,
+    "cancel_stop_order": PRIORITY_ORDER_ENTRY,
+    "get_orders_events": PRIORITY_BULK,
+    "get_stop_orders_events": PRIORITY_BULK,
+    "get_trades": PRIORITY_BULK,
+    "get_report": PRIORITY_BULK,
+    "get_daily_cumulative_performance": PRIORITY_BULK,
+    "get_daily_drawdown": PRIORITY_BULK,
+    "get_financial_transactions": PRIORITY_BULK
+}
+
+
+##############################################################################
+### SmarttTokenBucket class - allows bursts of up to "burst" requests, refilled
+### at "rate" requests per second
+class SmarttTokenBucket(object):
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.tokens = self.burst
+        self.last_update = time.time()
+
+    def refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last_update) * self.rate)
+        self.last_update = now
+
+    # Seconds until a token is available (0 if there is one already)
+    def delay(self, now):
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self.refill(now)
+        self.tokens -= 1
+
+##############################################################################
+
+
+##############################################################################
+### SmarttRequestScheduler class - decides which of the threads waiting to use
+### a client connection goes next: requests are served by priority class
+### (order entry, then reads, then bulk history), round robin across callers
+### within the same class (each caller in FIFO order) and subject to the
+### optional per function rate limits; callers are identified by thread,
+### unless a name is set with setCaller
+class SmarttRequestScheduler(object):
+
+    def __init__(self, priorities=None):
+        self.priorities = dict(functionPriorities)
+        self.priorities.update(priorities or {})
+
+        self.condition = threading.Condition()
+        self.busy = False
+        self.buckets = {}
+        self.local = threading.local()
+        self.ticket_counter = itertools.count()
+        # Per priority class, the callers with waiting requests (in round
+        # robin order) and their requests
+        self.queues = dict((priority, collections.OrderedDict())
+                           for priority in PRIORITIES)
+
+    ##########################################################################
+    ### Configuration ###
+    #####################
+    def setRateLimit(self, functionName, rate, burst=None):
+        with self.condition:
+            if rate is None:
+                self.buckets.pop(functionName, None)
+            else:
+                self.buckets[functionName] = SmarttTokenBucket(rate, burst)
+            self.condition.notify_all()
+
+    def setPriority(self, functionName, priority):
+        if priority not in PRIORITIES:
+            raise ValueError("Invalid priority: " + str(priority))
+        self.priorities[functionName] = priority
+
+    # Names the caller of the requests made from the current thread, for
+    # fair queuing (e.g. the same name for all the threads of a strategy)
+    def setCaller(self, caller):
+        self.local.caller = caller
+    ##########################################################################
+
+    ##########################################################################
+    ### Scheduling ###
+    ##################
+
+    ### Blocks until it's the turn of a request of the given function
+    def acquire(self, functionName):
+        priority = self.priorities.get(functionName, PRIORITY_READ)
+        caller = getattr(self.local, "caller", None)
+        if caller is None:
+            caller = threading.current_thread().ident
+        ticket = (next(self.ticket_counter), functionName)
+
+        with self.condition:
+            queue = self.queues[priority].setdefault(caller,
+                                                     collections.deque())
+            queue.append(ticket)
+            # The new request may change the selection of the waiting ones
+            self.condition.notify_all()
+
+            try:
+                while True:
+                    if not self.busy:
+                        (selected, delay) = self.selectNext()
+                        if selected == ticket:
+                            break
+                    else:
+                        delay = None
+                    self.condition.wait(delay)
+            except BaseException:
+                self.removeTicket(priority, caller, ticket)
+                self.condition.notify_all()
+                raise
+
+            self.busy = True
+            self.removeTicket(priority, caller, ticket)
+            # Next time, this caller goes to the end of the round robin
+            if caller in self.queues[priority]:
+                self.queues[priority][caller] = \
+                    self.queues[priority].pop(caller)
+            if functionName in self.buckets:
+                self.buckets[functionName].consume(time.time())
+
+    ### Charges another request of the given function to the current turn
+    ### (e.g. sent in the same window of a pipeline), if its rate limit
+    ### allows it now; returns whether it does
+    def charge(self, functionName):
+        with self.condition:
+            bucket = self.buckets.get(functionName)
+            if bucket is None:
+                return True
+            now = time.time()
+            if bucket.delay(now) > 0:
+                return False
+            bucket.consume(now)
+            return True
+
+    ### Frees the connection for the next request
+    def release(self):
+        with self.condition:
+            self.busy = False
+            self.condition.notify_all()
+    ##########################################################################
+
+    ##########################################################################
+    ### Helper functions - expect the condition lock to be held ###
+    ###############################################################
+
+    # Returns the next request to be served (or None, if all the waiting
+    # ones are rate limited) and the time to wait for a rate limit to expire
+    def selectNext(self):
+        now = time.time()
+        delay = None
+        for priority in PRIORITIES:
+            for queue in self.queues[priority].values():
+                ticket = queue[0]
+                bucket = self.buckets.get(ticket[1])
+                ticket_delay = bucket.delay(now) if bucket else 0.0
+                if ticket_delay == 0:
+                    return (ticket, None)
+                if delay is None or ticket_delay < delay:
+                    delay = ticket_delay
+        return (None, delay)
+
+    def removeTicket(self, priority, caller, ticket):
+        queue = self.queues[priority].get(caller)
+        if queue is None:
+            return
+        queue.remove(ticket)
+        if not queue:
+            del self.queues[priority][caller]
+    ##########################################################################
+
+##############################################################################
@@ -0,0 +1,238 @@
+
+# Standard library imports
+import collections
+import itertools
+import threading
+
+# Local imports
+from .smartt_simple_protocol import decodeToken
+
+
+# Formats of the list responses: a dict per row, a row object per row (a
+# named tuple, indexed and with an attribute per column) or a dict with a
+# list per column
+FORMAT_DICTS = "dicts"
+FORMAT_ROWS = "rows"
+FORMAT_COLUMNS = "columns"
+RESPONSE_FORMATS = [FORMAT_DICTS, FORMAT_ROWS, FORMAT_COLUMNS]
+
+
+# Compiles the source of a row builder, a function build(values, transcode)
+def compileBuilder(name, source, namespace):
+    exec(compile(source, "<smartt row builder %s>" % name, "exec"), namespace)
+    return namespace["build"]
+
+
+# Returns a row (a dict) with its values decoded, whatever the decoding
+# policy of the client (see SmarttSimpleProtocol.DECODE_POLICIES)
+def decodeRow(row):
+    for value in row.values():
+        if isinstance(value, bytes):
+            return dict((name, decodeToken(value))
+                        for (name, value) in row.items())
+    return row
+
+
+# Whether a result is a list response in the columns format (a dict of
+# lists), rather than a single row (a dict of values)
+def isColumns(result):
+    return (isinstance(result, dict) and bool(result) and
+            all(isinstance(values, list) for values in result.values()))
+
+
+# Generates the rows of a list response in any of the formats (or lazy) as
+# dicts of decoded values - for code which must work whatever the client
+# format and decoding policy are
+def iterDicts(result):
+    if isinstance(result, dict):
+        rows = (dict(zip(result, values)) for values in zip(*result.values()))
+    else:
+        rows = (row if isinstance(row, dict) else row._asdict()
+                for row in result)
+    return map(decodeRow, rows)
+
+
+# Same as iterDicts, as a list
+def asDicts(result):
+    return list(iterDicts(result))
+
+
+##############################################################################
+### SmarttSchema class - the shape of the responses of a function for one
+### projection (attributes, in the response order), with the row builders
+### of each format generated and compiled when first used: the flat list of
+### values is grouped into rows by zip (instead of slicing each row) and
+### each row is built by an expression naming all the attributes, with only
+### the text attributes transcoded (see SmarttClient.textAttributes)
+class SmarttSchema(object):
+
+    def __init__(self, functionName, attributes, textAttributes=()):
+        self.function_name = functionName
+        self.attributes = tuple(attributes)
+        self.size = len(self.attributes)
+        self.text_attributes = frozenset(attribute for attribute in
+                                         self.attributes
+                                         if attribute in textAttributes)
+        self.row_class = None
+        self.builders = {}
+
+    ### Row objects class - a named tuple of the attributes
+    def rowClass(self):
+        if self.row_class is None:
+            name = (self.function_name[:1].upper() + self.function_name[1:]
+                    if self.function_name else "Smartt") + "Row"
+            self.row_class = collections.namedtuple(name, self.attributes,
+                                                    rename=True)
+        return self.row_class
+
+    ### Builds the rows of a response (the values of all the rows, in
+    ### order) in the given format; transcode, if given, is applied to the
+    ### text attributes; lazy returns an iterator of the rows (except for
+    ### the columns format)
+    def build(self, values, responseFormat=FORMAT_DICTS, transcode=None,
+              lazy=False):
+        if not self.text_attributes:
+            transcode = None
+        builder = self.builder(responseFormat, transcode is not None, lazy)
+
+        remainder = len(values) % self.size if self.size else 0
+        if remainder == 0 or responseFormat == FORMAT_COLUMNS:
+            return builder(values, transcode)
+
+        # A truncated last row is kept, with the attributes received
+        complete = len(values) - remainder
+        rows = builder(values[:complete], transcode)
+        last = self.partialRow(values[complete:], responseFormat, transcode)
+        return itertools.chain(rows, [last]) if lazy else rows + [last]
+
+    ### Builds the rows of a response received as a stream of tokens (see
+    ### SmarttClient.streamMessage) as an iterator, in the dicts or rows
+    ### format; a truncated last row is dropped
+    def stream(self, tokens, responseFormat=FORMAT_DICTS, transcode=None):
+        if responseFormat == FORMAT_COLUMNS:
+            raise ValueError("Streamed responses can't be built as columns")
+        if not self.text_attributes:
+            transcode = None
+        return self.builder(responseFormat, transcode is not None,
+                            True)(iter(tokens), transcode)
+
+    def partialRow(self, values, responseFormat, transcode):
+        row = dict(zip(self.attributes, values))
+        if transcode is not None:
+            for attribute in self.text_attributes:
+                if attribute in row:
+                    row[attribute] = transcode(row[attribute])
+        if responseFormat == FORMAT_ROWS:
+            return self.rowClass()(*[row.get(attribute)
+                                     for attribute in self.attributes])
+        return row
+
+    def builder(self, responseFormat, transcoded, lazy):
+        key = (responseFormat, transcoded, lazy)
+        builder = self.builders.get(key)
+        if builder is None:
+            if responseFormat not in RESPONSE_FORMATS:
+                raise ValueError("Invalid response format: " +
+                                 str(responseFormat))
+            builder = compileBuilder(
+                "%s %s" % (self.function_name, ",".join(self.attributes)),
+                self.builderSource(responseFormat, transcoded, lazy),
+                {"make": self.rowClass()._make
+                 if responseFormat == FORMAT_ROWS else None})
+            self.builders[key] = builder
+        return builder
+
+    # Source of the builder function - e.g., for a list of dicts of two
+    # attributes, the second one transcoded:
+    #     def build(values, transcode):
+    #         return [{'order_id': v0, 'description': transcode(v1)}
+    #                 for (v0, v1,) in zip(*[iter(values)] * 2)]
+    def builderSource(self, responseFormat, transcoded, lazy):
+        def value(index):
+            if transcoded and self.attributes[index] in self.text_attributes:
+                return "transcode(v%d)" % index
+            return "v%d" % index
+
+        indexes = range(self.size)
+        if responseFormat == FORMAT_COLUMNS:
+            columns = []
+            for index in indexes:
+                column = "values[%d::%d]" % (index, self.size)
+                if value(index) != "v%d" % index:
+                    column = "[transcode(v) for v in %s]" % column
+                columns.append("%r: %s" % (self.attributes[index], column))
+            return ("def build(values, transcode):\n"
+                    "    return {%s}\n" % ", ".join(columns))
+
+        if self.size == 0:
+            return ("def build(values, transcode):\n"
+                    "    return %s\n" % ("iter(())" if lazy else "[]"))
+
+        groups = "zip(*[iter(values)] * %d)" % self.size
+        if responseFormat == FORMAT_ROWS and not transcoded:
+            return ("def build(values, transcode):\n"
+                    "    return %s\n" % ("map(make, %s)" if lazy else
+                                          "list(map(make, %s))") % groups)
+
+        names = "(%s,)" % ", ".join("v%d" % index for index in indexes)
+        if responseFormat == FORMAT_ROWS:
+            row = "make((%s,))" % ", ".join(value(index) for index in indexes)
+        else:
+            row = "{%s}" % ", ".join("%r: %s" % (self.attributes[index],
+                                                 value(index))
+                                     for index in indexes)
+        return ("def build(values, transcode):\n"
+                "    return %s%s for %s in %s%s\n" % (
+                    "(" if lazy else "[", row, names, groups,
+                    ")" if lazy else "]"))
+
+##############################################################################
+
+
+##############################################################################
+### SmarttSchemaRegistry class - the schemas of the responses of a client
+### class, generated from its *Attributes lists (the default projections of
+### each function) and textAttributes; the schema of each projection is
+### created (and its builders compiled) only once
+class SmarttSchemaRegistry(object):
+
+    MAXIMUM_SIZE = 4096
+
+    def __init__(self, clientClass):
+        self.text_attributes = clientClass.textAttributes
+        # Function names by their attributes lists (by id, as the lists
+        # aren't hashable - the list is kept to check the identity)
+        self.functions = {}
+        for (name, value) in vars(clientClass).items():
+            if (name.endswith("Attributes") and isinstance(value, list) and
+                    callable(getattr(clientClass, name[:-10], None))):
+                self.functions[id(value)] = (value, name[:-10])
+        self.schemas = {}
+        self.lock = threading.Lock()
+
+    ### Returns the function name of one of the *Attributes lists
+    def functionName(self, defaultAttributes):
+        registered = self.functions.get(id(defaultAttributes))
+        if registered is None or registered[0] is not defaultAttributes:
+            return None
+        return registered[1]
+
+    ### Returns the function names and their default attributes
+    def functionAttributes(self):
+        return dict((name, attributes) for (attributes, name)
+                    in self.functions.values())
+
+    ### Returns the schema of a projection (attributes) of the responses of
+    ### the function with the given default attributes
+    def schema(self, attributes, defaultAttributes):
+        key = (self.functionName(defaultAttributes), tuple(attributes))
+        schema = self.schemas.get(key)
+        if schema is None:
+            schema = SmarttSchema(key[0], attributes, self.text_attributes)
+            with self.lock:
+                if len(self.schemas) >= self.MAXIMUM_SIZE:
+                    self.schemas.clear()
+                schema = self.schemas.setdefault(key, schema)
+        return schema
+
+##############################################################################
@@ -1,4 +1,7 @@
 
+# Standard library imports
+import contextlib
+
 
 # Escapes a string value according to the protocol
 def escape(value):
@@ -10,75 +13,289 @@ def unescape(value):
     return value
 
 
+# Decodes a token received with any of the decoding policies (the tokens
+# are bytes with DECODE_RAW and DECODE_TEXT_FIELDS)
+def decodeToken(value):
+    if isinstance(value, bytes):
+        return value.decode(SmarttSimpleProtocol.SERVER_ENCODING)
+    return value
+
+
+##############################################################################
+### SmarttLazyTokens class - the tokens of a message received with the
+### DECODE_LAZY policy: a read-only sequence of the raw tokens which decodes
+### each one only when it's accessed (slices are decoded lists)
+class SmarttLazyTokens(object):
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [token.decode(SmarttSimpleProtocol.SERVER_ENCODING)
+                    for token in self.tokens[index]]
+        return self.tokens[index].decode(SmarttSimpleProtocol.SERVER_ENCODING)
+
+    def __iter__(self):
+        for token in self.tokens:
+            yield token.decode(SmarttSimpleProtocol.SERVER_ENCODING)
+
+    def __repr__(self):
+        return "SmarttLazyTokens(%r)" % list(self)
+
+##############################################################################
+
+
 ##############################################################################
 ### SmarttSimpleProtocol - handles the Smartt simplest protocol, using any
 ### source and destination for writing and receiving the data
 class SmarttSimpleProtocol(object):
     # Protocol specific characters
-    SEPARATOR_CHAR = ";"
-    END_OF_MESSAGE_CHAR = "$"
-    # Encoding of string data sent by the server
+    SEPARATOR_CHAR = b";"
+    END_OF_MESSAGE_CHAR = b"$"
+    # Encoding of string data sent by the server (and of the str tokens sent
+    # to it)
     SERVER_ENCODING = "latin1"
-    # Encoding used by this client
+    # Encoding used by this client when text has to be stored as bytes
     CLIENT_ENCODING = "utf-8"
-    # Maximum number of characters read on each call of the read function
+    # Decoding policies for received messages: decode the whole message from
+    # the server encoding into str tokens, return the raw (bytes) tokens
+    # exactly as sent by the server, return raw tokens and leave it to the
+    # caller to decode only the text fields (see transcode function) or
+    # decode each token only when it's accessed (see SmarttLazyTokens)
+    DECODE_ALL = "all"
+    DECODE_RAW = "raw"
+    DECODE_TEXT_FIELDS = "text_fields"
+    DECODE_LAZY = "lazy"
+    DECODE_POLICIES = [DECODE_ALL, DECODE_RAW, DECODE_TEXT_FIELDS,
+                       DECODE_LAZY]
+    # Maximum number of bytes read on each call of the read function
     MAXIMUM_READ_SIZE = 4096
 
+    # Maximum number of frames written by each call of the vectored write
+    # function (the usual IOV_MAX of the systems)
+    MAXIMUM_WRITE_VECTORS = 1024
+
     ### Init function - just stores the read and write functions and inits
-    ### the data receiving buffer
+    ### the data receiving and sending buffers; the write function may write
+    ### only part of the data, returning how much was written (as
+    ### socket.send), or write all of it, returning None (as socket.sendall);
+    ### write_vector_function, if given, writes a list of buffers in a single
+    ### call (as socket.sendmsg) and is used to flush several messages at once
     def __init__(self, read_function, write_function,
-                 print_raw_messages=False):
+                 print_raw_messages=False, decode_policy=DECODE_ALL,
+                 write_vector_function=None):
+        if decode_policy not in self.DECODE_POLICIES:
+            raise ValueError("Invalid decode policy: " + str(decode_policy))
+
         self.read_function = read_function
         self.write_function = write_function
-        self.data_buffer = ""
+        self.write_vector_function = write_vector_function
+        self.data_buffer = bytearray()
+        # Messages queued and not flushed yet, and the buffer they are joined
+        # in when written without the vectored write function (kept between
+        # flushes, so it's only reallocated when growing)
+        self.pending_messages = []
+        self.write_buffer = bytearray()
+        # Depth of nested batch blocks - messages are only flushed at the end
+        # of the outermost one
+        self.batch_depth = 0
         self.print_raw_messages = print_raw_messages
+        self.decode_policy = decode_policy
+
+    ### Transcoding function - decodes a single token received from the
+    ### server; used by callers which receive raw tokens and only need some
+    ### of them (the text fields) decoded
+    def transcode(self, token):
+        return token.decode(self.SERVER_ENCODING)
 
-    ### Sending function - sends a message according to the protocol; just
-    ### concatenates the escaped strings using the ';' character as a
-    ### separator and '$' as the end of message character
+    ### Sending function - sends a message according to the protocol (see
+    ### queue), along with any message queued before it; inside a batch block
+    ### the message is only queued
     def send(self, message):
-        # Escape all tokens
-        escaped_message = [escape(token) for token in message]
+        self.queue(message)
+        if self.batch_depth == 0:
+            self.flush()
+
+    ### Queueing function - formats a message according to the protocol and
+    ### keeps it to be written by the next flush; just concatenates the
+    ### escaped tokens using the ';' character as a separator and '$' as the
+    ### end of message character; the tokens may be str (encoded with the
+    ### server encoding) or bytes (sent as they are); the queue is flushed by
+    ### any send, so the owner of the connection must queue and flush while
+    ### holding it (see SmarttClient.exchangeWindow)
+    def queue(self, message):
+        # Escape and encode all tokens
+        escaped_message = [escape(token) if isinstance(token, bytes)
+                           else escape(token).encode(self.SERVER_ENCODING)
+                           for token in message]
 
         # Join tokens and append end of message character
         formatted_message = (self.SEPARATOR_CHAR.join(escaped_message)
                              + self.END_OF_MESSAGE_CHAR)
 
         if self.print_raw_messages:
-            print formatted_message
+            print(formatted_message.decode(self.SERVER_ENCODING))
+
+        self.pending_messages.append(formatted_message)
+
+    ### Flushing function - writes all the queued messages, with a single
+    ### vectored write if possible, handling partial writes
+    def flush(self):
+        messages = self.pending_messages
+        if not messages:
+            return
+        self.pending_messages = []
+
+        if self.write_vector_function is not None and len(messages) > 1:
+            try:
+                self.writeVectored(messages)
+                return
+            except NotImplementedError:
+                # E.g. SSL sockets, which can't send more than one buffer at
+                # once (raised before writing anything)
+                self.write_vector_function = None
+        self.writeBuffered(messages)
+
+    ### Batch block - the messages sent inside it are written together when
+    ### it ends (e.g. a burst of orders, whose responses are received
+    ### afterwards):
+    ###     with protocol.batch():
+    ###         protocol.send(...)
+    ###         protocol.send(...)
+    @contextlib.contextmanager
+    def batch(self):
+        self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                self.flush()
+
+    # Writes the messages joined in the write buffer (or the single message),
+    # until the write function accepts all of it
+    def writeBuffered(self, messages):
+        if len(messages) == 1:
+            data = messages[0]
+        else:
+            data = self.write_buffer
+            del data[:]
+            for message in messages:
+                data += message
 
-        self.write_function(formatted_message)
+        with memoryview(data) as view:
+            size = len(view)
+            written = 0
+            while written < size:
+                with view[written:] as remaining:
+                    count = self.write_function(remaining)
+                written = size if count is None else written + count
+
+    # Writes the messages with the vectored write function, continuing from
+    # where each partial write stopped
+    def writeVectored(self, messages):
+        views = [memoryview(message) for message in messages]
+        first = 0
+        while first < len(views):
+            count = self.write_vector_function(
+                views[first:first + self.MAXIMUM_WRITE_VECTORS])
+            while count > 0:
+                if count >= len(views[first]):
+                    count -= len(views[first])
+                    first += 1
+                else:
+                    views[first] = views[first][count:]
+                    count = 0
 
     ### Receiving function - receives data until finding the termination
     ### character, then extracts the message received up until this character
     ### from the buffer, and parses it; just removes the end of message
-    ### character, splits the string at the ';' characters and unescapes the
-    ### resulting strings; this implementation only supports a escaping scheme
+    ### character, splits the bytes at the ';' characters and unescapes the
+    ### resulting tokens; this implementation only supports a escaping scheme
     ### where the end of message and token separator characters aren't present
-    ### anywhere in a escaped token string
+    ### anywhere in a escaped token; with DECODE_RAW and DECODE_TEXT_FIELDS
+    ### the tokens are returned as bytes, in the server encoding, skipping
+    ### the decoding of numeric-only messages altogether, and with
+    ### DECODE_LAZY they are decoded as they are accessed
     def receive(self):
-        # Reads data until the end of message character ('$') is found
+        # Reads data until the end of message character ('$') is found,
+        # only searching the data received since the last search
         terminator_index = self.data_buffer.find(self.END_OF_MESSAGE_CHAR)
         while terminator_index == -1:
-            self.data_buffer += self.read_function(self.MAXIMUM_READ_SIZE)
-            terminator_index = self.data_buffer.find(self.END_OF_MESSAGE_CHAR)
-
-        # Extracts the message from the buffer
-        data = self.data_buffer[:terminator_index]
-        # Truncates the buffer
-        self.data_buffer = self.data_buffer[terminator_index + 1:]
+            searched = len(self.data_buffer)
+            data = self.read_function(self.MAXIMUM_READ_SIZE)
+            if not data:
+                raise EOFError("Connection closed by the other side")
+            self.data_buffer += data
+            terminator_index = self.data_buffer.find(self.END_OF_MESSAGE_CHAR,
+                                                     searched)
 
-        # Handle data encoding
-        data = unicode(data.decode(self.SERVER_ENCODING)) \
-            .encode(self.CLIENT_ENCODING)
+        # Extracts the message from the buffer (copying it only once) and
+        # truncates the buffer
+        with memoryview(self.data_buffer) as view:
+            data = view[:terminator_index].tobytes()
+        del self.data_buffer[:terminator_index + 1]
 
         if self.print_raw_messages:
-            print data + "$"
+            print(data.decode(self.SERVER_ENCODING) + "$")
 
         if len(data) == 0:
             return []
 
+        # Handle data encoding - the whole message is decoded at once
+        separator = self.SEPARATOR_CHAR
+        if self.decode_policy == self.DECODE_ALL:
+            data = data.decode(self.SERVER_ENCODING)
+            separator = separator.decode(self.SERVER_ENCODING)
+
         # Split message, unescape tokens and return
-        return [unescape(token) for token in data.split(self.SEPARATOR_CHAR)]
+        tokens = [unescape(token) for token in data.split(separator)]
+        if self.decode_policy == self.DECODE_LAZY:
+            return SmarttLazyTokens(tokens)
+        return tokens
+
+    ### Streaming receiving function - yields the tokens of the next message
+    ### as they are received, so a big message is never kept whole in memory
+    ### (nor printed, with print_raw_messages); it must be consumed to the
+    ### end before anything else is received
+    def receiveTokens(self):
+        buffer = self.data_buffer
+        # Each token is decoded as it's yielded, so lazily as well
+        decode = self.decode_policy in (self.DECODE_ALL, self.DECODE_LAZY)
+        yielded = False
+        while True:
+            terminator_index = buffer.find(self.END_OF_MESSAGE_CHAR)
+            end = terminator_index if terminator_index != -1 else len(buffer)
+
+            # Yields the complete tokens received so far
+            separator_index = buffer.rfind(self.SEPARATOR_CHAR, 0, end)
+            if separator_index != -1:
+                with memoryview(buffer) as view:
+                    data = view[:separator_index].tobytes()
+                del buffer[:separator_index + 1]
+                for token in data.split(self.SEPARATOR_CHAR):
+                    yield unescape(token.decode(self.SERVER_ENCODING)
+                                   if decode else token)
+                yielded = True
+                terminator_index = buffer.find(self.END_OF_MESSAGE_CHAR)
+
+            # The last token (an empty message has no tokens)
+            if terminator_index != -1:
+                with memoryview(buffer) as view:
+                    token = view[:terminator_index].tobytes()
+                del buffer[:terminator_index + 1]
+                if yielded or token:
+                    yield unescape(token.decode(self.SERVER_ENCODING)
+                                   if decode else token)
+                return
+
+            data = self.read_function(self.MAXIMUM_READ_SIZE)
+            if not data:
+                raise EOFError("Connection closed by the other side")
+            buffer += data
 
 ##############################################################################
@@ -0,0 +1,58 @@
+
+# Standard library imports
+import threading
+
+
+##############################################################################
+### SmarttFlight class - a call in progress, with the threads waiting for it
+class SmarttFlight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+##############################################################################
+
+
+##############################################################################
+### SmarttSingleFlight class - makes concurrent calls with the same key share
+### a single execution: the first caller runs the function and the others
+### just wait for its result (or exception)
+class SmarttSingleFlight(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        # Number of calls which shared the result of another one
+        self.coalesced = 0
+
+    def do(self, key, function, *args):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = SmarttFlight()
+                self.flights[key] = flight
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = function(*args)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+        return flight.result
+
+##############################################################################
@@ -0,0 +1,358 @@
+
+# Standard library imports
+import io
+import json
+import mmap
+import struct
+
+# Local imports
+from .smartt_client import SmarttClient
+from .smartt_client import SmarttClientException
+from .smartt_schema import asDicts
+from .smartt_schema import isColumns
+from .smartt_simple_protocol import SmarttSimpleProtocol
+
+
+##############################################################################
+### Snapshot file layout - a fixed size preamble (magic string, format
+### version and header size), a JSON header describing the columns and then
+### each column stored contiguously, aligned to 8 bytes:
+###   - "int64" and "float64" columns: little endian 8 byte values
+###   - "string" columns: fixed width UTF-8 values, padded with null bytes
+### followed, for the columns with missing values (None), by a byte per row
+### set for the missing ones (the values are stored as 0, NaN or empty);
+### the column types are taken from the schema (see columnTypes) and the
+### column order follows the *Attributes lists of the client; the daily
+### series are stored as a row per point (see seriesAttributes)
+SNAPSHOT_MAGIC = b"SMTTSNAP"
+SNAPSHOT_VERSION = 1
+PREAMBLE_FORMAT = "<8sII"
+PREAMBLE_SIZE = struct.calcsize(PREAMBLE_FORMAT)
+ALIGNMENT = 8
+
+COLUMN_FORMATS = {
+    "int64": "<q",
+    "float64": "<d"
+}
+COLUMN_TYPES = ["int64", "float64", "string"]
+
+# Functions whose results can be exported, with their schemas
+snapshotSchemas = {
+    "getTrades": SmarttClient.getTradesAttributes,
+    "getOrders": SmarttClient.getOrdersAttributes,
+    "getDailyCumulativePerformance":
+        SmarttClient.getDailyCumulativePerformanceAttributes[:2] +
+        ["date", "daily_cumulative_performance"]
+}
+
+# Attributes holding a daily series (see smartt_analytics.parseDailySeries)
+# in the results of the exported functions - each point is exported as a
+# row, with its date and value
+seriesAttributes = {
+    "getDailyCumulativePerformance": "daily_cumulative_performance"
+}
+
+# Types of the numeric attributes of the exported functions - the others
+# (codes and ids given by the brokerages included, as "00123") are strings
+columnTypes = {
+    "order_id": "int64",
+    "brokerage_id": "int64",
+    "number_of_stocks": "int64",
+    "number_of_traded_stocks": "int64",
+    "price": "float64",
+    "financial_volume": "float64",
+    "average_nominal_price": "float64",
+    "trading_tax_cost": "float64",
+    "liquidation_tax_cost": "float64",
+    "register_tax_cost": "float64",
+    "income_tax_cost": "float64",
+    "withholding_income_tax_cost": "float64",
+    "other_taxes_cost": "float64",
+    "absolute_brokerage_tax_cost": "float64",
+    "percentual_brokerage_tax_cost": "float64",
+    "iss_tax_cost": "float64",
+    "daily_cumulative_performance": "float64"
+}
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+# Returns the (name, type) columns of a schema, whose entries are attribute
+# names (typed by columnTypes) or (name, type) pairs
+def schemaColumns(schema):
+    columns = []
+    for entry in schema:
+        if isinstance(entry, (list, tuple)):
+            (name, columnType) = entry
+        else:
+            (name, columnType) = (entry, columnTypes.get(entry, "string"))
+        if columnType not in COLUMN_TYPES:
+            raise SmarttClientException("Invalid snapshot column type: " +
+                                        str(columnType))
+        columns.append((name, columnType))
+    return columns
+
+
+# Whether a value is missing - None, or empty in a numeric column
+def isMissing(value, columnType):
+    return value is None or (columnType != "string" and
+                             value in ("", b""))
+
+
+# Splits the daily series of the rows into a row per point - the other
+# attributes are repeated, the date is stored as text
+def seriesRows(rows, attribute):
+    # Only needed here (tries to import NumPy)
+    from .smartt_analytics import parseDailySeries
+
+    points = []
+    for row in rows:
+        (dates, values) = parseDailySeries(row.get(attribute) or "")
+        for (date, value) in zip(dates, values):
+            point = dict(row)
+            point.update({"date": date.isoformat(), attribute: value})
+            points.append(point)
+    return points
+
+
+def encodeString(value):
+    if value is None:
+        return b""
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode(SmarttSimpleProtocol.CLIENT_ENCODING)
+
+
+### Writes the result of one of the functions in snapshotSchemas (a list
+### response in any format, or a single dict) to a snapshot file
+def exportSnapshot(path, functionName, result, schema=None):
+    with open(path, "wb") as snapshot_file:
+        writeSnapshot(snapshot_file, functionName, result, schema)
+
+
+### Returns the snapshot of a result as bytes (e.g. to be copied to shared
+### memory and read with SmarttSnapshot)
+def buildSnapshot(functionName, result, schema=None):
+    output = io.BytesIO()
+    writeSnapshot(output, functionName, result, schema)
+    return output.getvalue()
+
+
+### Writes the snapshot of a result to a binary file object; results of
+### other functions (e.g. computed by strategies) may be written as well,
+### given their schema (the attributes, in the columns order, as names or
+### (name, type) pairs - see schemaColumns)
+def writeSnapshot(snapshot_file, functionName, result, schema=None):
+    if schema is None:
+        if functionName not in snapshotSchemas:
+            raise SmarttClientException("Function can't be exported to a "
+                                        "snapshot: " + functionName)
+        schema = snapshotSchemas[functionName]
+    rows = ([result] if isinstance(result, dict) and not isColumns(result)
+            else asDicts(result))
+    if functionName in seriesAttributes:
+        rows = seriesRows(rows, seriesAttributes[functionName])
+
+    # Columns present in the result, in the schema order
+    present = set()
+    for row in rows:
+        present.update(row)
+
+    columns = []
+    offset = 0
+    for (attribute, columnType) in schemaColumns(schema):
+        if attribute not in present:
+            continue
+        values = [row.get(attribute) for row in rows]
+        missing = [isMissing(value, columnType) for value in values]
+        if columnType == "string":
+            values = [encodeString(value) for value in values]
+            width = max([len(value) for value in values] + [1])
+        else:
+            width = struct.calcsize(COLUMN_FORMATS[columnType])
+        column = {"name": attribute, "type": columnType, "width": width,
+                  "offset": offset, "values": values, "missing": missing}
+        offset = align(offset + width * len(rows))
+        if any(missing):
+            column["nulls_offset"] = offset
+            offset = align(offset + len(rows))
+        columns.append(column)
+
+    header = json.dumps({
+        "function": functionName,
+        "rows": len(rows),
+        "columns": [dict((key, value) for (key, value) in column.items()
+                         if key not in ("values", "missing"))
+                    for column in columns]
+    }).encode("utf-8")
+    data_start = align(PREAMBLE_SIZE + len(header))
+
+    snapshot_file.write(struct.pack(PREAMBLE_FORMAT, SNAPSHOT_MAGIC,
+                                    SNAPSHOT_VERSION, len(header)))
+    snapshot_file.write(header)
+    position = PREAMBLE_SIZE + len(header)
+
+    for column in columns:
+        start = data_start + column["offset"]
+        snapshot_file.write(b"\0" * (start - position))
+
+        if column["type"] == "string":
+            width = column["width"]
+            snapshot_file.write(b"".join(value.ljust(width, b"\0")
+                                         for value in column["values"]))
+        else:
+            convert = int if column["type"] == "int64" else float
+            empty = 0 if column["type"] == "int64" else float("nan")
+            count = len(column["values"])
+            snapshot_file.write(struct.pack(
+                "<%d%s" % (count, COLUMN_FORMATS[column["type"]][1]),
+                *[empty if missing else convert(value) for (value, missing)
+                  in zip(column["values"], column["missing"])]))
+        position = start + column["width"] * len(rows)
+
+        if "nulls_offset" in column:
+            start = data_start + column["nulls_offset"]
+            snapshot_file.write(b"\0" * (start - position))
+            snapshot_file.write(bytes(bytearray(column["missing"])))
+            position = start + len(rows)
+
+
+### Opens a snapshot file, memory mapping it
+def openSnapshot(path):
+    return SmarttSnapshot(path)
+
+
+##############################################################################
+### SmarttSnapshotColumn class - read-only sequence of the values of a column,
+### read straight from the snapshot buffer on access
+class SmarttSnapshotColumn(object):
+
+    def __init__(self, buffer, start, length, columnType, width, name,
+                 nulls_start=None):
+        self.buffer = buffer
+        self.start = start
+        self.length = length
+        self.type = columnType
+        self.width = width
+        self.name = name
+        self.format = COLUMN_FORMATS.get(columnType)
+        # Start of the missing values flags, if the column has any
+        self.nulls_start = nulls_start
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("Snapshot column index out of range")
+        if self.isNull(index):
+            return None
+
+        position = self.start + index * self.width
+        if self.format is None:
+            return bytes(self.buffer[position:position + self.width]).rstrip(
+                b"\0").decode(SmarttSimpleProtocol.CLIENT_ENCODING)
+        return struct.unpack_from(self.format, self.buffer, position)[0]
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self[index]
+
+    def isNull(self, index):
+        return (self.nulls_start is not None and
+                self.buffer[self.nulls_start + index] != 0)
+
+    # Returns a NumPy array of a numeric column sharing the snapshot memory,
+    # where the missing values are 0 (integers) or NaN (floats); NumPy is an
+    # optional dependency, only needed by this function
+    def asArray(self):
+        try:
+            import numpy
+        except ImportError:
+            raise SmarttClientException("NumPy is needed for snapshot arrays")
+
+        if self.format is None:
+            return numpy.array(list(self))
+        return numpy.frombuffer(self.buffer, dtype=self.format,
+                                count=self.length, offset=self.start)
+
+##############################################################################
+
+
+##############################################################################
+### SmarttSnapshot class - gives access to the columns of a snapshot, either
+### from a file (memory mapped, so nothing is read before being accessed) or
+### from any object supporting the buffer interface
+class SmarttSnapshot(object):
+
+    def __init__(self, source):
+        self.snapshot_file = None
+        if isinstance(source, str):
+            self.snapshot_file = open(source, "rb")
+            self.buffer = mmap.mmap(self.snapshot_file.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+        else:
+            self.buffer = source
+
+        (magic, version, header_size) = struct.unpack_from(PREAMBLE_FORMAT,
+                                                           self.buffer, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise SmarttClientException("Invalid snapshot file")
+
+        header = json.loads(bytes(
+            self.buffer[PREAMBLE_SIZE:PREAMBLE_SIZE + header_size]).decode(
+            "utf-8"))
+        data_start = align(PREAMBLE_SIZE + header_size)
+
+        self.function = header["function"]
+        self.length = header["rows"]
+        self.columns = {}
+        self.columnNames = []
+        for column in header["columns"]:
+            name = column["name"]
+            self.columnNames.append(name)
+            nulls_offset = column.get("nulls_offset")
+            self.columns[name] = SmarttSnapshotColumn(
+                self.buffer, data_start + column["offset"], self.length,
+                column["type"], column["width"], name,
+                None if nulls_offset is None else data_start + nulls_offset)
+
+    def __len__(self):
+        return self.length
+
+    def column(self, name):
+        if name not in self.columns:
+            raise SmarttClientException("Invalid snapshot column: " + name)
+        return self.columns[name]
+
+    # Builds the dict of a single row, with only the requested columns
+    def row(self, index, columnNames=None):
+        return dict((name, self.column(name)[index])
+                    for name in (columnNames or self.columnNames))
+
+    def rows(self, columnNames=None):
+        columns = [self.column(name)
+                   for name in (columnNames or self.columnNames)]
+        for index in range(self.length):
+            yield dict((column.name, column[index]) for column in columns)
+
+    def close(self):
+        if self.snapshot_file is not None:
+            self.buffer.close()
+            self.snapshot_file.close()
+            self.snapshot_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception_info):
+        self.close()
+
+##############################################################################
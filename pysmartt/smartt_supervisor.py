@@ -0,0 +1,219 @@
+
+# Standard library imports
+# (multiprocessing.shared_memory needs Python 3.8 and is only imported when
+# results are published or received)
+import multiprocessing
+import queue
+import traceback
+
+# Local imports
+from .smartt_client import SmarttClientException
+from .smartt_snapshot import SmarttSnapshot
+from .smartt_snapshot import buildSnapshot
+
+
+# Messages sent by the strategy processes to the supervisor
+MESSAGE_RESULT = "result"
+MESSAGE_ERROR = "error"
+MESSAGE_DONE = "done"
+
+
+# Entry point of the strategy processes - opens the session of the process
+# and runs the strategy, reporting errors and its end to the supervisor
+def runStrategy(name, strategy, args, client_factory, messages, stop_event):
+    try:
+        client = client_factory()
+        strategy(SmarttStrategyContext(name, client, messages, stop_event),
+                 *args)
+    except BaseException:
+        messages.put((MESSAGE_ERROR, name, traceback.format_exc()))
+    finally:
+        messages.put((MESSAGE_DONE, name))
+
+
+##############################################################################
+### SmarttStrategyContext class - what a strategy process gets from the
+### supervisor: its own client (session), the stop request and the channel
+### to publish results
+class SmarttStrategyContext(object):
+
+    def __init__(self, name, client, messages, stop_event):
+        self.name = name
+        self.client = client
+        self.messages = messages
+        self.stop_event = stop_event
+
+    def stopping(self):
+        return self.stop_event.is_set()
+
+    ### Publishes a result to the supervisor - a list of dicts (or a dict),
+    ### as returned by the client functions (or with the given schema, see
+    ### smartt_snapshot.writeSnapshot); the rows are written as a snapshot
+    ### into shared memory, and only its name goes through the queue, so
+    ### nothing is pickled
+    def publish(self, functionName, result, tag=None, schema=None):
+        from multiprocessing import shared_memory
+
+        data = buildSnapshot(functionName, result, schema)
+        memory = shared_memory.SharedMemory(create=True, size=len(data))
+        try:
+            memory.buf[:len(data)] = data
+            self.messages.put((MESSAGE_RESULT, self.name, tag, memory.name,
+                               len(data)))
+        finally:
+            # The supervisor owns (and unlinks) the memory from now on
+            memory.close()
+
+##############################################################################
+
+
+##############################################################################
+### SmarttSharedResult class - a result published by a strategy, read
+### straight from the shared memory (see SmarttSnapshot); must be closed to
+### free the memory, after releasing any array or view of its columns
+class SmarttSharedResult(object):
+
+    def __init__(self, strategy, tag, memory_name, size):
+        from multiprocessing import shared_memory
+
+        self.strategy = strategy
+        self.tag = tag
+        self.memory = shared_memory.SharedMemory(name=memory_name)
+        self.view = self.memory.buf[:size]
+        self.snapshot = SmarttSnapshot(self.view)
+
+    def close(self):
+        if self.memory is None:
+            return
+        self.snapshot = None
+        self.view.release()
+        self.memory.close()
+        self.memory.unlink()
+        self.memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception_info):
+        self.close()
+
+##############################################################################
+
+
+##############################################################################
+### SmarttSupervisor class - runs each strategy in its own process (with its
+### own session, created in the process by client_factory), so response
+### shaping and strategy logic use all the cores instead of sharing the GIL;
+### strategies are functions called as strategy(context, *args) (see
+### SmarttStrategyContext), which publish their results as shared memory
+### snapshots; strategies which fail are restarted up to max_restarts times;
+### with the "spawn" start method, strategies and client_factory must be
+### importable (module level) functions
+class SmarttSupervisor(object):
+
+    # Seconds between the checks for crashed processes while waiting
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, client_factory, max_restarts=0, start_method=None):
+        self.client_factory = client_factory
+        self.max_restarts = max_restarts
+        self.context = multiprocessing.get_context(start_method)
+        self.messages = self.context.Queue()
+        self.stop_event = self.context.Event()
+        self.strategies = {}
+        self.processes = {}
+        self.restarts = {}
+        # Last error of each strategy (a formatted traceback) and the ones
+        # whose current process failed
+        self.errors = {}
+        self.failed = set()
+
+    def addStrategy(self, name, strategy, *args):
+        if name in self.strategies:
+            raise SmarttClientException("Strategy already added: " + name)
+        self.strategies[name] = (strategy, args)
+        self.restarts[name] = 0
+
+    def start(self):
+        # The strategy processes must share the resource tracker of this
+        # process, which unlinks the shared memory (forked processes would
+        # start their own ones otherwise, which report the memory as leaked)
+        from multiprocessing import resource_tracker
+        resource_tracker.ensure_running()
+
+        for name in self.strategies:
+            self.startProcess(name)
+
+    def startProcess(self, name):
+        (strategy, args) = self.strategies[name]
+        process = self.context.Process(
+            target=runStrategy, name="smartt-strategy-" + name,
+            args=(name, strategy, args, self.client_factory, self.messages,
+                  self.stop_event))
+        process.daemon = True
+        process.start()
+        self.processes[name] = process
+
+    def running(self):
+        return [name for (name, process) in self.processes.items()
+                if process is not None]
+
+    ### Yields the results published by the strategies (as
+    ### SmarttSharedResult, which the caller must close) until all of them
+    ### end; returns earlier if nothing arrives for "timeout" seconds
+    def results(self, timeout=None):
+        waited = 0.0
+        while self.running():
+            try:
+                message = self.messages.get(timeout=self.POLL_INTERVAL)
+            except queue.Empty:
+                self.checkCrashed()
+                waited += self.POLL_INTERVAL
+                if timeout is not None and waited >= timeout:
+                    return
+                continue
+
+            waited = 0.0
+            if message[0] == MESSAGE_RESULT:
+                yield SmarttSharedResult(*message[1:])
+            elif message[0] == MESSAGE_ERROR:
+                self.errors[message[1]] = message[2]
+                self.failed.add(message[1])
+            elif message[0] == MESSAGE_DONE:
+                self.processEnded(message[1])
+
+    # Processes killed (e.g. by a signal) never send the done message - the
+    # strategy errors make runStrategy exit normally
+    def checkCrashed(self):
+        for (name, process) in list(self.processes.items()):
+            if process is not None and process.exitcode not in (None, 0):
+                self.errors[name] = ("Strategy process exited with code %d" %
+                                     process.exitcode)
+                self.failed.add(name)
+                self.processEnded(name)
+
+    def processEnded(self, name):
+        self.processes[name].join()
+        self.processes[name] = None
+        if name not in self.failed:
+            return
+        self.failed.discard(name)
+        if (not self.stop_event.is_set() and
+                self.restarts[name] < self.max_restarts):
+            self.restarts[name] += 1
+            self.startProcess(name)
+
+    ### Asks the strategies to stop (see SmarttStrategyContext.stopping) and
+    ### waits for them, freeing the results not consumed; the processes
+    ### still running after the timeout are terminated
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        for result in self.results(timeout):
+            result.close()
+        for (name, process) in self.processes.items():
+            if process is not None:
+                process.terminate()
+                process.join()
+                self.processes[name] = None
+
+##############################################################################
@@ -0,0 +1,213 @@
+
+# Standard library imports
+# (pyarrow is only imported when exporting to Parquet)
+import csv
+import datetime
+import math
+
+# Local imports
+from .smartt_client import SmarttClient
+from .smartt_client import SmarttClientException
+from .smartt_pipeline import SmarttPipeline
+from .smartt_schema import FORMAT_ROWS
+from .smartt_simple_protocol import decodeToken
+
+
+# Columns of the CSV files, as the attributes of getFinancialTransactions
+# (financial_transaction_id is ignored when importing)
+COLUMNS = SmarttClient.getFinancialTransactionsAttributes
+REQUIRED_COLUMNS = ["investment_code", "datetime",
+                    "contribution_or_withdrawal", "value"]
+
+DATETIME_FORMATS = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d"]
+
+# Accepted values of contribution_or_withdrawal (as sent to the server)
+CONTRIBUTION_OR_WITHDRAWAL = {
+    "0": 0,
+    "1": 1,
+    "contribution": 0,
+    "withdrawal": 1
+}
+
+# Column types of the Parquet files (the others are strings)
+PARQUET_TYPES = {
+    "financial_transaction_id": "int64",
+    "brokerage_id": "int64",
+    "value": "float64",
+    "operational_tax_cost": "float64"
+}
+
+# Rows written to each Parquet row group
+PARQUET_BATCH_SIZE = 65536
+
+
+def parseDatetime(value):
+    for format in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValueError("Invalid datetime: %r" % value)
+
+
+def parseDecimal(name, value):
+    number = float(value)
+    if math.isnan(number) or math.isinf(number):
+        raise ValueError("Invalid %s: %r" % (name, value))
+    return number
+
+
+### Validates a CSV row - returns the keyword arguments of
+### insertFinancialTransaction, raising ValueError if the row is invalid
+def transactionArguments(row):
+    missing = [column for column in REQUIRED_COLUMNS
+               if not (row.get(column) or "").strip()]
+    if missing:
+        raise ValueError("Missing " + ", ".join(missing))
+
+    kind = row["contribution_or_withdrawal"].strip().lower()
+    if kind not in CONTRIBUTION_OR_WITHDRAWAL:
+        raise ValueError("Invalid contribution_or_withdrawal: %r" % kind)
+    brokerage_id = (row.get("brokerage_id") or "").strip()
+    tax = (row.get("operational_tax_cost") or "").strip()
+
+    return {
+        "investmentCode": row["investment_code"].strip(),
+        "brokerageId": int(brokerage_id) if brokerage_id else None,
+        "datetime": parseDatetime(row["datetime"].strip()),
+        "contributionOrWithdrawal": CONTRIBUTION_OR_WITHDRAWAL[kind],
+        "value": parseDecimal("value", row["value"]),
+        "operationalTaxCost": parseDecimal("operational_tax_cost", tax)
+        if tax else 0.0,
+        "description": row.get("description") or None
+    }
+
+
+##############################################################################
+### Import - reads the transactions from a CSV file (with a header naming
+### the COLUMNS) as a stream, validating and inserting them pipelined, at
+### most "window" at a time; invalid rows and the ones refused by the server
+### are reported (line, row and error) to the errors CSV file object, if
+### given, and counted; returns the counts of rows, inserted and failed ones
+def importFinancialTransactions(client, source, window=32, errors=None):
+    if isinstance(source, str):
+        with open(source, newline="") as source_file:
+            return importFinancialTransactions(client, source_file, window,
+                                               errors)
+
+    reader = csv.DictReader(source)
+    errors_writer = None
+    if errors is not None:
+        errors_writer = csv.writer(errors)
+        errors_writer.writerow(["line", "error"] + COLUMNS)
+    counts = {"rows": 0, "inserted": 0, "failed": 0}
+
+    def report(line, row, error):
+        counts["failed"] += 1
+        if errors_writer is not None:
+            errors_writer.writerow([line, error] +
+                                   [row.get(column) for column in COLUMNS])
+
+    # Line and row of the calls in flight, by the id of their arguments
+    lines = {}
+
+    # Arguments of the valid rows (the invalid ones are reported as read)
+    def calls():
+        for row in reader:
+            counts["rows"] += 1
+            try:
+                arguments = transactionArguments(row)
+            except ValueError as e:
+                report(reader.line_num, row, str(e))
+                continue
+            lines[id(arguments)] = (reader.line_num, row)
+            yield arguments
+
+    pipeline = SmarttPipeline(client, window)
+    for (arguments, future) in pipeline.map("insertFinancialTransaction",
+                                            calls()):
+        (line, row) = lines.pop(id(arguments))
+        try:
+            future.result()
+            counts["inserted"] += 1
+        except SmarttClientException as e:
+            report(line, row, str(e))
+    return counts
+##############################################################################
+
+
+##############################################################################
+### Export - streams the transactions (as returned by
+### getFinancialTransactions, with the same parameters) to a CSV file or,
+### with format "parquet", to a Parquet file (requires pyarrow), never
+### keeping all of them in memory; output is a path or a file object
+### (opened in text mode for CSV, binary for Parquet); returns the number of
+### exported rows
+def exportFinancialTransactions(client, output, investmentCode=None,
+                                brokerageId=None, financialTransactionId=None,
+                                format="csv"):
+    if format not in ("csv", "parquet"):
+        raise SmarttClientException("Invalid export format: " + str(format))
+    if format == "parquet":
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SmarttClientException("Exporting to Parquet requires "
+                                        "pyarrow")
+
+    message = client.getFinancialTransactionsMessage(
+        financialTransactionId, investmentCode, brokerageId)
+    rows = client.schemas.schema(COLUMNS, COLUMNS).stream(
+        client.streamMessage(message), FORMAT_ROWS, client.textTranscoder())
+
+    if format == "csv":
+        if isinstance(output, str):
+            with open(output, "w", newline="") as output_file:
+                return writeCsv(output_file, rows)
+        return writeCsv(output, rows)
+    return writeParquet(pyarrow, pyarrow.parquet, output, rows)
+
+
+def writeCsv(output, rows):
+    writer = csv.writer(output)
+    writer.writerow(COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow([decodeToken(value) for value in row])
+        count += 1
+    return count
+
+
+def writeParquet(pyarrow, parquet, output, rows):
+    types = dict((column, getattr(pyarrow, PARQUET_TYPES.get(column,
+                                                             "string"))())
+                 for column in COLUMNS)
+    schema = pyarrow.schema([(column, types[column]) for column in COLUMNS])
+    count = 0
+    with parquet.ParquetWriter(output, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == PARQUET_BATCH_SIZE:
+                writer.write_table(parquetTable(pyarrow, schema, batch))
+                count += len(batch)
+                batch = []
+        if batch or count == 0:
+            writer.write_table(parquetTable(pyarrow, schema, batch))
+            count += len(batch)
+    return count
+
+
+def parquetTable(pyarrow, schema, rows):
+    columns = []
+    for (index, column) in enumerate(COLUMNS):
+        convert = {"int64": int, "float64": float}.get(
+            PARQUET_TYPES.get(column), decodeToken)
+        columns.append([convert(decodeToken(row[index])) if row[index] not in
+                        ("", b"", None) else None for row in rows])
+    return pyarrow.Table.from_arrays(
+        [pyarrow.array(values, type=field.type)
+         for (values, field) in zip(columns, schema)], schema=schema)
+
+##############################################################################
@@ -1,8 +1,8 @@
 import os
 import sys
 
-if sys.version_info[:2] < (2, 7) or sys.version_info[0] > 2:
-    msg = ("This software was developed for Python 2.7."
+if sys.version_info[:2] < (3, 6):
+    msg = ("This software was developed for Python 3.6 or newer."
            "We have not tested it with any other version. You are using version %s."
            "Thus, we have not tested with your version. BE CAREFUL!" % sys.version)
     sys.stderr.write(msg)
@@ -24,6 +24,7 @@ CLASSIFIERS = [
     'Intended Audience :: Investing strategies programmers',
     'Natural Language :: English',
     'Operating System :: POSIX',
+    'Programming Language :: Python :: 3',
 ]
 
 dist = setup(
@@ -34,15 +35,16 @@ dist = setup(
     author = "Felipe Machado",
     author_email = "felipe@s10i.com.br",
     packages = find_packages(),
+    python_requires = ">=3.6",
     install_requires = requires,
     tests_require = requires,
     include_package_data = True,
     zip_safe = False,
-    namespace_packages = ['pysmartt'],
     test_suite = "tests",
     entry_points = {
         'console_scripts': [
             'smartt-console = pysmartt.console:main',
+            'smartt-gateway = pysmartt.smartt_gateway:main',
         ],
     },
 )